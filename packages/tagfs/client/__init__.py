@@ -4,22 +4,117 @@
 Implementación de los clientes TagFS.
 """
 
-import random
+import os
+import copy
+import time
+import uuid
+import Queue
 import threading
+import functools
+import itertools
+import contextlib
+import collections
+import cStringIO
 
 import Zeroconf
 import Pyro.core
+import Pyro.errors
 
-from tagfs.common import ZEROCONF_SERVICE_TYPE
+from tagfs.common import ZEROCONF_SERVICE_TYPE, TRANSFER_CHUNK_SIZE, get_file_hash
 from tagfs.server import TagFSServer
+from tagfs.common.erasure import ReedSolomon
+from tagfs.common.lru import LRUCache
+from tagfs.common.ring import HashRing
+from tagfs.common.bloom import BloomFilter
+from tagfs.common.workers import WorkerPool
+from tagfs.server.datachannel import download
+
+
+# Capacity in bytes of a server with weight 1 in the hash ring. Servers
+# with a smaller capacity also have weight 1.
+RING_CAPACITY_UNIT = 16 * 1024 ** 3
+
+# Maximum number of file metadata entries kept by each client.
+INFO_CACHE_SIZE = 10000
+
+# Default number of seconds during which the cached metadata of a file is
+# returned without asking the servers.
+INFO_CACHE_TTL = 5
+
+# Seconds during which the known empty space of a server is used to place
+# files before asking the server again.
+CAPACITY_TTL = 30
+
+# Maximum number of uploads sent at the same time to each server.
+SERVER_UPLOADS = 4
+
+# Seconds during which the copies of the Bloom filters of the servers are
+# used before updating them. It is also the minimum number of seconds
+# between two forced updates.
+FILTER_REFRESH = 2
+
+# Number of threads used to call the servers in parallel.
+FANOUT_WORKERS = 16
+
+# Seconds to wait for the answers of the servers called in parallel. A
+# server that does not answer a call in time is not called in parallel
+# again during the same number of seconds.
+FANOUT_TIMEOUT = 10
+
+# Percentile of the recent read latencies after which a hedged read is
+# also sent to the next server.
+HEDGE_PERCENTILE = 95
+
+# Seconds after which a hedged read is also sent to the next server while
+# there are not enough latency samples.
+HEDGE_DELAY = 0.05
+
+# Number of threads used to send the hedged reads, separate from the ones
+# used to call the servers in parallel.
+HEDGE_WORKERS = 16
+
+# Number of recent read latencies used to compute the percentile.
+LATENCY_SAMPLES = 256
+
+
+class ResultSet(set):
+    """
+    Conjunto con los resultados combinados de los servidores. El atributo
+    C{unavailable} contiene las URI de PyRO de los servidores que no
+    respondieron a tiempo o fallaron, por lo que el resultado puede estar
+    incompleto si no es vacío.
+    """
+
+    def __init__(self, results=(), unavailable=()):
+        set.__init__(self, results)
+        self.unavailable = set(unavailable)
 
 
 class TagFSClient(object):
     """
     Clase base de los clientes de TagFS.
+
+    Las réplicas de cada archivo se ubican en los primeros servidores con
+    capacidad disponible que le corresponden a su hash en un anillo de
+    hash consistente, por lo que las lecturas comienzan por los servidores
+    que probablemente almacenan el archivo. Además, el cliente mantiene una
+    copia del filtro de Bloom de los archivos de cada servidor y sólo
+    contacta a los servidores que probablemente almacenan el archivo.
+
+    El espacio disponible en cada servidor se toma de las respuestas de los
+    servidores al almacenar archivos o al actualizar los filtros de Bloom y
+    se considera válido durante C{CAPACITY_TTL} segundos, por lo que ubicar
+    un archivo normalmente no requiere llamadas adicionales.
+
+    Los metadatos obtenidos con los métodos C{info} e C{info_many} se
+    guardan en una caché LRU durante un tiempo limitado. Los archivos que
+    añade, modifica o elimina el propio cliente se eliminan de la caché, pero
+    los cambios realizados por otros clientes pueden tardar ese tiempo en
+    observarse.
     """
     
-    def __init__(self, address, data_dir, capacity, ntp_server=None):
+    def __init__(self, address, data_dir, capacity, ntp_server=None,
+                 info_ttl=INFO_CACHE_TTL):
         """
         Inicializa una instancia de un cliente TagFS.
         
@@ -44,11 +139,19 @@ class TagFSClient(object):
             el tiempo durante el proceso de sincronización de los servidores.
             Si no se especifica este parámetro el servidor utilizará la hora
             del sistema durante la sincronización.             
+
+        @type info_ttl: C{float}
+        @param info_ttl: Segundos durante los que se utilizan los metadatos
+            de un archivo guardados en la caché. Si es C{0} no se utiliza la
+            caché.
         """
         self._address = address
         self._data_dir = data_dir
         self._capacity = capacity
         self._ntp_server = ntp_server
+        self._info_ttl = info_ttl
+        # Metadata of each file and time when it expires.
+        self._info_cache = LRUCache(INFO_CACHE_SIZE, lambda entry: 1)
         self.init_server()
         self.init_autodiscovery()
         
@@ -66,6 +169,22 @@ class TagFSClient(object):
         """
         self._servers = {}
         self._servers_mutex = threading.Lock()                
+        # Proxies used to call each server in parallel.
+        self._fanout_proxies = {}
+        # Semaphore limiting the uploads sent at the same time to each server.
+        self._upload_slots = {}
+        self._ring = HashRing()
+        # Known empty space of each server and time when it expires.
+        self._capacities = {}
+        # Epoch, sequence number and copy of the Bloom filter of each server.
+        self._filters = {}
+        self._filters_time = 0
+        self._forced_filters_time = 0
+        # Held while the filters are updated, so only one thread updates them.
+        self._filters_mutex = threading.Lock()
+        self._pool = WorkerPool(FANOUT_WORKERS)
+        self._hedge_pool = WorkerPool(HEDGE_WORKERS)
+        self._read_latencies = _LatencyTracker(LATENCY_SAMPLES)
         self.addService = self.server_added
         self.removeService = self.server_removed
         self._zeroconf = Zeroconf.Zeroconf(self._address)
@@ -79,6 +198,8 @@ class TagFSClient(object):
         self._server.stop()
         self._server_thread.join()
         self._zeroconf.close()
+        self._pool.close()
+        self._hedge_pool.close()
         
     def server_added(self, zeroconf, service_type, service_name):
         """
@@ -96,10 +217,23 @@ class TagFSClient(object):
         @param service_name: Nombre completamente calificado del nombre 
             del servicio que fue descubierto.
         """
+        pyro_uri = service_name[:-(len(service_type) + 1)]
+        pyro_proxy = Pyro.core.getProxyForURI(pyro_uri)
+        fanout_proxy = _FanOutProxy(pyro_proxy, FANOUT_TIMEOUT)
+        try:
+            capacity = fanout_proxy.call('capacity')
+        except Exception:
+            # Ignoring any exception here.
+            capacity = None
         with self._servers_mutex:
-            pyro_uri = service_name[:-(len(service_type) + 1)]
-            pyro_proxy = Pyro.core.getProxyForURI(pyro_uri)
             self._servers[pyro_uri] = pyro_proxy
+            self._fanout_proxies[pyro_uri] = fanout_proxy
+            self._upload_slots.setdefault(pyro_uri, threading.Semaphore(SERVER_UPLOADS))
+            if capacity is None:
+                self._ring.add(pyro_uri)
+            else:
+                self._ring.add(pyro_uri, max(1.0, capacity['capacity'] / float(RING_CAPACITY_UNIT)))
+                self._record_capacity(pyro_uri, capacity)
         
     def server_removed(self, zeroconf, service_type, service_name):
         """
@@ -120,8 +254,84 @@ class TagFSClient(object):
         with self._servers_mutex:
             pyro_uri = service_name[:-(len(service_type) + 1)]
             del self._servers[pyro_uri]
+            del self._fanout_proxies[pyro_uri]
+            self._upload_slots.pop(pyro_uri, None)
+            self._ring.remove(pyro_uri)
+            self._filters.pop(pyro_uri, None)
+            self._capacities.pop(pyro_uri, None)
+
+    def _record_capacity(self, pyro_uri, capacity):
+        """
+        Guarda el espacio disponible en un servidor según una respuesta del
+        servidor. Se tiene que llamar con C{self._servers_mutex} adquirido.
+
+        @type pyro_uri: C{str}
+        @param pyro_uri: URI de PyRO del servidor.
+
+        @type capacity: C{dict}
+        @param capacity: Diccionario retornado por el método C{capacity} del
+            servidor, o cualquier diccionario con la llave C{empty_space}.
+        """
+        if pyro_uri in self._servers and isinstance(capacity, dict):
+            self._capacities[pyro_uri] = (capacity['empty_space'], time.time() + CAPACITY_TTL)
+
+    def _reserve_space(self, pyro_uri, size):
+        """
+        Descuenta del espacio disponible conocido de un servidor el tamaño
+        de un archivo que se le va a enviar, hasta que el servidor responda
+        con el nuevo valor. Se tiene que llamar con C{self._servers_mutex}
+        adquirido.
+        """
+        if pyro_uri in self._capacities:
+            empty_space, expires = self._capacities[pyro_uri]
+            self._capacities[pyro_uri] = (empty_space - size, expires)
+
+    def _preferred_servers(self, file_hash, count=None):
+        """
+        Retorna los servidores que le corresponden a un archivo en el anillo
+        de hash consistente, en orden de preferencia. Se tiene que llamar
+        con C{self._servers_mutex} adquirido.
+
+        @type file_hash: C{str}
+        @param file_hash: Hash del archivo.
+
+        @type count: C{int}
+        @param count: Cantidad máxima de servidores. Si no se especifica se
+            retornan todos los servidores.
+
+        @rtype: C{list}
+        @return: Lista de tuplas con la URI de PyRO y el servidor.
+        """
+        return [(pyro_uri, self._servers[pyro_uri])
+                for pyro_uri in self._ring.nodes(file_hash, count)]
 
-    def put(self, name, description, tags, owner, group, perms, data, replication):
+    @contextlib.contextmanager
+    def _uploading(self, pyro_uris):
+        """
+        Espera a que cada servidor admita una subida más, según el límite
+        de C{SERVER_UPLOADS} subidas a la vez por servidor, y la cuenta
+        mientras se ejecuta el bloque C{with}. Los semáforos se adquieren
+        en el orden de las URI para que dos subidas no se bloqueen
+        mutuamente. No se debe llamar con C{self._servers_mutex} adquirido.
+
+        @type pyro_uris: C{list}
+        @param pyro_uris: URI de PyRO de los servidores.
+        """
+        with self._servers_mutex:
+            slots = [self._upload_slots[pyro_uri] for pyro_uri in sorted(set(pyro_uris))
+                     if pyro_uri in self._upload_slots]
+        acquired = []
+        try:
+            for slot in slots:
+                slot.acquire()
+                acquired.append(slot)
+            yield
+        finally:
+            for slot in acquired:
+                slot.release()
+
+    def put(self, name, description, tags, owner, group, perms, data, replication,
+            chained=False):
         """
         Añade un nuevo archivo al sistema de ficheros distribuido.
         
@@ -152,14 +362,28 @@ class TagFSClient(object):
         @type perms: C{int}
         @param perms: Permisos del fichero.
 
-        @type data: C{str}
-        @param data: Contenido del archivo.
+        @type data: C{str} o C{file}
+        @param data: Contenido del archivo o un objeto con un método C{read}
+            (y C{seek}) del que se leerá el contenido del archivo. El archivo
+            se envía a los servidores por partes de C{TRANSFER_CHUNK_SIZE}
+            bytes.
         
         @type replication: C{int}
         @param replication: Porciento de replicación que se debe utillizar para 
             este archivo. El cliente intentará que este archivo se almacene 
             en un número de nodos correspondiente al porciento indicado del 
             total de nodos disponibles en el momento en que se añade el archivo.
+            Los nodos son los primeros con capacidad suficiente que le
+            corresponden al archivo en el anillo de hash consistente.
+
+        @type chained: C{bool}
+        @param chained: Si es C{True} el archivo sólo se envía al primer
+            servidor, que lo reenvía al siguiente mientras lo recibe y así
+            sucesivamente, por lo que el cliente envía el contenido del
+            archivo una sola vez independientemente de la cantidad de
+            réplicas. Si falla un servidor de la cadena, los servidores que
+            le siguen no reciben el archivo y la réplica se recupera más
+            tarde. Es falso por defecto.
             
         @rtype: C{bool}
         @return: Este método retornará C{True} si el archivo se logró almacenar
@@ -168,40 +392,481 @@ class TagFSClient(object):
             no se pueda almacenar el archivo porque estos no tengan la 
             capacidad de almacenamiento necesaria. 
         """
+        if isinstance(data, basestring):
+            data = cStringIO.StringIO(data)
+        data.seek(0, os.SEEK_END)
+        size = data.tell()
+        data.seek(0)
+        # Servers where the file should be saved.
         with self._servers_mutex:
-            size = len(data)
-            
-            # Servers where the file should be saved.
             num_servers = max(1, int((replication * len(self._servers)) / 100.0))
-            servers = [server for server in self._servers.values()
-                       if (server.status()['empty_space'] >= size)]
-            servers = random.sample(servers, min(len(servers), num_servers))
-            
-            # Collect the metadata of the file.
-            info = {}
-            info['tags'] = tags
-            info['description'] = description
-            info['name'] = name
-            info['size'] = str(size)
-            info['owner'] = owner
-            info['group'] = group
-            info['perms'] = str(perms)
+        file_hash = get_file_hash(tags, name)
+        self._info_cache.discard(file_hash)
+        servers = self._select_servers(file_hash, num_servers, size)
+
+        # Collect the metadata of the file.
+        info = {}
+        info['tags'] = tags
+        info['description'] = description
+        info['name'] = name
+        info['size'] = str(size)
+        info['owner'] = owner
+        info['group'] = group
+        info['perms'] = str(perms)
+        # Number of replicas the servers try to keep for the file.
+        info['replicas'] = str(num_servers)
+
+        if chained:
+            return self._put_chained(servers, info, data)
             
-            # Save the file in each selected server.
-            saved = False
-            for server in servers:
+        # Save the file in each selected server. The content of the file
+        # is read once and each chunk is sent to every server.
+        with self._uploading([pyro_uri for pyro_uri, _ in servers]):
+            uploads = []
+            for pyro_uri, server in servers:
                 try:
-                    server.put(data, info)
+                    uploads.append((pyro_uri, server, server.open_upload(info)))
                 except Exception:
                     # Ignoring any exception here. If the server is not accesible 
                     # it will be eventually removed from the server list when is 
                     # detected by Zeroconf.
                     pass
+            chunk = data.read(TRANSFER_CHUNK_SIZE)
+            while chunk and uploads:
+                for upload in uploads[:]:
+                    _, server, upload_id = upload
+                    try:
+                        server.put_chunk(upload_id, chunk)
+                    except Exception:
+                        # Ignoring any exception here.
+                        uploads.remove(upload)
+                chunk = data.read(TRANSFER_CHUNK_SIZE)
+            saved = False
+            for pyro_uri, server, upload_id in uploads:
+                try:
+                    stored = server.commit_upload(upload_id)
+                except Exception:
+                    # Ignoring any exception here.
+                    pass
                 else:
+                    with self._servers_mutex:
+                        self._record_capacity(pyro_uri, stored.get(pyro_uri))
                     saved = True
         return saved
+
+    def _put_chained(self, servers, info, data):
+        """
+        Almacena un archivo enviándolo sólo al primer servidor de una cadena.
+        Si ese servidor falla, se vuelve a enviar el archivo al siguiente
+        servidor con el resto de la cadena. No se debe llamar con
+        C{self._servers_mutex} adquirido.
+
+        @type servers: C{list}
+        @param servers: Lista de tuplas con la URI de PyRO y el servidor,
+            como la retornada por el método C{_select_servers}.
+
+        @type info: C{dict}
+        @param info: Diccionario con los metadatos del archivo.
+
+        @type data: C{file}
+        @param data: Objeto con los métodos C{read} y C{seek} del que se lee
+            el contenido del archivo.
+
+        @rtype: C{bool}
+        @return: C{True} si el archivo se almacenó en al menos un servidor,
+            C{False} en caso contrario.
+        """
+        for index, (_, server) in enumerate(servers):
+            chain = [pyro_uri for pyro_uri, _ in servers[index + 1:]]
+            upload_id = None
+            data.seek(0)
+            try:
+                with self._uploading([servers[index][0]]):
+                    upload_id = server.open_upload(info, chain)
+                    chunk = data.read(TRANSFER_CHUNK_SIZE)
+                    while chunk:
+                        server.put_chunk(upload_id, chunk)
+                        chunk = data.read(TRANSFER_CHUNK_SIZE)
+                    stored = server.commit_upload(upload_id)
+            except Exception:
+                # Ignoring any exception here. The next server of the chain
+                # receives the file instead.
+                if upload_id is not None:
+                    try:
+                        server.abort_upload(upload_id)
+                    except Exception:
+                        # Ignoring any exception here.
+                        pass
+                continue
+            with self._servers_mutex:
+                for pyro_uri, capacity in stored.iteritems():
+                    self._record_capacity(pyro_uri, capacity)
+            return True
+        return False
+
+    def put_coded(self, name, description, tags, owner, group, perms, data,
+                  data_fragments, parity_fragments):
+        """
+        Añade un nuevo archivo al sistema de ficheros distribuido utilizando
+        un código de borrado Reed-Solomon en lugar de almacenar copias
+        completas del archivo. El archivo se divide en C{data_fragments}
+        fragmentos de datos y se le añaden C{parity_fragments} fragmentos de
+        paridad, cada uno del tamaño del archivo dividido entre
+        C{data_fragments}, y cada fragmento se almacena en un servidor
+        distinto. El archivo se puede obtener mientras estén disponibles
+        C{data_fragments} fragmentos cualesquiera.
+
+        Los argumentos C{name}, C{description}, C{tags}, C{owner}, C{group},
+        C{perms} y C{data} son los mismos del método C{put}.
+
+        @type data_fragments: C{int}
+        @param data_fragments: Cantidad de fragmentos de datos.
+
+        @type parity_fragments: C{int}
+        @param parity_fragments: Cantidad de fragmentos de paridad, es decir,
+            cantidad de servidores que pueden dejar de estar disponibles sin
+            que se pierda el archivo.
+
+        @rtype: C{bool}
+        @return: Este método retornará C{True} si se lograron almacenar al
+            menos C{data_fragments} fragmentos del archivo o C{False} en caso
+            contrario.
+        """
+        if isinstance(data, basestring):
+            data = cStringIO.StringIO(data)
+        data.seek(0, os.SEEK_END)
+        size = data.tell()
+        data.seek(0)
+        code = ReedSolomon(data_fragments, parity_fragments)
+
+        # Servers where the fragments should be saved.
+        file_hash = get_file_hash(tags, name)
+        self._info_cache.discard(file_hash)
+        servers = self._select_servers(file_hash,
+                                       data_fragments + parity_fragments,
+                                       code.piece_size(size))
+        if len(servers) < data_fragments:
+            return False
+
+        # Collect the metadata of the file. The version identifies the
+        # fragments created by this call.
+        info = {}
+        info['tags'] = tags
+        info['description'] = description
+        info['name'] = name
+        info['size'] = str(size)
+        info['owner'] = owner
+        info['group'] = group
+        info['perms'] = str(perms)
+        version = uuid.uuid4().hex
+
+        # Save a fragment in each selected server. The content of the
+        # file is read by stripes and each server receives its piece of
+        # every stripe.
+        with self._uploading([pyro_uri for pyro_uri, _ in servers]):
+            uploads = []
+            for index, (pyro_uri, server) in enumerate(servers):
+                fragment = {'index': index, 'data': data_fragments,
+                            'parity': parity_fragments, 'version': version}
+                try:
+                    upload_id = server.open_upload(dict(info, fragment=fragment))
+                    uploads.append((index, pyro_uri, server, upload_id))
+                except Exception:
+                    # Ignoring any exception here.
+                    pass
+            stripe = data.read(code.stripe_size())
+            while stripe and len(uploads) >= data_fragments:
+                pieces = code.encode(stripe)
+                for upload in uploads[:]:
+                    index, _, server, upload_id = upload
+                    try:
+                        server.put_chunk(upload_id, pieces[index])
+                    except Exception:
+                        # Ignoring any exception here.
+                        uploads.remove(upload)
+                stripe = data.read(code.stripe_size())
+            if len(uploads) < data_fragments:
+                for _, _, server, upload_id in uploads:
+                    try:
+                        server.abort_upload(upload_id)
+                    except Exception:
+                        # Ignoring any exception here.
+                        pass
+                return False
+            saved = 0
+            for _, pyro_uri, server, upload_id in uploads:
+                try:
+                    stored = server.commit_upload(upload_id)
+                except Exception:
+                    # Ignoring any exception here.
+                    pass
+                else:
+                    with self._servers_mutex:
+                        self._record_capacity(pyro_uri, stored.get(pyro_uri))
+                    saved += 1
+        return saved >= data_fragments
+
+    def _scatter(self, call, *args):
+        """
+        Llama a un método de todos los servidores en paralelo y espera sus
+        respuestas durante a lo sumo C{FANOUT_TIMEOUT} segundos. Las
+        llamadas se hacen mediante instancias de C{_FanOutProxy}, para que
+        los servidores que no responden no ocupen todos los hilos de
+        C{self._pool}. No se debe llamar con C{self._servers_mutex}
+        adquirido.
+
+        @type call: C{str}
+        @param call: Nombre del método de los servidores.
+
+        @rtype: C{tuple}
+        @return: Tupla con un diccionario con el resultado de cada servidor
+            que respondió, indexado por su URI de PyRO, y el conjunto de las
+            URI de los servidores que no respondieron a tiempo o fallaron.
+        """
+        with self._servers_mutex:
+            servers = self._fanout_proxies.items()
+        return self._fan_out(call, [(pyro_uri, server, args) for pyro_uri, server in servers])
+
+    def _fan_out(self, call, requests):
+        """
+        Llama a un método de varios servidores en paralelo, con argumentos
+        distintos para cada servidor, como se describe en el método
+        C{_scatter}. No se debe llamar con C{self._servers_mutex} adquirido.
+
+        @type call: C{str}
+        @param call: Nombre del método de los servidores.
+
+        @type requests: C{list}
+        @param requests: Lista de tuplas con la URI de PyRO, la instancia de
+            C{_FanOutProxy} y la tupla con los argumentos de cada servidor.
+
+        @rtype: C{tuple}
+        @return: Tupla como la retornada por el método C{_scatter}.
+        """
+        tasks = [(pyro_uri, self._pool.submit(server.call, call, *args))
+                 for pyro_uri, server, args in requests]
+        deadline = time.time() + FANOUT_TIMEOUT
+        results = {}
+        unavailable = set()
+        for pyro_uri, task in tasks:
+            if not task.wait(max(0, deadline - time.time())):
+                unavailable.add(pyro_uri)
+                continue
+            try:
+                results[pyro_uri] = task.result()
+            except Exception:
+                # Ignoring any exception here. If the server is not accesible
+                # it will be eventually removed from the server list when is
+                # detected by Zeroconf.
+                unavailable.add(pyro_uri)
+        return results, unavailable
+
+    def _refresh_filters(self, force=False):
+        """
+        Actualiza las copias de los filtros de Bloom de los servidores si
+        tienen más de C{FILTER_REFRESH} segundos. Cada servidor sólo envía
+        los bits que cambiaron desde la última actualización. Los servidores
+        se consultan en paralelo mediante el método C{_fan_out} y los que no
+        responden a tiempo se quedan sin filtro, por lo que siempre se
+        contactan. No se debe llamar con C{self._servers_mutex} adquirido.
+
+        @type force: C{bool}
+        @param force: Actualizar los filtros aunque no hayan pasado
+            C{FILTER_REFRESH} segundos. Aun así, los filtros se actualizan a
+            lo sumo una vez cada C{FILTER_REFRESH} segundos por esta causa.
+
+        @rtype: C{bool}
+        @return: C{True} si se actualizaron los filtros, C{False} en caso
+            contrario.
+        """
+        with self._filters_mutex:
+            now = time.time()
+            if force:
+                if now - self._forced_filters_time < FILTER_REFRESH:
+                    return False
+                self._forced_filters_time = now
+            elif now - self._filters_time < FILTER_REFRESH:
+                return False
+            with self._servers_mutex:
+                requests = [(pyro_uri, server, (self._filters.get(pyro_uri, (None, 0, None))[:2],))
+                            for pyro_uri, server in self._fanout_proxies.iteritems()]
+            results, unavailable = self._fan_out('status', requests)
+            with self._servers_mutex:
+                for pyro_uri in unavailable:
+                    # A server without a filter is always contacted.
+                    self._filters.pop(pyro_uri, None)
+                for pyro_uri, status in results.iteritems():
+                    if pyro_uri not in self._servers:
+                        continue
+                    self._record_capacity(pyro_uri, status)
+                    epoch, seq, flips, data = status['filter']
+                    if flips is None:
+                        bloom = BloomFilter(data)
+                    elif pyro_uri in self._filters:
+                        bloom = self._filters[pyro_uri][2]
+                        bloom.flip(flips)
+                    else:
+                        continue
+                    self._filters[pyro_uri] = (epoch, seq, bloom)
+            self._filters_time = time.time()
+            return True
+
+    def _may_store(self, pyro_uri, file_hash):
+        """
+        Determina, según su filtro de Bloom, si un servidor probablemente
+        almacena un archivo. Se tiene que llamar con C{self._servers_mutex}
+        adquirido.
+
+        @type pyro_uri: C{str}
+        @param pyro_uri: URI de PyRO del servidor.
+
+        @type file_hash: C{str}
+        @param file_hash: Hash del archivo.
+
+        @rtype: C{bool}
+        @return: C{False} si el servidor no almacena el archivo, C{True} si
+            probablemente lo almacena o no se tiene su filtro.
+        """
+        bloom = self._filters.get(pyro_uri, (None, 0, None))[2]
+        return bloom is None or file_hash in bloom
+
+    def _probable_servers(self, file_hash):
+        """
+        Genera los servidores que probablemente almacenan un archivo, en
+        orden de preferencia. Si se consumen todos y los filtros de Bloom no
+        se acababan de actualizar, se actualizan y se generan los servidores
+        que faltan, ya que los filtros pueden no incluir los archivos más
+        recientes. No se debe llamar con C{self._servers_mutex} adquirido.
+
+        @type file_hash: C{str}
+        @param file_hash: Hash del archivo.
+
+        @rtype: C{iterator}
+        @return: Iterador sobre tuplas con la URI de PyRO y el servidor.
+        """
+        generated = set()
+        for force in (False, True):
+            refreshed = self._refresh_filters(force)
+            with self._servers_mutex:
+                servers = [(pyro_uri, server) for pyro_uri, server
+                           in self._preferred_servers(file_hash)
+                           if (pyro_uri not in generated and
+                               self._may_store(pyro_uri, file_hash))]
+            for pyro_uri, server in servers:
+                generated.add(pyro_uri)
+                yield pyro_uri, server
+            if refreshed:
+                break
+
+    def _select_servers(self, file_hash, count, size):
+        """
+        Elige los servidores donde se debe almacenar un archivo: los
+        primeros servidores que le corresponden en el anillo de hash
+        consistente que tienen capacidad suficiente. El espacio disponible
+        de los servidores cuyo valor conocido tiene más de C{CAPACITY_TTL}
+        segundos se consulta en paralelo mediante el método C{_fan_out},
+        sin el mutex adquirido. El tamaño del archivo se descuenta del
+        espacio disponible conocido de los servidores elegidos. No se debe
+        llamar con C{self._servers_mutex} adquirido.
+
+        @type file_hash: C{str}
+        @param file_hash: Hash del archivo.
+
+        @type count: C{int}
+        @param count: Cantidad de servidores que se deben elegir.
+
+        @type size: C{int}
+        @param size: Espacio en bytes que se necesita en cada servidor.
+
+        @rtype: C{list}
+        @return: Lista con a lo sumo C{count} tuplas con la URI de PyRO y
+            el servidor.
+        """
+        now = time.time()
+        with self._servers_mutex:
+            preferred = self._preferred_servers(file_hash)
+            expired = [(pyro_uri, self._fanout_proxies[pyro_uri], ())
+                       for pyro_uri, _ in preferred
+                       if now >= self._capacities.get(pyro_uri, (None, 0))[1]]
+        if expired:
+            results, unavailable = self._fan_out('capacity', expired)
+        else:
+            results, unavailable = {}, ()
+        servers = []
+        with self._servers_mutex:
+            for pyro_uri, capacity in results.iteritems():
+                self._record_capacity(pyro_uri, capacity)
+            for pyro_uri in unavailable:
+                self._capacities.pop(pyro_uri, None)
+            for pyro_uri, server in preferred:
+                if len(servers) == count:
+                    break
+                empty_space = self._capacities.get(pyro_uri, (None, 0))[0]
+                if empty_space is not None and empty_space >= size:
+                    self._reserve_space(pyro_uri, size)
+                    servers.append((pyro_uri, server))
+        return servers
+
+    def put_many(self, files, replication):
+        """
+        Añade varios archivos al sistema de ficheros distribuido. Cada
+        servidor recibe todos los archivos que debe almacenar en una única
+        llamada. Este método está pensado para archivos pequeños; los
+        archivos grandes se deben añadir con el método C{put}.
+
+        @type files: C{list}
+        @param files: Lista de tuplas de la forma C{(name, description, tags,
+            owner, group, perms, data)} con los argumentos del método C{put}
+            para cada archivo. El contenido C{data} de cada archivo debe ser
+            de tipo C{str}.
+
+        @type replication: C{int}
+        @param replication: Porciento de replicación que se debe utillizar
+            para estos archivos.
+
+        @rtype: C{list}
+        @return: Lista con un valor C{bool} para cada archivo, en el mismo
+            orden de C{files}, que indica si el archivo se logró almacenar
+            en al menos un servidor del sistema distribuido.
+        """
+        with self._servers_mutex:
+            num_servers = max(1, int((replication * len(self._servers)) / 100.0))
+
+        # Select the servers where each file should be saved.
+        batches = {}
+        for index, (name, description, tags, owner, group, perms, data) in enumerate(files):
+            info = {}
+            info['tags'] = tags
+            info['description'] = description
+            info['name'] = name
+            info['size'] = str(len(data))
+            info['owner'] = owner
+            info['group'] = group
+            info['perms'] = str(perms)
+            info['replicas'] = str(num_servers)
+            file_hash = get_file_hash(tags, name)
+            self._info_cache.discard(file_hash)
+            servers = self._select_servers(file_hash, num_servers, len(data))
+            for pyro_uri, server in servers:
+                batches.setdefault((pyro_uri, server), []).append((index, data, info))
+
+        # Save the files in each selected server with a single call.
+        saved = [False] * len(files)
+        for (pyro_uri, server), batch in batches.iteritems():
+            try:
+                with self._uploading([pyro_uri]):
+                    capacity = server.put_many([(data, info) for _, data, info in batch])
+                with self._servers_mutex:
+                    self._record_capacity(pyro_uri, capacity)
+            except Exception:
+                # Ignoring any exception here.
+                pass
+            else:
+                for index, _, _ in batch:
+                    saved[index] = True
+        return saved
     
-    def get(self, file_hash):
+    def get(self, file_hash, hedged=False):
         """
         Obtiene el contenido del archivo identificado por C{file_hash}
         
@@ -209,6 +874,10 @@ class TagFSClient(object):
         @param file_hash: Hash del contenido del archivo cuyos datos
             se quiere obtener. Este hash identifica al archivo únicamente
             dentro del sistema de ficheros distribuidos.
+
+        @type hedged: C{bool}
+        @param hedged: Realizar una lectura con cobertura, como se describe
+            en el método C{get_chunks}.
             
         @rtype: C{str}
         @return: Contenido del archivo identificado por C{file_hash} si
@@ -216,17 +885,244 @@ class TagFSClient(object):
             sistema de ficheros distribuido un archivo identificado 
             por el hash dado.
         """
-        with self._servers_mutex:
-            for server in self._servers.itervalues():
-                try:
-                    data = server.get(file_hash)
-                    if data is not None:
-                        return data
-                except Exception:
-                    # Ignoring any exception here.
-                    pass
+        chunks = self.get_chunks(file_hash, hedged)
+        if chunks is not None:
+            return ''.join(chunks)
+        else:
+            return None
+
+    def get_chunks(self, file_hash, hedged=False):
+        """
+        Obtiene el contenido del archivo identificado por C{file_hash} en
+        partes de a lo sumo C{TRANSFER_CHUNK_SIZE} bytes. El contenido se
+        recibe por el canal de datos del servidor a medida que se consumen
+        las partes, por lo que no es necesario mantener el archivo completo
+        en memoria.
+
+        En una lectura con cobertura la lectura se envía al servidor
+        preferido y, si no se recibe la primera parte del contenido en el
+        percentil C{HEDGE_PERCENTILE} de las latencias recientes, también
+        al siguiente servidor, y así sucesivamente. Se utiliza el primer
+        servidor que responde y se cancelan las demás lecturas.
+
+        @type file_hash: C{str}
+        @param file_hash: Hash del contenido del archivo cuyos datos
+            se quiere obtener. Este hash identifica al archivo únicamente
+            dentro del sistema de ficheros distribuidos.
+
+        @type hedged: C{bool}
+        @param hedged: Realizar una lectura con cobertura.
+
+        @rtype: C{iterator}
+        @return: Iterador sobre las partes del contenido del archivo
+            identificado por C{file_hash} si este archivo existe, C{None}
+            si no hay almacenado en el sistema de ficheros distribuido un
+            archivo identificado por el hash dado.
+        """
+        if hedged:
+            return self._hedged_chunks(file_hash)
+        fragments = []
+        for _, server in self._probable_servers(file_hash):
+            try:
+                transfer = server.open_download(file_hash)
+            except Exception:
+                # Ignoring any exception here.
+                continue
+            if transfer is not None:
+                if transfer[5] is None:
+                    self._cancel_transfers(fragments)
+                    return download(*transfer[:5])
+                fragments.append((server, transfer))
+        if fragments:
+            return self._decode_fragments(fragments)
         return None
-    
+
+    def _hedged_chunks(self, file_hash):
+        """
+        Realiza una lectura con cobertura, como se describe en el método
+        C{get_chunks}, y retorna lo mismo que ese método.
+        """
+        answers = Queue.Queue()
+        # Set when a read wins, the reads that finish later cancel themselves.
+        won = threading.Event()
+        won_mutex = threading.Lock()
+        servers = self._probable_servers(file_hash)
+        delay = self._read_latencies.percentile(HEDGE_PERCENTILE, HEDGE_DELAY)
+        pending = 0
+        exhausted = False
+        deadline = None
+        fragments = []
+        while True:
+            # Each answer and each delay sends the read to the next server.
+            if not exhausted:
+                server = next(servers, None)
+                if server is not None:
+                    with self._servers_mutex:
+                        proxy = self._fanout_proxies.get(server[0])
+                    if proxy is None:
+                        # The server was removed meanwhile.
+                        continue
+                    self._hedge_pool.submit(self._hedged_read, file_hash, proxy,
+                                            answers, won, won_mutex)
+                    pending += 1
+                else:
+                    exhausted = True
+                    deadline = time.time() + FANOUT_TIMEOUT
+            if pending == 0:
+                break
+            if exhausted:
+                timeout = max(0, deadline - time.time())
+            else:
+                timeout = delay
+            try:
+                source, transfer, chunks = answers.get(timeout=timeout)
+            except Queue.Empty:
+                if exhausted:
+                    # No read answered in time. The late reads cancel
+                    # themselves and only the answers already queued are used.
+                    with won_mutex:
+                        won.set()
+                    pending = answers.qsize()
+                # Otherwise the read is taking too long, send it to the next
+                # server.
+                continue
+            pending -= 1
+            if chunks is not None:
+                self._cancel_transfers(fragments)
+                with won_mutex:
+                    won.set()
+                while True:
+                    try:
+                        self._cancel_read(*answers.get_nowait())
+                    except Queue.Empty:
+                        break
+                return chunks
+            if transfer is not None:
+                fragments.append((source, transfer))
+        if fragments:
+            return self._decode_fragments(fragments)
+        return None
+
+    def _hedged_read(self, file_hash, server, answers, won, won_mutex):
+        """
+        Envía una lectura con cobertura a un servidor mediante su instancia
+        de C{_FanOutProxy}, de modo que un servidor que no responde no
+        retiene el hilo indefinidamente. Si el servidor almacena el archivo
+        completo se espera a recibir la primera parte del contenido. El
+        resultado se pone en la cola C{answers} como una tupla con el
+        servidor, la tupla retornada por su método C{open_download} (C{None}
+        si falló o no tiene el archivo) y un iterador sobre las partes del
+        contenido (C{None} si no se recibió). Si otra lectura ya ganó, o se
+        dejó de esperar por las lecturas, indicado por el evento C{won}, que
+        se activa con C{won_mutex} adquirido, la lectura se cancela en lugar
+        de ponerla en la cola.
+        """
+        start = time.time()
+        transfer, chunks = None, None
+        try:
+            transfer = server.open_download(file_hash)
+            if transfer is not None and transfer[5] is None:
+                received = download(*transfer[:5])
+                first = next(received, None)
+                chunks = _ChainedChunks([] if first is None else [first], received)
+                self._read_latencies.add(time.time() - start)
+        except Exception:
+            # Ignoring any exception here.
+            transfer, chunks = None, None
+        with won_mutex:
+            if not won.is_set():
+                answers.put((server, transfer, chunks))
+                return
+        self._cancel_read(server, transfer, chunks)
+
+    def _cancel_read(self, server, transfer, chunks):
+        """
+        Cancela una lectura con cobertura que perdió.
+        """
+        if chunks is not None:
+            chunks.close()
+        elif transfer is not None:
+            try:
+                server.cancel_download(transfer[2])
+            except Exception:
+                # Ignoring any exception here.
+                pass
+
+    def _decode_fragments(self, transfers):
+        """
+        Elige la versión más reciente de un archivo almacenado con un código
+        de borrado que se puede reconstruir a partir de los fragmentos
+        disponibles.
+
+        Las transferencias de los fragmentos que no se utilizan se cancelan.
+
+        @type transfers: C{list}
+        @param transfers: Lista de tuplas con cada servidor que almacena un
+            fragmento y la tupla retornada por su método C{open_download}.
+
+        @rtype: C{iterator}
+        @return: Iterador sobre las partes del contenido del archivo o
+            C{None} si ninguna versión tiene suficientes fragmentos.
+        """
+        versions = {}
+        for server, transfer in transfers:
+            fragment = transfer[5]
+            versions.setdefault(fragment['version'], {})[fragment['index']] = (server, transfer)
+        latest = None
+        for version in versions.itervalues():
+            fragment = version.values()[0][1][5]
+            time = max(transfer[5]['time'] for _, transfer in version.itervalues())
+            if len(version) >= fragment['data'] and (latest is None or time > latest[0]):
+                latest = (time, version)
+        if latest is None:
+            self._cancel_transfers(transfers)
+            return None
+        version = latest[1]
+        indexes = sorted(version)[:version.values()[0][1][5]['data']]
+        used = [version[index] for index in indexes]
+        self._cancel_transfers([transfer for transfer in transfers if transfer not in used])
+        return self._iter_fragments(dict((index, version[index][1]) for index in indexes))
+
+    def _iter_fragments(self, version):
+        """
+        Reconstruye el contenido de un archivo franja por franja a partir
+        de las transferencias de C{data} fragmentos, indexadas por el
+        número del fragmento: los fragmentos de datos disponibles y, si
+        faltan, los fragmentos de paridad necesarios.
+        """
+        fragment = version.values()[0][5]
+        code = ReedSolomon(fragment['data'], fragment['parity'])
+        readers = dict((index, _ChunkReader(download(*transfer[:5])))
+                       for index, transfer in version.iteritems())
+        remaining = fragment['size']
+        while remaining > 0:
+            length = min(remaining, code.stripe_size())
+            piece_size = code.piece_size(length)
+            pieces = {}
+            for index, reader in readers.iteritems():
+                pieces[index] = reader.read(piece_size)
+                if len(pieces[index]) != piece_size:
+                    raise IOError('Fragment {0} is incomplete'.format(index))
+            yield code.decode(pieces, length)
+            remaining -= length
+
+    def _cancel_transfers(self, transfers):
+        """
+        Cancela transferencias preparadas con el método C{open_download}
+        que no se van a utilizar, para que los servidores cierren sus
+        ficheros sin esperar a que expiren.
+
+        @type transfers: C{list}
+        @param transfers: Lista de tuplas con el servidor y la tupla
+            retornada por su método C{open_download}.
+        """
+        for server, transfer in transfers:
+            try:
+                server.cancel_download(transfer[2])
+            except Exception:
+                # Ignoring any exception here.
+                pass
+
     def remove(self, file_hash):
         """
         Elimina un archivo almacenado en el sistema de ficheros distribuido.
@@ -237,14 +1133,67 @@ class TagFSClient(object):
         @param file_hash: Hash del contenido del archivo que se quiere
             eliminar. Este hash identifica al archivo únicamente
             dentro del sistema de ficheros distribuido.
+
+        @rtype: C{set}
+        @return: Conjunto con las URI de PyRO de los servidores que no
+            confirmaron la eliminación.
         """
-        with self._servers_mutex:
-            for server in self._servers.itervalues():
-                try:
-                    server.remove(file_hash)
-                except Exception:
-                    # Ignoring any exception here.
-                    pass
+        self._info_cache.discard(file_hash)
+        return self._scatter('remove', file_hash)[1]
+
+    def remove_many(self, file_hashes):
+        """
+        Elimina varios archivos almacenados en el sistema de ficheros
+        distribuido con una única llamada a cada servidor. Los hashes de
+        archivos que el sistema de ficheros no tiene almacenados se ignoran.
+
+        @type file_hashes: C{list}
+        @param file_hashes: Lista con los hashes de los archivos que se
+            quieren eliminar.
+
+        @rtype: C{set}
+        @return: Conjunto con las URI de PyRO de los servidores que no
+            confirmaron la eliminación.
+        """
+        file_hashes = list(file_hashes)
+        for file_hash in file_hashes:
+            self._info_cache.discard(file_hash)
+        return self._scatter('remove_many', file_hashes)[1]
+
+    def update_metadata(self, file_hash, name, tags, description):
+        """
+        Cambia el nombre, las etiquetas y la descripción de un archivo del
+        sistema de ficheros distribuido. Sólo se transfieren los metadatos:
+        cada servidor que almacena el archivo reutiliza el contenido que ya
+        tiene almacenado. Los servidores se llaman en paralelo; los que no
+        responden obtienen el cambio durante la sincronización.
+
+        @type file_hash: C{str}
+        @param file_hash: Hash del archivo que se quiere modificar.
+
+        @type name: C{str}
+        @param name: Nuevo nombre del archivo.
+
+        @type tags: C{set}
+        @param tags: Nuevo conjunto de tags del archivo.
+
+        @type description: C{str}
+        @param description: Nueva descripción del archivo.
+
+        @rtype: C{str}
+        @return: Nuevo hash del archivo, C{None} si no hay almacenado en el
+            sistema de ficheros distribuido un archivo identificado por el
+            hash dado.
+        """
+        new_hash = None
+        self._info_cache.discard(file_hash)
+        results, _ = self._scatter('update_metadata', file_hash, name, tags, description)
+        for server_hash in results.itervalues():
+            if server_hash is not None:
+                new_hash = server_hash
+        if new_hash is not None:
+            self._info_cache.discard(new_hash)
+        return new_hash
 
     def list(self, tags):
         """
@@ -254,20 +1203,12 @@ class TagFSClient(object):
         @type tags: C{set}
         @param tags: Conjunto de tags que deben tener los archivos.
         
-        @rtype: C{set}
+        @rtype: C{ResultSet}
         @return: Conjunto con los hash de los archivos que tienen los tags 
             especificados mediante el conjunto C{tags}.
         """
-        all_results = set()
-        with self._servers_mutex:
-            for server in self._servers.itervalues():
-                try:
-                    server_results = server.list(tags)
-                    all_results |= server_results
-                except Exception:
-                    # Ignoring any exception here.
-                    pass                    
-        return all_results
+        results, unavailable = self._scatter('list', tags)
+        return ResultSet(set().union(*results.values()), unavailable)
     
     def search(self, text):
         """
@@ -278,20 +1219,12 @@ class TagFSClient(object):
         @type text: C{str}
         @param text: Texto de la búsqueda que se quiere realizar.
         
-        @rtype: C{set}
+        @rtype: C{ResultSet}
         @return: Conjunto con los hash de los archivos que son relevantes 
             para la búsqueda de texto libre C{text}.
         """
-        all_results = set()
-        with self._servers_mutex:
-            for server in self._servers.itervalues():
-                try:
-                    server_results = server.search(text)
-                    all_results |= server_results
-                except Exception:
-                    # Ignoring any exception here.
-                    pass                    
-        return all_results
+        results, unavailable = self._scatter('search', text)
+        return ResultSet(set().union(*results.values()), unavailable)
 
     def info(self, file_hash):
         """
@@ -307,34 +1240,137 @@ class TagFSClient(object):
             de ficheros distribuido tiene almacenado un archivo identificado 
             por el hash dado, C{None} en caso contrario.
         """
-        with self._servers_mutex:
-            for server in self._servers.itervalues():
-                try:
-                    info = server.info(file_hash)
-                    if info is not None:
-                        return info
-                except Exception:
-                    # Ignoring any exception here.
-                    pass
+        info = self._cached_info(file_hash)
+        if info is not None:
+            return info
+        for _, server in self._probable_servers(file_hash):
+            try:
+                info = server.info(file_hash)
+                if info is not None:
+                    self._cache_info(file_hash, info)
+                    return info
+            except Exception:
+                # Ignoring any exception here.
+                pass
         return None
+
+    def info_many(self, file_hashes):
+        """
+        Obtiene información de varios archivos. Primero se le solicita a
+        cada servidor en una única llamada la información de los archivos
+        para los que es el primer servidor en el anillo de hash consistente
+        que probablemente los almacena y después a cada servidor la de los
+        archivos que no se han obtenido y que probablemente almacena. Las
+        llamadas de cada etapa se realizan en paralelo mediante el método
+        C{_fan_out}, sin el mutex adquirido.
+
+        @type file_hashes: C{list}
+        @param file_hashes: Lista con los hashes de los archivos cuya
+            información se quiere obtener.
+
+        @rtype: C{dict}
+        @return: Diccionario indexado por el hash de cada archivo con el
+            diccionario que retornaría el método C{info}. Los archivos que
+            el sistema de ficheros distribuido no tiene almacenados no se
+            incluyen.
+        """
+        infos = {}
+        missing = []
+        for file_hash in file_hashes:
+            info = self._cached_info(file_hash)
+            if info is not None:
+                infos[file_hash] = info
+            else:
+                missing.append(file_hash)
+        if not missing:
+            return infos
+        cached = set(infos)
+        self._refresh_filters()
+        with self._servers_mutex:
+            batches = {}
+            for file_hash in missing:
+                for pyro_uri, server in self._preferred_servers(file_hash):
+                    if self._may_store(pyro_uri, file_hash):
+                        batches.setdefault(pyro_uri, []).append(file_hash)
+                        break
+            requests = [(pyro_uri, self._fanout_proxies[pyro_uri], (batch,))
+                        for pyro_uri, batch in batches.iteritems()]
+        results, unavailable = self._fan_out('info_many', requests)
+        for result in results.itervalues():
+            infos.update(result)
+        missing = [file_hash for file_hash in missing
+                   if file_hash not in infos]
+        if missing:
+            with self._servers_mutex:
+                requests = []
+                for pyro_uri, server in self._fanout_proxies.iteritems():
+                    if pyro_uri in unavailable:
+                        continue
+                    asked = set(batches.get(pyro_uri, ()))
+                    batch = [file_hash for file_hash in missing
+                             if (file_hash not in asked and
+                                 self._may_store(pyro_uri, file_hash))]
+                    if batch:
+                        requests.append((pyro_uri, server, (batch,)))
+            results, unavailable = self._fan_out('info_many', requests)
+            for result in results.itervalues():
+                infos.update(result)
+        for file_hash, info in infos.iteritems():
+            if file_hash not in cached:
+                self._cache_info(file_hash, info)
+        return infos
+
+    def _cached_info(self, file_hash):
+        """
+        Obtiene de la caché los metadatos de un archivo, si no han expirado.
+
+        @type file_hash: C{str}
+        @param file_hash: Hash del archivo.
+
+        @rtype: C{dict}
+        @return: Copia del diccionario con los metadatos del archivo o
+            C{None} si no están en la caché.
+        """
+        entry = self._info_cache.get(file_hash)
+        if entry is None:
+            return None
+        info, expires = entry
+        if time.time() >= expires:
+            self._info_cache.discard(file_hash)
+            return None
+        return copy.deepcopy(info)
+
+    def _cache_info(self, file_hash, info):
+        """
+        Guarda en la caché los metadatos de un archivo obtenidos de un
+        servidor. Si la caché tiene metadatos sin expirar con un identificador
+        de tiempo C{time} posterior se conservan, porque el servidor puede
+        no haber recibido aún la última modificación.
+
+        @type file_hash: C{str}
+        @param file_hash: Hash del archivo.
+
+        @type info: C{dict}
+        @param info: Diccionario con los metadatos del archivo.
+        """
+        if self._info_ttl <= 0:
+            return
+        now = time.time()
+        entry = self._info_cache.get(file_hash)
+        if (entry is not None and now < entry[1] and
+                float(entry[0].get('time') or 0) > float(info.get('time') or 0)):
+            return
+        self._info_cache.put(file_hash, (copy.deepcopy(info), now + self._info_ttl))
     
     def get_all_tags(self):
         """
         Permite obtener un conjunto con todas los tags en el sistema.
         
-        @rtype: C{set}
+        @rtype: C{ResultSet}
         @return: Conjunto con los nombres de las etiquetas del sistema.
         """
-        all_results = set()
-        with self._servers_mutex:
-            for server in self._servers.itervalues():
-                try:
-                    server_results = server.get_all_tags()
-                    all_results |= server_results
-                except Exception:
-                    # Ignoring any exception here.
-                    pass
-        return all_results
+        results, unavailable = self._scatter('get_all_tags')
+        return ResultSet(set().union(*results.values()), unavailable)
 
     def get_popular_tags(self, number):
         """
@@ -343,25 +1379,137 @@ class TagFSClient(object):
         @type number: C{int}
         @param number: Cantidad de tags populares deseadas.
         
-        @rtype: C{set}
+        @rtype: C{ResultSet}
         @return: Conjunto con los nombres de las etiquetas del sistema.
         """
+        results, unavailable = self._scatter('get_popular_tags', number)
         all_results = {}
-        with self._servers_mutex:
-            for server in self._servers.itervalues():
-                try:
-                    server_results = server.get_popular_tags(number)
-                    for frequency, tag in server_results:
-                        if tag in all_results:
-                            all_results[tag].append(frequency)
-                        else:
-                            all_results[tag] = [frequency]
-                except Exception:
-                    # Ignoring any exception here.
-                    pass
+        for server_results in results.itervalues():
+            for frequency, tag in server_results:
+                if tag in all_results:
+                    all_results[tag].append(frequency)
+                else:
+                    all_results[tag] = [frequency]
         result = []
         for tag, freqs in all_results.iteritems():
             mean = (sum(freqs) / len(freqs), tag)
             result.append(mean)
         result.sort()
-        return set([tag for (_, tag) in result[:number]])
+        return ResultSet([tag for (_, tag) in result[:number]], unavailable)
+
+class _ChainedChunks(object):
+    """
+    Iterador sobre las partes de un contenido del que ya se recibieron las
+    primeras partes. Permite cerrar la conexión sin recibir el resto.
+    """
+
+    def __init__(self, received, chunks):
+        self._chunks = chunks
+        self._iterator = itertools.chain(received, chunks)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self._iterator)
+
+    def close(self):
+        """
+        Deja de recibir el contenido.
+        """
+        self._chunks.close()
+
+
+class _FanOutProxy(object):
+    """
+    Proxy de PyRO propio de las llamadas en paralelo a un servidor. Cada
+    llamada espera la respuesta durante a lo sumo C{timeout} segundos y,
+    si el servidor no responde a tiempo, las llamadas de los siguientes
+    C{timeout} segundos fallan sin contactarlo. Se puede utilizar desde
+    varios hilos a la vez y en lugar del proxy original, ya que los métodos
+    del servidor también se pueden llamar como métodos de la instancia.
+    """
+
+    def __init__(self, proxy, timeout):
+        self._proxy = copy.copy(proxy)
+        self._proxy._setTimeout(timeout)
+        self._timeout = timeout
+        self._mutex = threading.Lock()
+        # Time until which the calls fail without contacting the server.
+        self._stalled_until = 0
+
+    def call(self, name, *args):
+        """
+        Llama a un método del servidor y retorna su resultado. Lanza
+        C{Pyro.errors.TimeoutError} si el servidor no responde a tiempo.
+        """
+        with self._mutex:
+            if time.time() < self._stalled_until:
+                raise Pyro.errors.TimeoutError('server not responding')
+            try:
+                return getattr(self._proxy, name)(*args)
+            except Pyro.errors.TimeoutError:
+                # The answer may still arrive, so the connection is dropped
+                # to avoid reading it as the answer of the next call.
+                self._proxy._release()
+                self._stalled_until = time.time() + self._timeout
+                raise
+
+    def __getattr__(self, name):
+        return functools.partial(self.call, name)
+
+
+class _LatencyTracker(object):
+    """
+    Mantiene las latencias más recientes de una operación para calcular
+    sus percentiles. Se puede utilizar desde varios hilos a la vez.
+    """
+
+    def __init__(self, size):
+        self._samples = collections.deque(maxlen=size)
+        self._mutex = threading.Lock()
+
+    def add(self, latency):
+        """
+        Registra la latencia en segundos de una operación.
+        """
+        with self._mutex:
+            self._samples.append(latency)
+
+    def percentile(self, percent, default):
+        """
+        Calcula un percentil de las latencias registradas. Retorna
+        C{default} mientras se hayan registrado menos de 16 latencias.
+        """
+        with self._mutex:
+            samples = sorted(self._samples)
+        if len(samples) < 16:
+            return default
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100.0))]
+
+
+class _ChunkReader(object):
+    """
+    Permite leer una cantidad exacta de bytes de un iterador sobre las
+    partes de un contenido.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = ''
+
+    def read(self, size):
+        """
+        Lee C{size} bytes, o menos si se llegó al final del contenido.
+        """
+        parts = [self._buffer]
+        available = len(self._buffer)
+        while available < size:
+            chunk = next(self._chunks, '')
+            if not chunk:
+                break
+            parts.append(chunk)
+            available += len(chunk)
+        data = ''.join(parts)
+        self._buffer = data[size:]
+        return data[:size]
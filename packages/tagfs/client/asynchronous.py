@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+Interfaz asíncrona de los clientes TagFS.
+"""
+
+from tagfs.common.workers import WorkerPool
+
+
+# Default number of operations executed at the same time.
+ASYNC_WORKERS = 32
+
+
+class AsyncTagFSClient(object):
+    """
+    Interfaz asíncrona de un cliente TagFS. Cada método envía la operación
+    a un conjunto acotado de hilos y retorna inmediatamente una instancia de
+    C{Task}, cuyo método C{result} espera a que termine la operación y
+    retorna el mismo valor que el método correspondiente del cliente. Las
+    operaciones que exceden la cantidad de hilos esperan en una cola.
+
+    Además, el cliente TagFS admite a lo sumo C{SERVER_UPLOADS} subidas a
+    la vez por servidor, y las demás subidas a ese servidor esperan en su
+    hilo. Las operaciones comparten el mutex de los servidores del cliente
+    TagFS, que sólo se mantiene mientras se consulta o actualiza su estado,
+    nunca durante las llamadas a los servidores. Cada conexión con un
+    servidor atiende una llamada a la vez, por lo que las llamadas de
+    distintas operaciones a un mismo servidor se realizan una detrás de
+    otra; las transferencias de los contenidos de los archivos sí se
+    realizan en paralelo.
+    """
+
+    def __init__(self, client, workers=ASYNC_WORKERS):
+        """
+        Inicializa una instancia de la clase C{AsyncTagFSClient}.
+
+        @type client: C{TagFSClient}
+        @param client: Cliente TagFS que realiza las operaciones. Varias
+            instancias de esta clase pueden compartir el mismo cliente.
+
+        @type workers: C{int}
+        @param workers: Cantidad máxima de operaciones que se ejecutan a la
+            vez.
+        """
+        self._client = client
+        self._pool = WorkerPool(workers)
+
+    def close(self):
+        """
+        Espera a que terminen las operaciones enviadas y detiene los hilos.
+        No termina la ejecución del cliente TagFS.
+        """
+        self._pool.close()
+
+    def put(self, name, description, tags, owner, group, perms, data, replication,
+            chained=False):
+        """
+        Añade un nuevo archivo al sistema de ficheros distribuido. Consulte
+        la documentación del método C{put} de la clase C{TagFSClient}.
+
+        @rtype: C{Task}
+        @return: Tarea cuyo resultado es un valor C{bool}.
+        """
+        return self._pool.submit(self._client.put, name, description, tags,
+                                 owner, group, perms, data, replication, chained)
+
+    def get(self, file_hash, hedged=False):
+        """
+        Obtiene el contenido de un archivo. Consulte la documentación del
+        método C{get} de la clase C{TagFSClient}.
+
+        @rtype: C{Task}
+        @return: Tarea cuyo resultado es el contenido del archivo o C{None}.
+        """
+        return self._pool.submit(self._client.get, file_hash, hedged)
+
+    def list(self, tags):
+        """
+        Lista los archivos que tienen todos los tags especificados. Consulte
+        la documentación del método C{list} de la clase C{TagFSClient}.
+
+        @rtype: C{Task}
+        @return: Tarea cuyo resultado es una instancia de C{ResultSet}.
+        """
+        return self._pool.submit(self._client.list, tags)
+
+    def search(self, text):
+        """
+        Realiza una búsqueda de texto libre. Consulte la documentación del
+        método C{search} de la clase C{TagFSClient}.
+
+        @rtype: C{Task}
+        @return: Tarea cuyo resultado es una instancia de C{ResultSet}.
+        """
+        return self._pool.submit(self._client.search, text)
+
+    def info(self, file_hash):
+        """
+        Obtiene los metadatos de un archivo. Consulte la documentación del
+        método C{info} de la clase C{TagFSClient}.
+
+        @rtype: C{Task}
+        @return: Tarea cuyo resultado es un diccionario o C{None}.
+        """
+        return self._pool.submit(self._client.info, file_hash)
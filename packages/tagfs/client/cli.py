@@ -5,6 +5,8 @@ Implementación de un cliente TagFS para la línea de comandos.
 """
 
 import shlex
+import shutil
+import tempfile
 import textwrap
 import time
 
@@ -16,6 +18,7 @@ except ImportError:
     pass
 
 from tagfs.client import TagFSClient
+from tagfs.common import TRANSFER_CHUNK_SIZE
 from tagfs import __version__
 
 
@@ -115,13 +118,12 @@ class CLITagFSClient(TagFSClient):
             print 'Try "help cp" for more information.'
             return
         
-        # Opening the source file.
+        # Opening the source file. The source is either a local file object 
+        # or an iterator over the chunks of a remote file.
         source = None
-        local_source, local_dest = None, None
         if args[0].startswith("local:"):
             try:
-                local_source = open(args[0][6:], 'rb')
-                source = local_source.read()
+                source = open(args[0][6:], 'rb')
             except Exception:
                 print error_msg.format(command='cp', msg='Unable to access {0}'.format(args[0]))
                 return
@@ -134,7 +136,7 @@ class CLITagFSClient(TagFSClient):
 
             name = path[path.rfind('/')+1:]
             path_tags = self._get_tags(path)
-            infos = [self.info(hash) for hash in self.list(path_tags)]
+            infos = self.info_many(self.list(path_tags)).values()
             file_hash = None
             for info in infos:
                 if info['name'] == name:
@@ -144,16 +146,31 @@ class CLITagFSClient(TagFSClient):
                 print error_msg.format(command='cp', msg='Unable to access {0}'.format(args[0]))
                 return
             else:
-                source = self.get(file_hash)
+                source = self.get_chunks(file_hash)
+                if source is None:
+                    print error_msg.format(command='cp', msg='Unable to access {0}'.format(args[0]))
+                    return
         
         # Writing the source file to destination.
         if args[1].startswith("local:"):
             try:
-                local_dest = open(args[1][6:], 'wb')
-                local_dest.write(source)
+                with open(args[1][6:], 'wb') as local_dest:
+                    if isinstance(source, file):
+                        shutil.copyfileobj(source, local_dest, TRANSFER_CHUNK_SIZE)
+                    else:
+                        for chunk in source:
+                            local_dest.write(chunk)
             except Exception:
                 print error_msg.format(command='cp', msg='Unable to access {0}'.format(args[1]))
         else:
+            if not isinstance(source, file):
+                # Keep the remote file in a temporary local file while
+                # it is copied to the destination.
+                remote_source = source
+                source = tempfile.TemporaryFile()
+                for chunk in remote_source:
+                    source.write(chunk)
+                source.seek(0)
             if args[1].startswith("remote:"):
                 path = args[1][7:]
             else:
@@ -167,6 +184,8 @@ class CLITagFSClient(TagFSClient):
                 self._empty_dirs.difference_update(path_tags)
             except Exception:
                 print error_msg.format(command='cp', msg='Unable to access {0}'.format(args[1]))
+        if isinstance(source, file):
+            source.close()
                         
     def _command_rm(self, args):
         """
@@ -194,22 +213,51 @@ class CLITagFSClient(TagFSClient):
                 error = error_msg.format(command='rm', 
                                          msg='cannot remove "{0}": No such file or directory'.format(name))
         if not error:
-            infos = [self.info(hash) for hash in self.list(path_tags)]
+            infos = self.info_many(self.list(path_tags)).values()
             if not infos:
                 error = error_msg.format(command='rm', 
                                          msg='cannot remove "{0}": No such file or directory'.format(name))
         if not error:
-            removed = False
-            for info in infos:
-                if info['name'] == name:
-                    self.remove(info['hash'])
-                    removed = True
+            removed = [info['hash'] for info in infos if info['name'] == name]
+            self.remove_many(removed)
             if not removed:
                 error = error_msg.format(command='rm', 
                                          msg='cannot remove "{0}": No such file or directory'.format(name))
         if error:
             print error.format(name)
-    
+
+    def _command_mv(self, args):
+        """
+        Usage: mv source dest
+
+        Move or rename a file of the distributed filesystem. If dest ends
+        with "/" the file keeps its name. Only the metadata of the file is
+        changed, its content is not transferred.
+        """
+        error_msg = '{command}: {msg}.'
+        if (not args) or (len(args) < 2):
+            print error_msg.format(command='mv', msg='Missing operand')
+            print 'Try "help mv" for more information.'
+            return
+        source = self._get_absolute(args[0])
+        name = source[source.rfind('/')+1:]
+        infos = self.info_many(self.list(self._get_tags(source))).values()
+        infos = [info for info in infos if name and info['name'] == name]
+        if not infos:
+            print error_msg.format(command='mv',
+                                   msg='cannot move "{0}": No such file or directory'.format(args[0]))
+            return
+        dest = self._get_absolute(args[1])
+        dest_name = dest[dest.rfind('/')+1:] or name
+        dest_tags = self._get_tags(dest)
+        for info in infos:
+            if self.update_metadata(info['hash'], dest_name, dest_tags,
+                                    info['description']) is None:
+                print error_msg.format(command='mv',
+                                       msg='cannot move "{0}"'.format(args[0]))
+                return
+        self._empty_dirs.difference_update(dest_tags)
+
     def _command_cd(self, args):
         """
         Usage: cd [directory]
@@ -242,7 +290,7 @@ class CLITagFSClient(TagFSClient):
              (path_tags - all_tags).issubset(self._empty_dirs))):
             self._cwd = path
         else:
-            infos = [self.info(hash) for hash in self.list(path_tags)]
+            infos = self.info_many(self.list(path_tags)).values()
             if not infos:
                 print error_msg.format(command='cd', file=args[0], msg='Not such file or directory')
             else:
@@ -311,7 +359,7 @@ class CLITagFSClient(TagFSClient):
                 for dir in ((self._empty_dirs | all_tags) - path_tags):
                     elements[dir] = (None, True)
             else:
-                infos = [self.info(hash) for hash in self.list(path_tags)]
+                infos = self.info_many(self.list(path_tags)).values()
                 if not infos:
                     print error_msg.format(command='ls', file=path, msg='Not such file or directory')
                     return
@@ -411,7 +459,7 @@ class CLITagFSClient(TagFSClient):
                 error = error_msg.format(command='file', 
                                          msg='"{0}": No such file or directory'.format(name))
         if not error:
-            infos = [self.info(hash) for hash in self.list(path_tags)]
+            infos = self.info_many(self.list(path_tags)).values()
             if not infos:
                 error = error_msg.format(command='file', 
                                          msg='"{0}": No such file or directory'.format(name))
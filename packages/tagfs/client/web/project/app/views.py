@@ -3,7 +3,7 @@
 # Create your views here.
 
 from django.conf import settings
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, Http404
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 
@@ -50,8 +50,7 @@ def list_tags(request):
 
     files = CLIENT.list(tags)
     files_tags = set()
-    for f in files:
-        file_info = CLIENT.info(f)
+    for file_info in CLIENT.info_many(files).values():
         files_tags = files_tags.union(file_info['tags'])
     files_tags = files_tags.difference(tags)
     files_tags = list(files_tags)
@@ -95,7 +94,6 @@ def put(request):
             tags = set()
             for tag in tags_cleaned.split():
                 tags.add(tag)
-            data = data.read()
             description = not description and 'Uploaded using the web client.' or description
             replication = not replication and 25 or replication
 
@@ -134,11 +132,7 @@ def edit(request, file_hash):
             for tag in tags_cleaned.split():
                 tags.add(tag)
             description = not description and 'Uploaded using the web client.' or description
-            replication = 25
-            data = CLIENT.get(file_hash)
-
-            CLIENT.remove(file_hash)
-            save = CLIENT.put(name, description, tags, 'tagfs', 'tagfs', 775, data, replication)
+            save = CLIENT.update_metadata(file_hash, name, tags, description) is not None
 
             form = EditForm(file_info)
             return render_to_response(PUT_TEMPLATE,
@@ -163,7 +157,11 @@ def get(request, file_hash):
     Devuelve el fichero para descargar.
     """
     file_info = CLIENT.info(file_hash)
-    response = HttpResponse(CLIENT.get(file_hash), mimetype=file_info['type'])
+    chunks = CLIENT.get_chunks(file_hash)
+    if file_info is None or chunks is None:
+        raise Http404
+    response = HttpResponse(chunks, mimetype=file_info['type'])
+    response['Content-Length'] = file_info['size']
     response['Content-Disposition'] = 'attachment; filename=%s' % (file_info['name'])
     return response
 
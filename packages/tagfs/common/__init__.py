@@ -4,4 +4,29 @@
 Código común para la implementación del cliente y el servidor de TagFS.
 """
 
+import hashlib
+
 ZEROCONF_SERVICE_TYPE = '_tagfs._tcp.local.'
+
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+
+
+def get_file_hash(tags, name, encoding='utf-8'):
+    """
+    Calcula el hash que identifica a un archivo en el sistema de ficheros
+    distribuido a partir de sus etiquetas y su nombre.
+
+    @type tags: C{set}
+    @param tags: Conjunto de tags del archivo.
+
+    @type name: C{str}
+    @param name: Nombre del archivo.
+
+    @type encoding: C{str}
+    @param encoding: Codificación de las etiquetas y el nombre.
+
+    @rtype: C{str}
+    @return: Hash del archivo.
+    """
+    return hashlib.md5(u' '.join([tag.decode(encoding) for tag in tags])
+                       + name.decode(encoding)).hexdigest()
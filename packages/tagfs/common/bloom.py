@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+Filtros de Bloom utilizados por los clientes para determinar qué
+servidores probablemente almacenan un archivo.
+"""
+
+import uuid
+import hashlib
+import itertools
+import threading
+import collections
+
+
+# Number of bits of the filters.
+FILTER_BITS = 2 ** 20
+
+# Number of bits set for each key.
+FILTER_HASHES = 4
+
+# Maximum number of bit changes kept to update the filters incrementally.
+MAX_FILTER_CHANGES = 65536
+
+# Maximum value of the counters of a counting filter.
+_MAX_COUNT = 255
+
+
+def _indexes(key, bits, hashes):
+    """
+    Calcula las posiciones de los bits que le corresponden a una llave.
+    """
+    digest = long(hashlib.md5(key).hexdigest(), 16)
+    return [(digest >> (32 * i)) % bits for i in xrange(hashes)]
+
+
+class BloomFilter(object):
+    """
+    Filtro de Bloom: determina si una llave probablemente pertenece al
+    conjunto (con una pequeña probabilidad de falsos positivos) o si no
+    pertenece.
+    """
+
+    def __init__(self, data, hashes=FILTER_HASHES):
+        """
+        Inicializa una instancia de la clase C{BloomFilter}.
+
+        @type data: C{str}
+        @param data: Bits del filtro, como los retorna el método C{changes}
+            de la clase C{CountingBloomFilter}.
+
+        @type hashes: C{int}
+        @param hashes: Cantidad de bits de cada llave.
+        """
+        self._bits = bytearray(data)
+        self._hashes = hashes
+
+    def __contains__(self, key):
+        for index in _indexes(key, len(self._bits) * 8, self._hashes):
+            if not self._bits[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
+
+    def flip(self, indexes):
+        """
+        Invierte el valor de varios bits del filtro.
+
+        @type indexes: C{list}
+        @param indexes: Lista con las posiciones de los bits.
+        """
+        for index in indexes:
+            self._bits[index >> 3] ^= 1 << (index & 7)
+
+
+class CountingBloomFilter(object):
+    """
+    Filtro de Bloom con un contador por bit, que permite eliminar llaves,
+    y que registra los bits que cambian para que las copias del filtro se
+    actualicen incrementalmente. Los contadores que alcanzan su valor
+    máximo no se decrementan. Se puede utilizar desde varios hilos a la vez.
+
+    Cada instancia se identifica por una época distinta y cada cambio por
+    un número de secuencia, que sólo es válido junto con su época.
+    """
+
+    def __init__(self, bits=FILTER_BITS, hashes=FILTER_HASHES):
+        """
+        Inicializa una instancia de la clase C{CountingBloomFilter} vacía.
+
+        @type bits: C{int}
+        @param bits: Cantidad de bits del filtro, múltiplo de 8.
+
+        @type hashes: C{int}
+        @param hashes: Cantidad de bits de cada llave.
+        """
+        self.epoch = uuid.uuid4().hex
+        self._counts = bytearray(bits)
+        self._bits = bytearray(bits // 8)
+        self._hashes = hashes
+        self._changes = collections.deque(maxlen=MAX_FILTER_CHANGES)
+        self._last_seq = 0L
+        self._mutex = threading.Lock()
+
+    def _flip(self, index):
+        """
+        Invierte un bit y registra el cambio. Se tiene que llamar con el
+        mutex adquirido.
+        """
+        self._bits[index >> 3] ^= 1 << (index & 7)
+        self._changes.append(index)
+        self._last_seq += 1
+
+    def add(self, key):
+        """
+        Añade una llave al filtro.
+
+        @type key: C{str}
+        @param key: Llave.
+        """
+        with self._mutex:
+            for index in _indexes(key, len(self._counts), self._hashes):
+                count = self._counts[index]
+                if count == 0:
+                    self._flip(index)
+                if count < _MAX_COUNT:
+                    self._counts[index] = count + 1
+
+    def remove(self, key):
+        """
+        Elimina del filtro una llave añadida anteriormente.
+
+        @type key: C{str}
+        @param key: Llave.
+        """
+        with self._mutex:
+            for index in _indexes(key, len(self._counts), self._hashes):
+                count = self._counts[index]
+                if 0 < count < _MAX_COUNT:
+                    self._counts[index] = count - 1
+                    if count == 1:
+                        self._flip(index)
+
+    def changes(self, epoch, seq):
+        """
+        Obtiene los cambios del filtro posteriores a un número de secuencia
+        o, si no están disponibles, los bits del filtro.
+
+        @type epoch: C{str}
+        @param epoch: Época en la que se obtuvo el número de secuencia,
+            C{None} si no se conoce.
+
+        @type seq: C{long}
+        @param seq: Número de secuencia del último cambio conocido.
+
+        @rtype: C{tuple}
+        @return: Tupla C{(epoch, seq, flips, data)} con la época, el número
+            de secuencia del último cambio y, o bien la lista con las
+            posiciones de los bits que cambiaron (y C{data} es C{None}), o
+            bien los bits del filtro (y C{flips} es C{None}).
+        """
+        with self._mutex:
+            first_seq = self._last_seq - len(self._changes) + 1
+            if epoch == self.epoch and first_seq <= seq + 1 <= self._last_seq + 1:
+                start = int(seq + 1 - first_seq)
+                flips = list(itertools.islice(self._changes, start, None))
+                return (self.epoch, self._last_seq, flips, None)
+            return (self.epoch, self._last_seq, None, str(self._bits))
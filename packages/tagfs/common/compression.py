@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compresión del contenido de los archivos almacenados en los servidores
+TagFS.
+
+El contenido se comprime con zlib en el nivel más rápido. Sólo se comprimen
+los contenidos cuyo tipo no corresponde a un formato ya comprimido y cuyos
+primeros bytes se reducen al comprimirlos.
+"""
+
+import zlib
+
+from tagfs.common import TRANSFER_CHUNK_SIZE
+
+
+# Name of the codec used to compress the contents.
+ZLIB_CODEC = 'zlib'
+
+# Compression level used by zlib, the fastest one.
+COMPRESSION_LEVEL = 1
+
+# Maximum ratio between the compressed and the original size of a content
+# (or its header) for the compressed version to be kept.
+MAX_COMPRESSION_RATIO = 0.9
+
+# Types returned by magic.whatis for formats that are already compressed.
+COMPRESSED_TYPES = frozenset([
+    'application/compress', 'application/x-arc', 'application/x-arj',
+    'application/x-bzip', 'application/x-bzip2', 'application/x-dpkg',
+    'application/x-gzip', 'application/x-lha', 'application/x-lzh',
+    'application/x-rar', 'application/x-zoo', 'application/zip',
+    'audio/mpeg', 'image/gif', 'image/jpeg', 'image/x-jpeg-proprietary',
+    'image/x-png', 'video/flc', 'video/fli', 'video/mpeg', 'video/quicktime',
+])
+
+
+def compressible(file_type, header):
+    """
+    Determina si vale la pena comprimir un contenido.
+
+    @type file_type: C{str}
+    @param file_type: Tipo del contenido según C{magic.whatis}.
+
+    @type header: C{str}
+    @param header: Primeros bytes del contenido.
+
+    @rtype: C{bool}
+    @return: C{True} si el tipo del contenido no corresponde a un formato
+        comprimido y sus primeros bytes se reducen al comprimirlos, C{False}
+        en caso contrario.
+    """
+    if file_type in COMPRESSED_TYPES or not header:
+        return False
+    compressed = zlib.compress(header, COMPRESSION_LEVEL)
+    return len(compressed) <= len(header) * MAX_COMPRESSION_RATIO
+
+
+def compress_file(source, target):
+    """
+    Comprime el contenido de un fichero.
+
+    @type source: C{file}
+    @param source: Fichero abierto en modo binario con el contenido
+        original.
+
+    @type target: C{file}
+    @param target: Fichero abierto en modo binario donde se escribe el
+        contenido comprimido.
+    """
+    compressor = zlib.compressobj(COMPRESSION_LEVEL)
+    data = source.read(TRANSFER_CHUNK_SIZE)
+    while data:
+        target.write(compressor.compress(data))
+        data = source.read(TRANSFER_CHUNK_SIZE)
+    target.write(compressor.flush())
+
+
+def decompress_chunks(chunks):
+    """
+    Descomprime un contenido recibido por partes.
+
+    @type chunks: C{iterator}
+    @param chunks: Iterador sobre las partes del contenido comprimido.
+
+    @rtype: C{iterator}
+    @return: Iterador sobre las partes del contenido original, de a lo
+        sumo C{TRANSFER_CHUNK_SIZE} bytes.
+    """
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk, TRANSFER_CHUNK_SIZE)
+            if data:
+                yield data
+            chunk = decompressor.unconsumed_tail
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+class DecompressingReader(object):
+    """
+    Fichero de sólo lectura que descomprime a medida que se lee el
+    contenido de un fichero comprimido con la función C{compress_file}.
+    """
+
+    def __init__(self, file):
+        """
+        Inicializa una instancia de la clase C{DecompressingReader}.
+
+        @type file: C{file}
+        @param file: Fichero abierto en modo binario con el contenido
+            comprimido. Se cierra al cerrar esta instancia.
+        """
+        self._file = file
+        self._decompressor = zlib.decompressobj()
+        self._buffer = ''
+        self._position = 0L
+
+    def read(self, size=-1):
+        """
+        Lee una porción del contenido original.
+
+        @type size: C{int}
+        @param size: Cantidad máxima de bytes que se quiere leer. Si es
+            negativa se lee hasta el final del contenido.
+
+        @rtype: C{str}
+        @return: Porción del contenido original, una cadena vacía si se
+            llegó al final.
+        """
+        parts = [self._buffer]
+        available = len(self._buffer)
+        while size < 0 or available < size:
+            if self._decompressor.unconsumed_tail:
+                data = self._decompressor.unconsumed_tail
+            else:
+                data = self._file.read(TRANSFER_CHUNK_SIZE)
+                if not data:
+                    parts.append(self._decompressor.flush())
+                    available += len(parts[-1])
+                    break
+            parts.append(self._decompressor.decompress(data, TRANSFER_CHUNK_SIZE))
+            available += len(parts[-1])
+        buffer = ''.join(parts)
+        if size < 0:
+            size = len(buffer)
+        data, self._buffer = buffer[:size], buffer[size:]
+        self._position += len(data)
+        return data
+
+    def seek(self, offset):
+        """
+        Cambia la posición de lectura en el contenido original. El contenido
+        se descomprime hasta la nueva posición, por lo que los
+        desplazamientos hacia atrás vuelven a descomprimir desde el inicio.
+
+        @type offset: C{int}
+        @param offset: Nueva posición desde el inicio del contenido.
+        """
+        if offset < self._position:
+            self._file.seek(0)
+            self._decompressor = zlib.decompressobj()
+            self._buffer = ''
+            self._position = 0L
+        while self._position < offset:
+            if not self.read(min(offset - self._position, TRANSFER_CHUNK_SIZE)):
+                break
+
+    def tell(self):
+        """
+        Retorna la posición de lectura en el contenido original.
+
+        @rtype: C{long}
+        @return: Posición desde el inicio del contenido.
+        """
+        return self._position
+
+    def close(self):
+        """
+        Cierra el fichero comprimido.
+        """
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+"""
+Código de borrado Reed-Solomon sobre GF(2^8) utilizado para almacenar un
+archivo como fragmentos repartidos entre varios servidores.
+
+El contenido se divide en franjas y cada franja en C{data} porciones del
+mismo tamaño, a las que se añaden C{parity} porciones de paridad. La
+porción C{i} de cada franja se almacena en el fragmento C{i}. El código es
+sistemático (los fragmentos de datos contienen el contenido original) y
+utiliza una matriz de Cauchy para la paridad, por lo que el contenido se
+puede reconstruir a partir de cualesquiera C{data} fragmentos.
+
+Las operaciones se aplican a porciones completas: la multiplicación por una
+constante se realiza con C{str.translate} y la suma (XOR) convirtiendo las
+porciones en enteros largos.
+"""
+
+import binascii
+
+from tagfs.common import TRANSFER_CHUNK_SIZE
+
+
+# Maximum number of bytes of the original content in a stripe.
+STRIPE_SIZE = TRANSFER_CHUNK_SIZE
+
+# Primitive polynomial used to build GF(2^8).
+_PRIMITIVE_POLYNOMIAL = 0x11d
+
+_EXP = [0] * 512
+_LOG = [0] * 256
+_value = 1
+for _power in xrange(255):
+    _EXP[_power] = _value
+    _LOG[_value] = _power
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= _PRIMITIVE_POLYNOMIAL
+for _power in xrange(255, 512):
+    _EXP[_power] = _EXP[_power - 255]
+del _value, _power
+
+
+def _mul(a, b):
+    """
+    Multiplica dos elementos de GF(2^8).
+    """
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+
+def _inv(a):
+    """
+    Retorna el inverso multiplicativo de un elemento no nulo de GF(2^8).
+    """
+    return _EXP[255 - _LOG[a]]
+
+
+# Translation tables used to multiply every byte of a string by a constant.
+_MUL_TABLES = [''.join(chr(_mul(c, x)) for x in xrange(256)) for c in xrange(256)]
+
+
+def _to_long(piece):
+    return long(binascii.hexlify(piece), 16) if piece else 0L
+
+
+def _from_long(value, length):
+    return binascii.unhexlify('%0*x' % (2 * length, value)) if length else ''
+
+
+def _combine(coefficients, pieces):
+    """
+    Calcula la combinación lineal de varias porciones del mismo tamaño.
+
+    @type coefficients: C{list}
+    @param coefficients: Coeficiente de cada porción.
+
+    @type pieces: C{list}
+    @param pieces: Porciones del mismo tamaño.
+
+    @rtype: C{str}
+    @return: Porción resultante.
+    """
+    value = 0L
+    for coefficient, piece in zip(coefficients, pieces):
+        if coefficient == 1:
+            value ^= _to_long(piece)
+        elif coefficient != 0:
+            value ^= _to_long(piece.translate(_MUL_TABLES[coefficient]))
+    return _from_long(value, len(pieces[0]))
+
+
+def _invert(matrix):
+    """
+    Invierte una matriz cuadrada sobre GF(2^8) por eliminación de
+    Gauss-Jordan.
+    """
+    size = len(matrix)
+    rows = [list(row) + [int(i == j) for j in xrange(size)]
+            for i, row in enumerate(matrix)]
+    for column in xrange(size):
+        pivot = column
+        while rows[pivot][column] == 0:
+            pivot += 1
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        factor = _inv(rows[column][column])
+        rows[column] = [_mul(factor, x) for x in rows[column]]
+        for i in xrange(size):
+            if i != column and rows[i][column] != 0:
+                factor = rows[i][column]
+                rows[i] = [x ^ _mul(factor, y) for x, y in zip(rows[i], rows[column])]
+    return [row[size:] for row in rows]
+
+
+class ReedSolomon(object):
+    """
+    Código Reed-Solomon con C{data} fragmentos de datos y C{parity}
+    fragmentos de paridad.
+    """
+
+    def __init__(self, data, parity):
+        """
+        Inicializa una instancia de la clase C{ReedSolomon}.
+
+        @type data: C{int}
+        @param data: Cantidad de fragmentos de datos.
+
+        @type parity: C{int}
+        @param parity: Cantidad de fragmentos de paridad. Se toleran tantos
+            fragmentos perdidos como fragmentos de paridad.
+        """
+        if data < 1 or parity < 0 or data + parity > 256:
+            raise ValueError('Invalid number of fragments')
+        self.data = data
+        self.parity = parity
+        # Row i of the generator matrix produces the fragment i: the
+        # identity for the data fragments and a Cauchy matrix for the
+        # parity fragments, so any data rows form an invertible matrix.
+        self._rows = [[int(i == j) for j in xrange(data)] for i in xrange(data)]
+        self._rows += [[_inv((data + i) ^ j) for j in xrange(data)]
+                       for i in xrange(parity)]
+
+    def stripe_size(self):
+        """
+        Retorna la cantidad de bytes del contenido original en cada franja
+        completa.
+
+        @rtype: C{int}
+        @return: Cantidad de bytes, múltiplo de C{data}.
+        """
+        return (STRIPE_SIZE // self.data) * self.data
+
+    def piece_size(self, length):
+        """
+        Retorna el tamaño de las porciones de una franja.
+
+        @type length: C{int}
+        @param length: Cantidad de bytes del contenido original en la franja.
+
+        @rtype: C{int}
+        @return: Tamaño en bytes de cada porción.
+        """
+        return (length + self.data - 1) // self.data
+
+    def encode(self, stripe):
+        """
+        Divide una franja en porciones y calcula las porciones de paridad.
+
+        @type stripe: C{str}
+        @param stripe: Franja del contenido original, de a lo sumo
+            C{stripe_size()} bytes.
+
+        @rtype: C{list}
+        @return: Lista con la porción de cada fragmento.
+        """
+        size = self.piece_size(len(stripe))
+        stripe += '\0' * (size * self.data - len(stripe))
+        pieces = [stripe[i * size:(i + 1) * size] for i in xrange(self.data)]
+        for row in self._rows[self.data:]:
+            pieces.append(_combine(row, pieces[:self.data]))
+        return pieces
+
+    def decode(self, pieces, length):
+        """
+        Reconstruye una franja a partir de las porciones de C{data}
+        fragmentos distintos.
+
+        @type pieces: C{dict}
+        @param pieces: Diccionario con la porción de cada fragmento,
+            indexado por el número del fragmento.
+
+        @type length: C{int}
+        @param length: Cantidad de bytes del contenido original en la franja.
+
+        @rtype: C{str}
+        @return: Franja del contenido original.
+        """
+        indexes = sorted(pieces)[:self.data]
+        if len(indexes) < self.data:
+            raise ValueError('Not enough fragments to decode the stripe')
+        if indexes == range(self.data):
+            data_pieces = [pieces[i] for i in indexes]
+        else:
+            inverse = _invert([self._rows[i] for i in indexes])
+            available = [pieces[i] for i in indexes]
+            data_pieces = [_combine(row, available) for row in inverse]
+        return ''.join(data_pieces)[:length]
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+Caché con política de reemplazo LRU (el elemento utilizado hace más
+tiempo es el primero en eliminarse).
+"""
+
+import threading
+import collections
+
+
+class LRUCache(object):
+    """
+    Caché acotada por la suma de los pesos de sus elementos. Cuando se
+    sobrepasa la capacidad se eliminan los elementos utilizados hace más
+    tiempo. Se puede utilizar desde varios hilos a la vez.
+
+    Las cantidades de aciertos y fallos se mantienen en los atributos
+    C{hits} y C{misses}.
+    """
+
+    def __init__(self, capacity, weigh=len):
+        """
+        Inicializa una instancia de la clase C{LRUCache}.
+
+        @type capacity: C{int}
+        @param capacity: Suma máxima de los pesos de los elementos.
+
+        @type weigh: C{function}
+        @param weigh: Función que retorna el peso de un valor. Por defecto
+            se utiliza su longitud.
+        """
+        self.capacity = capacity
+        self.hits = 0L
+        self.misses = 0L
+        self._weigh = weigh
+        self._weight = 0
+        self._items = collections.OrderedDict()
+        self._mutex = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Obtiene el valor asociado a una llave y lo marca como el último
+        utilizado.
+
+        @param key: Llave del elemento.
+
+        @param default: Valor retornado si la llave no está en la caché.
+
+        @return: Valor asociado a la llave o C{default}.
+        """
+        with self._mutex:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Asocia un valor a una llave. El valor no se añade si su peso
+        sobrepasa la capacidad de la caché.
+
+        @param key: Llave del elemento.
+
+        @param value: Valor del elemento.
+        """
+        weight = self._weigh(value)
+        with self._mutex:
+            if key in self._items:
+                self._weight -= self._weigh(self._items.pop(key))
+            if weight > self.capacity:
+                return
+            self._items[key] = value
+            self._weight += weight
+            while self._weight > self.capacity:
+                _, evicted = self._items.popitem(last=False)
+                self._weight -= self._weigh(evicted)
+
+    def discard(self, key):
+        """
+        Elimina de la caché el elemento asociado a una llave, si existe.
+
+        @param key: Llave del elemento.
+        """
+        with self._mutex:
+            if key in self._items:
+                self._weight -= self._weigh(self._items.pop(key))
+
+    def __len__(self):
+        with self._mutex:
+            return len(self._items)
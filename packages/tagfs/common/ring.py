@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+Anillo de hash consistente utilizado para ubicar las réplicas de los
+archivos en los servidores.
+"""
+
+import bisect
+import hashlib
+
+
+# Number of virtual nodes of a node of weight 1.
+VIRTUAL_NODES = 64
+
+
+class HashRing(object):
+    """
+    Anillo de hash consistente con nodos virtuales. Cada nodo ocupa en el
+    anillo una cantidad de posiciones proporcional a su peso y una llave
+    corresponde a los nodos de las primeras posiciones que le siguen en el
+    sentido de las agujas del reloj. Al añadir o eliminar un nodo sólo
+    cambian los nodos de la parte de las llaves que le corresponden a ese
+    nodo.
+
+    La instancia no se sincroniza, se tiene que proteger con el mismo mutex
+    que la colección de nodos a partir de la que se construye.
+    """
+
+    def __init__(self):
+        """
+        Inicializa una instancia de la clase C{HashRing} sin nodos.
+        """
+        self._points = []
+        self._nodes = {}
+
+    def _position(self, key):
+        """
+        Calcula la posición en el anillo de una llave.
+        """
+        return long(hashlib.md5(key).hexdigest()[:16], 16)
+
+    def add(self, node, weight=1.0):
+        """
+        Añade un nodo al anillo. Si el nodo ya estaba en el anillo se
+        actualiza su peso.
+
+        @type node: C{str}
+        @param node: Identificador del nodo.
+
+        @type weight: C{float}
+        @param weight: Peso del nodo. Un nodo ocupa C{VIRTUAL_NODES}
+            posiciones por unidad de peso y al menos una posición.
+        """
+        self.remove(node)
+        count = max(1, int(round(VIRTUAL_NODES * weight)))
+        self._nodes[node] = count
+        for i in xrange(count):
+            bisect.insort(self._points, (self._position('{0}#{1}'.format(node, i)), node))
+
+    def remove(self, node):
+        """
+        Elimina un nodo del anillo, si existe.
+
+        @type node: C{str}
+        @param node: Identificador del nodo.
+        """
+        if self._nodes.pop(node, None) is not None:
+            self._points = [point for point in self._points if point[1] != node]
+
+    def nodes(self, key, count=None):
+        """
+        Retorna los nodos que le corresponden a una llave, en orden de
+        preferencia.
+
+        @type key: C{str}
+        @param key: Llave, por ejemplo el hash de un archivo.
+
+        @type count: C{int}
+        @param count: Cantidad máxima de nodos. Si no se especifica se
+            retornan todos los nodos del anillo.
+
+        @rtype: C{list}
+        @return: Lista de nodos distintos.
+        """
+        if count is None or count > len(self._nodes):
+            count = len(self._nodes)
+        nodes = []
+        if count == 0:
+            return nodes
+        start = bisect.bisect(self._points, (self._position(key),))
+        for i in xrange(len(self._points)):
+            node = self._points[(start + i) % len(self._points)][1]
+            if node not in nodes:
+                nodes.append(node)
+                if len(nodes) == count:
+                    break
+        return nodes
+
+    def __len__(self):
+        return len(self._nodes)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""
+Conjunto acotado de hilos que ejecutan tareas de forma concurrente.
+"""
+
+import sys
+import Queue
+import threading
+
+
+class Task(object):
+    """
+    Tarea enviada a un C{WorkerPool}. Permite esperar a que termine y
+    obtener su resultado.
+    """
+
+    def __init__(self, function, args):
+        """
+        Inicializa una instancia de la clase C{Task}.
+
+        @type function: C{callable}
+        @param function: Función que ejecuta la tarea.
+
+        @type args: C{tuple}
+        @param args: Argumentos de la función.
+        """
+        self._function = function
+        self._args = args
+        self._result = None
+        self._error = None
+        self._done = threading.Event()
+
+    def run(self):
+        """
+        Ejecuta la tarea y guarda su resultado o la excepción que lanzó.
+        """
+        try:
+            self._result = self._function(*self._args)
+        except Exception:
+            self._error = sys.exc_info()
+        finally:
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """
+        Espera a que termine la tarea.
+
+        @type timeout: C{float}
+        @param timeout: Cantidad máxima de segundos que se espera. Si no se
+            especifica se espera hasta que termine la tarea.
+
+        @rtype: C{bool}
+        @return: C{True} si la tarea terminó, C{False} en caso contrario.
+        """
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def result(self):
+        """
+        Espera a que termine la tarea y retorna su resultado. Si la tarea
+        lanzó una excepción se vuelve a lanzar.
+
+        @return: Valor retornado por la función de la tarea.
+        """
+        self._done.wait()
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._result
+
+
+class WorkerPool(object):
+    """
+    Conjunto de C{size} hilos que ejecutan las tareas enviadas en el orden
+    en que se reciben. Una tarea no debe esperar por otra tarea enviada al
+    mismo conjunto, porque todos los hilos podrían quedar bloqueados.
+    """
+
+    def __init__(self, size):
+        """
+        Inicializa una instancia de la clase C{WorkerPool} e inicia sus
+        hilos.
+
+        @type size: C{int}
+        @param size: Cantidad de hilos.
+        """
+        self._tasks = Queue.Queue()
+        self._threads = [threading.Thread(target=self._run_tasks) for _ in xrange(size)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _run_tasks(self):
+        """
+        Método ejecutado por cada hilo. Ejecuta tareas hasta recibir C{None}.
+        """
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+            task.run()
+
+    def submit(self, function, *args):
+        """
+        Envía una tarea para que la ejecute alguno de los hilos.
+
+        @type function: C{callable}
+        @param function: Función que ejecuta la tarea.
+
+        @rtype: C{Task}
+        @return: Tarea enviada.
+        """
+        task = Task(function, args)
+        self._tasks.put(task)
+        return task
+
+    def close(self):
+        """
+        Espera a que terminen las tareas enviadas y detiene los hilos.
+        """
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
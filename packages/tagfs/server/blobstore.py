@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+
+"""
+Almacén de los contenidos de los archivos de un servidor TagFS.
+"""
+
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+import cStringIO
+
+from tagfs.common.lru import LRUCache
+from tagfs.common.compression import ZLIB_CODEC, MAX_COMPRESSION_RATIO, \
+    DecompressingReader, compressible, compress_file
+
+
+# Number of bytes at the beginning of a blob kept to determine its type.
+HEADER_SIZE = 8192
+
+# Suffix of the files storing compressed blobs.
+COMPRESSED_SUFFIX = '.z'
+
+# Maximum number of bytes of the blobs kept in memory.
+BLOB_CACHE_SIZE = 64 * 1024 * 1024
+
+# Maximum size of a blob kept in memory.
+MAX_CACHED_BLOB_SIZE = 1024 * 1024
+
+
+class BlobWriter(object):
+    """
+    Escribe el contenido de un archivo en un fichero temporal antes de
+    añadirlo a un almacén, calculando el hash de su contenido.
+    """
+
+    def __init__(self, path):
+        """
+        Inicializa una instancia de la clase C{BlobWriter}.
+
+        @type path: C{str}
+        @param path: Ruta absoluta del fichero temporal.
+        """
+        self.path = path
+        self.size = 0L
+        self.header = ''
+        self._file = open(path, 'wb')
+        self._checksum = hashlib.sha1()
+
+    def write(self, data):
+        """
+        Añade una porción del contenido del archivo.
+
+        @type data: C{str}
+        @param data: Porción del contenido del archivo.
+        """
+        if len(self.header) < HEADER_SIZE:
+            self.header += data[:HEADER_SIZE - len(self.header)]
+        self._checksum.update(data)
+        self._file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        """
+        Cierra el fichero temporal.
+        """
+        self._file.close()
+
+    def discard(self):
+        """
+        Cierra y elimina el fichero temporal.
+        """
+        self._file.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def digest(self):
+        """
+        Retorna el hash del contenido escrito hasta el momento.
+
+        @rtype: C{str}
+        @return: Hash SHA-1 en hexadecimal del contenido del archivo.
+        """
+        return self._checksum.hexdigest()
+
+
+class BlobStore(object):
+    """
+    Almacén de contenidos direccionado por el hash del contenido. Un
+    contenido se almacena una única vez aunque lo compartan varios archivos
+    del sistema de ficheros distribuido.
+
+    Los contenidos de los tipos que no están comprimidos se almacenan
+    comprimidos si esto reduce su tamaño. El hash siempre corresponde al
+    contenido original, mientras que la cantidad de bytes utilizados se
+    calcula a partir del tamaño almacenado.
+
+    La cantidad de bytes utilizados por los contenidos se mantiene en un
+    registro en disco. Antes de añadir o eliminar un contenido se escribe
+    en el registro el cambio que se va a realizar, por lo que si el
+    servidor termina durante la operación el registro se corrige al crear
+    una nueva instancia comprobando si el contenido existe.
+
+    Los contenidos pequeños leídos con los métodos C{read} u
+    C{open_cached} se mantienen en memoria en el atributo C{cache}, una
+    instancia de C{LRUCache}. Un
+    contenido nunca cambia (su hash lo identifica), por lo que sólo hay que
+    sacarlo de la caché cuando se elimina del almacén.
+    """
+
+    def __init__(self, blobs_dir, uploads_dir, ledger_path, cache_size=BLOB_CACHE_SIZE):
+        """
+        Inicializa una instancia de la clase C{BlobStore}.
+
+        @type blobs_dir: C{str}
+        @param blobs_dir: Ruta absoluta al directorio donde se almacenan los
+            contenidos. Los contenidos no se almacenarán directamente en la
+            raíz de este directorio sino en un serie de directorios anidados
+            para evitar que este directorio tenga muchas entradas y se haga
+            muy lento el acceso a un contenido.
+
+        @type uploads_dir: C{str}
+        @param uploads_dir: Ruta absoluta al directorio donde se mantienen
+            los contenidos que se están recibiendo. Debe estar en el mismo
+            sistema de ficheros que C{blobs_dir}.
+
+        @type ledger_path: C{str}
+        @param ledger_path: Ruta absoluta del registro con la cantidad de
+            bytes utilizados por los contenidos.
+
+        @type cache_size: C{int}
+        @param cache_size: Cantidad máxima de bytes de los contenidos que se
+            mantienen en memoria.
+        """
+        self._blobs_dir = blobs_dir
+        if not os.path.isdir(self._blobs_dir):
+            os.mkdir(self._blobs_dir)
+        self._uploads_dir = uploads_dir
+        if os.path.isdir(self._uploads_dir):
+            # Discard the incomplete uploads of a previous execution.
+            shutil.rmtree(self._uploads_dir)
+        os.mkdir(self._uploads_dir)
+        self._pins = {}
+        self._mutex = threading.Lock()
+        self._ledger_path = ledger_path
+        self._load_ledger()
+        self.cache = LRUCache(cache_size)
+
+    def _load_ledger(self):
+        """
+        Lee del registro la cantidad de bytes utilizados por los contenidos
+        y completa las operaciones que no terminaron en una ejecución
+        anterior. Si el registro no existe se calcula recorriendo el
+        directorio de los contenidos.
+        """
+        if os.path.isfile(self._ledger_path):
+            with open(self._ledger_path, 'rb') as ledger:
+                state = json.load(ledger)
+            self._used = long(state['used'])
+            for digest, delta in state['pending'].iteritems():
+                # The operation was completed if the blob was added and it
+                # exists or if it was removed and it does not exist.
+                if self.contains(digest) == (delta > 0):
+                    self._used += delta
+        else:
+            self._used = 0L
+            for root, _, files in os.walk(self._blobs_dir):
+                for file in files:
+                    self._used += os.path.getsize(os.path.join(root, file))
+        self._write_ledger({})
+
+    def _write_ledger(self, pending):
+        """
+        Reemplaza el registro por la cantidad de bytes utilizados y las
+        operaciones en curso, y garantiza que se escriba en el disco.
+
+        @type pending: C{dict}
+        @param pending: Diccionario con la cantidad de bytes que se añaden
+            (o se eliminan, si es negativa) indexada por el hash de cada
+            contenido que se está añadiendo o eliminando.
+        """
+        temp_path = self._ledger_path + '.tmp'
+        with open(temp_path, 'wb') as ledger:
+            json.dump({'used': self._used, 'pending': pending}, ledger)
+            ledger.flush()
+            os.fsync(ledger.fileno())
+        os.rename(temp_path, self._ledger_path)
+
+    def used(self):
+        """
+        Retorna la cantidad de bytes utilizados por los contenidos
+        almacenados.
+
+        @rtype: C{long}
+        @return: Cantidad de bytes.
+        """
+        with self._mutex:
+            return self._used
+
+    def path(self, digest):
+        """
+        Retorna la ruta absoluta del fichero que almacena un contenido sin
+        comprimir. Un contenido comprimido se almacena en la misma ruta con
+        el sufijo C{COMPRESSED_SUFFIX}.
+
+        @type digest: C{str}
+        @param digest: Hash del contenido.
+
+        @rtype: C{str}
+        @return: Ruta absoluta del fichero.
+        """
+        return os.path.join(self._blobs_dir, os.path.sep.join(digest[0:5]), digest)
+
+    def _stored_path(self, digest):
+        """
+        Retorna la ruta absoluta del fichero que almacena un contenido,
+        comprimido o no, o C{None} si el contenido no está almacenado.
+        """
+        blob_path = self.path(digest)
+        if os.path.isfile(blob_path):
+            return blob_path
+        elif os.path.isfile(blob_path + COMPRESSED_SUFFIX):
+            return blob_path + COMPRESSED_SUFFIX
+        else:
+            return None
+
+    def contains(self, digest):
+        """
+        Determina si un contenido está almacenado.
+
+        @type digest: C{str}
+        @param digest: Hash del contenido.
+
+        @rtype: C{bool}
+        @return: C{True} si el contenido está almacenado, C{False} en caso
+            contrario.
+        """
+        return self._stored_path(digest) is not None
+
+    def writer(self):
+        """
+        Crea un nuevo C{BlobWriter} para recibir un contenido que luego
+        se añadirá a este almacén utilizando el método C{add}.
+
+        @rtype: C{BlobWriter}
+        @return: Instancia para escribir el nuevo contenido.
+        """
+        return BlobWriter(os.path.join(self._uploads_dir, uuid.uuid4().hex))
+
+    def pin(self, digest):
+        """
+        Impide que un contenido almacenado se elimine hasta que se llame al
+        método C{unpin}. Se utiliza para proteger un contenido referenciado
+        por un documento que aún no se ha añadido al índice.
+
+        @type digest: C{str}
+        @param digest: Hash del contenido.
+
+        @rtype: C{bool}
+        @return: C{True} si el contenido está almacenado, C{False} en caso
+            contrario (y en este caso el contenido no queda protegido).
+        """
+        with self._mutex:
+            if not self.contains(digest):
+                return False
+            self._pins[digest] = self._pins.get(digest, 0) + 1
+            return True
+
+    def unpin(self, digest):
+        """
+        Permite nuevamente eliminar un contenido protegido con el método
+        C{pin} o añadido con el método C{add}.
+
+        @type digest: C{str}
+        @param digest: Hash del contenido.
+        """
+        with self._mutex:
+            count = self._pins.get(digest, 0)
+            if count > 1:
+                self._pins[digest] = count - 1
+            else:
+                self._pins.pop(digest, None)
+
+    def add(self, writer, file_type=None):
+        """
+        Añade a este almacén el contenido escrito con un C{BlobWriter}. Si
+        el contenido ya estaba almacenado se descarta el fichero temporal.
+        El contenido queda protegido como si se hubiera llamado al método
+        C{pin}.
+
+        @type writer: C{BlobWriter}
+        @param writer: Instancia con la que se escribió el contenido.
+
+        @type file_type: C{str}
+        @param file_type: Tipo del contenido según C{magic.whatis}. Si se
+            especifica y no corresponde a un formato comprimido, el
+            contenido se almacena comprimido cuando esto reduce su tamaño.
+
+        @rtype: C{long}
+        @return: Cantidad de bytes que se añadieron al almacén, 0 si el
+            contenido ya estaba almacenado.
+        """
+        writer.close()
+        digest = writer.digest()
+        temp_path = writer.path
+        # The content is compressed without holding the mutex, the check
+        # for an already stored content is repeated below.
+        if (file_type is not None and not self.contains(digest) and
+            compressible(file_type, writer.header)):
+            temp_path = self._compress(writer)
+        blob_path = self.path(digest)
+        if temp_path != writer.path:
+            blob_path += COMPRESSED_SUFFIX
+        with self._mutex:
+            self._pins[digest] = self._pins.get(digest, 0) + 1
+            if self.contains(digest):
+                os.remove(temp_path)
+                return 0L
+            if not os.path.isdir(os.path.dirname(blob_path)):
+                os.makedirs(os.path.dirname(blob_path))
+            size = os.path.getsize(temp_path)
+            self._write_ledger({digest: size})
+            os.rename(temp_path, blob_path)
+            self._used += size
+            return size
+
+    def _compress(self, writer):
+        """
+        Comprime el fichero temporal de un C{BlobWriter} y lo elimina si la
+        versión comprimida es suficientemente pequeña.
+
+        @rtype: C{str}
+        @return: Ruta absoluta del fichero que se debe añadir al almacén, la
+            del fichero comprimido o la del fichero temporal original.
+        """
+        compressed_path = writer.path + COMPRESSED_SUFFIX
+        with open(writer.path, 'rb') as source:
+            with open(compressed_path, 'wb') as target:
+                compress_file(source, target)
+        if os.path.getsize(compressed_path) <= writer.size * MAX_COMPRESSION_RATIO:
+            os.remove(writer.path)
+            return compressed_path
+        else:
+            os.remove(compressed_path)
+            return writer.path
+
+    def remove(self, digest):
+        """
+        Elimina un contenido de este almacén, excepto si está protegido
+        por el método C{pin}.
+
+        @type digest: C{str}
+        @param digest: Hash del contenido.
+
+        @rtype: C{long}
+        @return: Cantidad de bytes liberados.
+        """
+        with self._mutex:
+            blob_path = self._stored_path(digest)
+            if digest in self._pins or blob_path is None:
+                return 0L
+            size = os.path.getsize(blob_path)
+            self._write_ledger({digest: -size})
+            os.remove(blob_path)
+            self._used -= size
+            self.cache.discard(digest)
+            return size
+
+    def open(self, digest):
+        """
+        Abre para lectura un contenido, descomprimiéndolo a medida que se
+        lee si se almacenó comprimido.
+
+        @type digest: C{str}
+        @param digest: Hash del contenido.
+
+        @rtype: C{file}
+        @return: Fichero abierto en modo binario o instancia de
+            C{DecompressingReader}. Se lanza C{IOError} si el contenido no
+            está almacenado.
+        """
+        file, codec = self.open_stored(digest)
+        if codec == ZLIB_CODEC:
+            return DecompressingReader(file)
+        else:
+            return file
+
+    def read(self, digest):
+        """
+        Lee un contenido completo. Los contenidos de hasta
+        C{MAX_CACHED_BLOB_SIZE} bytes se mantienen en memoria para las
+        siguientes lecturas. El tamaño se determina leyendo a lo sumo un
+        byte más que ese límite, antes de leer el resto del contenido.
+
+        @type digest: C{str}
+        @param digest: Hash del contenido.
+
+        @rtype: C{str}
+        @return: Contenido original. Se lanza C{IOError} si el contenido no
+            está almacenado.
+        """
+        data = self.cache.get(digest)
+        if data is None:
+            with self.open(digest) as file:
+                data = file.read(MAX_CACHED_BLOB_SIZE + 1)
+                if len(data) > MAX_CACHED_BLOB_SIZE:
+                    return data + file.read()
+            self.cache.put(digest, data)
+        return data
+
+    def open_cached(self, digest):
+        """
+        Abre para lectura un contenido que se va a transferir. Los
+        contenidos de hasta C{MAX_CACHED_BLOB_SIZE} bytes sin comprimir se
+        leen completos, se mantienen en memoria para las siguientes
+        lecturas y se retornan en un fichero en memoria sin comprimir; los
+        demás se abren como en el método C{open_stored}. Nunca se
+        descomprimen más de C{MAX_CACHED_BLOB_SIZE} + 1 bytes.
+
+        @type digest: C{str}
+        @param digest: Hash del contenido.
+
+        @rtype: C{tuple}
+        @return: Tupla con el fichero abierto en modo binario o en memoria,
+            el nombre del algoritmo con el que se comprimió el contenido
+            (C{None} si no está comprimido) y la cantidad de bytes del
+            fichero. Se lanza C{IOError} si el contenido no está almacenado.
+        """
+        data = self.cache.get(digest)
+        if data is None:
+            file, codec = self.open_stored(digest)
+            size = os.fstat(file.fileno()).st_size
+            if size > MAX_CACHED_BLOB_SIZE:
+                return (file, codec, size)
+            if codec == ZLIB_CODEC:
+                file = DecompressingReader(file)
+            with file:
+                data = file.read(MAX_CACHED_BLOB_SIZE + 1)
+            if len(data) > MAX_CACHED_BLOB_SIZE:
+                # The content expands beyond the limit, so it is transferred
+                # as stored instead.
+                file, codec = self.open_stored(digest)
+                return (file, codec, os.fstat(file.fileno()).st_size)
+            self.cache.put(digest, data)
+        return (cStringIO.StringIO(data), None, len(data))
+
+    def open_stored(self, digest):
+        """
+        Abre para lectura el fichero que almacena un contenido, sin
+        descomprimirlo.
+
+        @type digest: C{str}
+        @param digest: Hash del contenido.
+
+        @rtype: C{tuple}
+        @return: Tupla con el fichero abierto en modo binario y el nombre
+            del algoritmo con el que se comprimió el contenido (C{None} si
+            no está comprimido). Se lanza C{IOError} si el contenido no
+            está almacenado.
+        """
+        blob_path = self.path(digest)
+        try:
+            return (open(blob_path, 'rb'), None)
+        except IOError:
+            return (open(blob_path + COMPRESSED_SUFFIX, 'rb'), ZLIB_CODEC)
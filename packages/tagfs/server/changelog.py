@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""
+Registro de las modificaciones realizadas en los archivos de un servidor
+TagFS, utilizado por los demás servidores para obtener los cambios
+ocurridos desde la última vez que lo consultaron.
+"""
+
+import uuid
+import itertools
+import threading
+import collections
+
+
+# Maximum number of changes kept in the log.
+MAX_CHANGES = 100000
+
+
+class ChangeLog(object):
+    """
+    Registro en memoria de las acciones realizadas sobre los archivos, en
+    el orden en que se aplicaron al índice. A cada modificación se le
+    asigna un número de secuencia estrictamente creciente.
+
+    El registro conserva sólo las últimas C{MAX_CHANGES} modificaciones y
+    no se mantiene entre ejecuciones del servidor. Cada instancia se
+    identifica por una época distinta, por lo que un número de secuencia
+    sólo es válido junto con la época en la que se obtuvo. Si las
+    modificaciones solicitadas ya no están disponibles hay que recurrir a
+    una sincronización completa.
+    """
+
+    def __init__(self, size=MAX_CHANGES):
+        """
+        Inicializa una instancia de la clase C{ChangeLog} sin
+        modificaciones.
+
+        @type size: C{int}
+        @param size: Cantidad máxima de modificaciones que se conservan.
+        """
+        self.epoch = uuid.uuid4().hex
+        self._changes = collections.deque(maxlen=size)
+        self._last_seq = 0L
+        self._mutex = threading.Lock()
+
+    def append(self, file_hash, action, time):
+        """
+        Añade una modificación al final del registro.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo.
+
+        @type action: C{str}
+        @param action: Acción realizada, C{'add'} o C{'delete'}.
+
+        @type time: C{float}
+        @param time: Identificador de tiempo de la acción.
+
+        @rtype: C{long}
+        @return: Número de secuencia de la modificación.
+        """
+        with self._mutex:
+            self._last_seq += 1
+            self._changes.append((self._last_seq, file_hash, action, time))
+            return self._last_seq
+
+    def last_seq(self):
+        """
+        Retorna el número de secuencia de la última modificación.
+
+        @rtype: C{long}
+        @return: Número de secuencia, C{0} si no hay modificaciones.
+        """
+        with self._mutex:
+            return self._last_seq
+
+    def since(self, seq, limit):
+        """
+        Retorna las modificaciones posteriores a un número de secuencia.
+
+        @type seq: C{long}
+        @param seq: Número de secuencia de la última modificación conocida.
+
+        @type limit: C{int}
+        @param limit: Cantidad máxima de modificaciones retornadas.
+
+        @rtype: C{list}
+        @return: Lista de tuplas C{(seq, hash, action, time)} en orden
+            creciente del número de secuencia o C{None} si alguna de las
+            modificaciones posteriores ya no está en el registro.
+        """
+        with self._mutex:
+            if seq > self._last_seq:
+                return None
+            first_seq = self._last_seq - len(self._changes) + 1
+            if seq + 1 < first_seq:
+                return None
+            start = int(seq + 1 - first_seq)
+            return list(itertools.islice(self._changes, start, start + limit))
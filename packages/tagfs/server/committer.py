@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+
+"""
+Escritura en lotes de las modificaciones del índice de un servidor TagFS.
+"""
+
+import os
+import json
+import time
+import threading
+
+
+# Maximum number of operations applied in a single commit of the index.
+COMMIT_BATCH_SIZE = 256
+
+# Maximum number of seconds an operation waits for other operations
+# before it is committed to the index.
+COMMIT_DELAY = 0.5
+
+# Size in bytes of the intent log that triggers its compaction.
+MAX_LOG_SIZE = 4 * 1024 * 1024
+
+
+class IndexCommitter(object):
+    """
+    Aplica en lotes las modificaciones al índice de Whoosh de un servidor.
+
+    Cada modificación reemplaza el documento del índice identificado por
+    un hash. Las modificaciones se escriben primero en un registro de
+    intenciones en disco, por lo que se consideran realizadas una vez que
+    el método C{submit} retorna aunque aún no se hayan aplicado al índice.
+    Un hilo aplica las modificaciones pendientes con un único C{commit}
+    cuando se acumulan C{COMMIT_BATCH_SIZE} modificaciones, cuando
+    transcurren C{COMMIT_DELAY} segundos o cuando se llama al método
+    C{flush}. Las modificaciones que no se aplicaron al índice se aplican
+    a partir del registro de intenciones al crear una nueva instancia.
+
+    Si no se puede aplicar un lote, sus modificaciones se aplican una a
+    una y sólo se descartan las que fallan. Las modificaciones descartadas
+    se eliminan del registro de intenciones y la excepción se lanza en las
+    llamadas al método C{flush} que esperaban por ellas; las modificaciones
+    posteriores se aplican normalmente.
+
+    Una modificación es un diccionario con las llaves:
+        - C{hash}: Hash del documento que se reemplaza.
+        - C{fields}: Campos del nuevo documento o C{None} si el documento
+          se elimina del índice.
+        - C{pin}: Hash de un contenido que el nuevo documento referencia o
+          C{None}.
+        - C{release}: Hash de un contenido que el documento reemplazado
+          referenciaba o C{None}.
+    """
+
+    def __init__(self, index, log_path, on_commit=None, on_discard=None):
+        """
+        Inicializa una instancia de la clase C{IndexCommitter}.
+
+        @type index: C{whoosh.index.Index}
+        @param index: Índice al que se aplican las modificaciones.
+
+        @type log_path: C{str}
+        @param log_path: Ruta absoluta del registro de intenciones.
+
+        @type on_commit: C{callable}
+        @param on_commit: Función que se llama, con la lista de las
+            modificaciones aplicadas, después de cada C{commit} del índice.
+
+        @type on_discard: C{callable}
+        @param on_discard: Función que se llama con la lista de las
+            modificaciones que se descartan porque no se pudieron aplicar.
+        """
+        self._index = index
+        self._log_path = log_path
+        self._on_commit = on_commit
+        self._on_discard = on_discard
+        self._cond = threading.Condition()
+        self._pending = []
+        self._latest = {}
+        self._submitted = 0
+        self._committed = 0
+        self._flush_requested = False
+        self._optimize_requested = False
+        # Number of flush calls waiting and the ranges of operations that
+        # could not be applied while they wait, with the exception raised.
+        self._waiting = 0
+        self._failures = []
+        self._replay()
+        self._log = open(self._log_path, 'ab')
+        self._continue = True
+        self._thread = threading.Thread(target=self._commit_batches)
+        self._thread.start()
+
+    def _replay(self):
+        """
+        Aplica al índice las modificaciones del registro de intenciones
+        que no se aplicaron en una ejecución anterior.
+        """
+        if os.path.isfile(self._log_path):
+            ops = []
+            with open(self._log_path, 'rb') as log:
+                for line in log:
+                    try:
+                        ops.append(json.loads(line))
+                    except ValueError:
+                        # Ignore an incomplete line written during a crash.
+                        pass
+            if ops:
+                self._apply_batch(ops)
+            os.remove(self._log_path)
+
+    def _apply(self, ops):
+        """
+        Aplica una lista de modificaciones al índice con un único C{commit}.
+
+        @type ops: C{list}
+        @param ops: Lista de las modificaciones.
+        """
+        # Documents added by a writer can not be deleted by the same
+        # writer, so only the last operation on each hash is applied.
+        latest = {}
+        for op in ops:
+            latest[op['hash']] = op
+        writer = self._index.writer()
+        try:
+            for file_hash, op in latest.iteritems():
+                writer.delete_by_term('hash', file_hash)
+                if op['fields'] is not None:
+                    fields = dict((str(name), value) for name, value in op['fields'].iteritems())
+                    writer.add_document(**fields)
+        except Exception:
+            writer.cancel()
+            raise
+        writer.commit()
+
+    def _apply_batch(self, ops):
+        """
+        Aplica un lote de modificaciones al índice. Si no se puede aplicar
+        completo se aplican las modificaciones una a una y se descartan las
+        que fallan.
+
+        @type ops: C{list}
+        @param ops: Lista de las modificaciones.
+
+        @rtype: C{tuple}
+        @return: Tupla con la lista de las modificaciones descartadas y la
+            última excepción lanzada al aplicarlas, C{None} si se aplicaron
+            todas.
+        """
+        try:
+            self._apply(ops)
+            applied, failed, error = ops, [], None
+        except Exception, e:
+            applied, failed, error = [], [], e
+            for op in ops:
+                try:
+                    self._apply([op])
+                except Exception, e:
+                    failed.append(op)
+                    error = e
+                else:
+                    applied.append(op)
+        self._notify(self._on_commit, applied)
+        if failed:
+            self._notify(self._on_discard, failed)
+        return failed, error
+
+    def _notify(self, callback, ops):
+        """
+        Llama a una de las funciones recibidas al crear la instancia.
+        """
+        if callback:
+            try:
+                callback(ops)
+            except Exception:
+                # Ignoring any exception here. The operations were already
+                # applied or discarded.
+                pass
+
+    def _optimize(self):
+        """
+        Une los segmentos del índice y elimina físicamente los documentos
+        eliminados.
+        """
+        # Whoosh can not open the empty segment created when an index
+        # without documents is optimized.
+        if self._index.doc_count() == 0:
+            return
+        self._index.optimize()
+        self._notify(self._on_commit, [])
+
+    def _write_log(self, ops):
+        """
+        Añade modificaciones al registro de intenciones y garantiza que
+        se escriban en el disco.
+
+        @type ops: C{list}
+        @param ops: Lista de las modificaciones.
+        """
+        for op in ops:
+            self._log.write(json.dumps(op) + '\n')
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+    def _compact_log(self):
+        """
+        Reescribe el registro de intenciones con las modificaciones que
+        todavía no se han aplicado al índice.
+        """
+        self._log.close()
+        temp_path = self._log_path + '.tmp'
+        with open(temp_path, 'wb') as temp_log:
+            for op in self._pending:
+                temp_log.write(json.dumps(op) + '\n')
+            temp_log.flush()
+            os.fsync(temp_log.fileno())
+        os.rename(temp_path, self._log_path)
+        self._log = open(self._log_path, 'ab')
+
+    def _commit_batches(self):
+        """
+        Método ejecutado por el hilo que aplica las modificaciones.
+        """
+        while True:
+            with self._cond:
+                while (self._continue and not self._pending and
+                       not self._optimize_requested):
+                    self._cond.wait()
+                if not self._pending and not self._optimize_requested:
+                    break
+                if self._pending:
+                    # Wait for more operations to fill the batch.
+                    deadline = time.time() + COMMIT_DELAY
+                    while (self._continue and not self._flush_requested and
+                           len(self._pending) < COMMIT_BATCH_SIZE):
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    self._flush_requested = False
+                batch = self._pending[:COMMIT_BATCH_SIZE]
+                # The index is optimized once the pending operations are applied.
+                optimize = (self._optimize_requested and
+                            len(batch) == len(self._pending))
+                if optimize:
+                    self._optimize_requested = False
+            failed, error = [], None
+            if batch:
+                failed, error = self._apply_batch(batch)
+            if optimize:
+                try:
+                    self._optimize()
+                except Exception:
+                    # Ignoring any exception here. The index is valid
+                    # without optimizing it.
+                    pass
+            with self._cond:
+                del self._pending[:len(batch)]
+                for op in batch:
+                    if self._latest.get(op['hash']) is op:
+                        del self._latest[op['hash']]
+                self._committed += len(batch)
+                if failed and self._waiting:
+                    self._failures.append((self._committed - len(batch),
+                                           self._committed, error))
+                if not self._pending:
+                    self._log.truncate(0)
+                    self._log.seek(0)
+                elif failed or self._log.tell() > MAX_LOG_SIZE:
+                    # The discarded operations are removed from the log,
+                    # they must not be applied when the server starts.
+                    self._compact_log()
+                self._cond.notifyAll()
+
+    def submit(self, ops):
+        """
+        Añade modificaciones a la lista de modificaciones pendientes. Las
+        modificaciones se escriben en el registro de intenciones antes de
+        que este método retorne.
+
+        @type ops: C{list}
+        @param ops: Lista de las modificaciones que se quieren aplicar al
+            índice.
+        """
+        with self._cond:
+            self._write_log(ops)
+            for op in ops:
+                self._pending.append(op)
+                self._latest[op['hash']] = op
+            self._submitted += len(ops)
+            self._cond.notifyAll()
+
+    def pending(self, file_hash):
+        """
+        Obtiene los campos del documento que una modificación pendiente
+        asocia a un hash.
+
+        @type file_hash: C{unicode}
+        @param file_hash: Hash del documento.
+
+        @rtype: C{tuple}
+        @return: Tupla de la forma C{(True, fields)} si hay una modificación
+            pendiente para el hash dado (C{fields} es C{None} si el documento
+            se elimina), C{(False, None)} en caso contrario.
+        """
+        with self._cond:
+            op = self._latest.get(file_hash)
+            if op is not None:
+                return (True, op['fields'])
+            else:
+                return (False, None)
+
+    def flush(self):
+        """
+        Espera a que se apliquen al índice todas las modificaciones
+        añadidas antes de llamar a este método. Si alguna de las
+        modificaciones pendientes al llamar a este método se descartó, se
+        lanza la excepción con la que falló.
+        """
+        with self._cond:
+            start, ticket = self._committed, self._submitted
+            self._waiting += 1
+            try:
+                if self._committed < ticket:
+                    self._flush_requested = True
+                    self._cond.notifyAll()
+                    while self._committed < ticket:
+                        self._cond.wait()
+            finally:
+                self._waiting -= 1
+            errors = [error for first, last, error in self._failures
+                      if first < ticket and last > start]
+            if not self._waiting:
+                # Only the waiting calls can be affected by the failures.
+                self._failures = []
+            if errors:
+                raise errors[-1]
+
+    def optimize(self):
+        """
+        Solicita que se optimice el índice después de aplicar las
+        modificaciones pendientes. Este método retorna sin esperar a que
+        termine la optimización.
+        """
+        with self._cond:
+            self._optimize_requested = True
+            self._cond.notifyAll()
+
+    def close(self):
+        """
+        Aplica las modificaciones pendientes y termina el hilo que aplica
+        las modificaciones.
+        """
+        with self._cond:
+            self._continue = False
+            self._cond.notifyAll()
+        self._thread.join()
+        self._log.close()
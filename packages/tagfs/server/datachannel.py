@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+"""
+Canal de datos utilizado para transferir el contenido de los archivos de
+un servidor TagFS sin utilizar Pyro.
+
+Una llamada a Pyro registra el fichero que se quiere transferir en el canal
+de datos del servidor y retorna un identificador de la transferencia. El
+cliente se conecta al canal de datos, envía el identificador seguido de un
+cambio de línea y recibe el contenido del fichero hasta que se cierra la
+conexión. Si está disponible, el contenido de los ficheros en disco se
+envía con la llamada al sistema C{sendfile}, sin copiarlo a la memoria del
+proceso.
+"""
+
+import os
+import time
+import uuid
+import struct
+import socket
+import select
+import threading
+
+try:
+    from os import sendfile
+except ImportError:
+    try:
+        # The pysendfile package provides the same function for Python 2.
+        from sendfile import sendfile
+    except ImportError:
+        sendfile = None
+
+from tagfs.common import TRANSFER_CHUNK_SIZE
+from tagfs.common.compression import ZLIB_CODEC, decompress_chunks
+
+
+# Number of seconds a registered transfer waits for the client to connect.
+TRANSFER_TTL = 60
+
+# Number of seconds a connection waits for the client to send or receive data.
+TRANSFER_TIMEOUT = 30
+
+# Number of seconds the thread accepting connections waits between checks
+# for expired transfers.
+ACCEPT_TIMEOUT = 1
+
+
+class DataChannel(object):
+    """
+    Canal de datos de un servidor TagFS. Un hilo acepta las conexiones de
+    los clientes y cada transferencia se realiza en un nuevo hilo.
+    """
+
+    def __init__(self, address):
+        """
+        Inicializa una instancia de la clase C{DataChannel} y comienza a
+        aceptar conexiones en un puerto libre.
+
+        @type address: C{str}
+        @param address: Dirección IP de la interfaz de red donde debe
+            escuchar el canal de datos.
+        """
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((address, 0))
+        self._socket.listen(socket.SOMAXCONN)
+        self.address, self.port = self._socket.getsockname()
+        self._transfers = {}
+        self._mutex = threading.Lock()
+        self._continue = True
+        self._thread = threading.Thread(target=self._accept_connections)
+        self._thread.start()
+
+    def register(self, file):
+        """
+        Registra un fichero para que se transfiera por el canal de datos.
+        El canal de datos se encarga de cerrar el fichero.
+
+        @type file: C{file}
+        @param file: Fichero abierto en modo binario o fichero en memoria
+            creado con C{cStringIO}.
+
+        @rtype: C{str}
+        @return: Identificador de la transferencia. Sólo se puede utilizar
+            una vez y durante C{TRANSFER_TTL} segundos.
+        """
+        token = uuid.uuid4().hex
+        with self._mutex:
+            self._transfers[token] = (file, time.time() + TRANSFER_TTL)
+        return token
+
+    def cancel(self, token):
+        """
+        Cancela una transferencia registrada a la que el cliente todavía no
+        se ha conectado y cierra su fichero.
+
+        @type token: C{str}
+        @param token: Identificador de la transferencia.
+        """
+        with self._mutex:
+            file, _ = self._transfers.pop(token, (None, None))
+        if file is not None:
+            file.close()
+
+    def _accept_connections(self):
+        """
+        Método ejecutado por el hilo que acepta las conexiones.
+        """
+        while self._continue:
+            readable, _, _ = select.select([self._socket], [], [], ACCEPT_TIMEOUT)
+            self._expire_transfers()
+            if readable:
+                try:
+                    conn, _ = self._socket.accept()
+                except socket.error:
+                    # Ignoring any exception here.
+                    continue
+                conn_thread = threading.Thread(target=self._transfer, args=(conn,))
+                conn_thread.daemon = True
+                conn_thread.start()
+
+    def _expire_transfers(self):
+        """
+        Cierra los ficheros de las transferencias que expiraron.
+        """
+        now = time.time()
+        with self._mutex:
+            expired = [token for token, (_, deadline) in self._transfers.iteritems()
+                       if deadline < now]
+            files = [self._transfers.pop(token)[0] for token in expired]
+        for file in files:
+            file.close()
+
+    def _transfer(self, conn):
+        """
+        Atiende una conexión al canal de datos.
+
+        @type conn: C{socket.socket}
+        @param conn: Conexión con el cliente.
+        """
+        try:
+            conn.settimeout(TRANSFER_TIMEOUT)
+            token = ''
+            while not token.endswith('\n') and len(token) <= 32:
+                data = conn.recv(33 - len(token))
+                if not data:
+                    return
+                token += data
+            with self._mutex:
+                file, _ = self._transfers.pop(token.strip(), (None, None))
+            if file is not None:
+                try:
+                    self._send_file(conn, file)
+                finally:
+                    file.close()
+        except (socket.error, IOError, OSError):
+            # Ignoring any exception here. The client detects that the
+            # transfer is incomplete.
+            pass
+        finally:
+            conn.close()
+
+    def _send_file(self, conn, file):
+        """
+        Envía el contenido de un fichero por una conexión.
+
+        @type conn: C{socket.socket}
+        @param conn: Conexión con el cliente.
+
+        @type file: C{file}
+        @param file: Fichero abierto en modo binario o fichero en memoria.
+        """
+        if sendfile is not None and hasattr(file, 'fileno'):
+            size = os.fstat(file.fileno()).st_size
+            # sendfile needs a blocking socket, the timeout is set directly
+            # on the socket.
+            conn.settimeout(None)
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+                            struct.pack('ll', TRANSFER_TIMEOUT, 0))
+            offset = 0
+            while offset < size:
+                sent = sendfile(conn.fileno(), file.fileno(), offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        else:
+            chunk = file.read(TRANSFER_CHUNK_SIZE)
+            while chunk:
+                conn.sendall(chunk)
+                chunk = file.read(TRANSFER_CHUNK_SIZE)
+
+    def close(self):
+        """
+        Deja de aceptar conexiones y cierra los ficheros de las
+        transferencias que no se realizaron.
+        """
+        self._continue = False
+        self._thread.join()
+        self._socket.close()
+        with self._mutex:
+            files = [file for file, _ in self._transfers.itervalues()]
+            self._transfers = {}
+        for file in files:
+            file.close()
+
+
+def download(address, port, token, size, codec=None):
+    """
+    Recibe el contenido de un fichero registrado en el canal de datos de un
+    servidor TagFS, descomprimiéndolo si el servidor lo almacena comprimido.
+
+    @type address: C{str}
+    @param address: Dirección IP del canal de datos.
+
+    @type port: C{int}
+    @param port: Puerto del canal de datos.
+
+    @type token: C{str}
+    @param token: Identificador de la transferencia.
+
+    @type size: C{long}
+    @param size: Tamaño en bytes del fichero.
+
+    @type codec: C{str}
+    @param codec: Algoritmo con el que está comprimido el fichero, C{None}
+        si no está comprimido.
+
+    @rtype: C{iterator}
+    @return: Iterador sobre las partes del contenido original, de a lo
+        sumo C{TRANSFER_CHUNK_SIZE} bytes. Se lanza C{IOError} si la
+        conexión se cierra antes de recibir todo el fichero.
+    """
+    chunks = _receive(address, port, token, size)
+    if codec == ZLIB_CODEC:
+        chunks = decompress_chunks(chunks)
+    return chunks
+
+
+def _receive(address, port, token, size):
+    """
+    Recibe los bytes de un fichero registrado en el canal de datos.
+    """
+    conn = socket.create_connection((address, port), TRANSFER_TIMEOUT)
+    try:
+        conn.sendall(token + '\n')
+        stream = conn.makefile('rb')
+        received = 0
+        while received < size:
+            chunk = stream.read(min(TRANSFER_CHUNK_SIZE, size - received))
+            if not chunk:
+                raise IOError('Transfer {0} was interrupted'.format(token))
+            received += len(chunk)
+            yield chunk
+    finally:
+        conn.close()
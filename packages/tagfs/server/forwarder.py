@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""
+Reenvío de las transferencias al siguiente servidor de una cadena.
+"""
+
+import Queue
+import threading
+
+
+# Maximum number of chunks of each upload waiting to be forwarded.
+FORWARD_QUEUE_SIZE = 16
+
+# Seconds to wait for each call to the next server of a chain, for each
+# server that follows it in the chain, including itself.
+FORWARD_TIMEOUT = 30
+
+# Markers put in the queue after the last chunk of an upload.
+_COMMIT = object()
+_ABORT = object()
+
+
+class UploadForwarder(object):
+    """
+    Reenvía las porciones de una transferencia al siguiente servidor de una
+    cadena desde un hilo propio, a medida que se reciben, de modo que este
+    servidor no espera por el siguiente para recibir la próxima porción.
+    Las porciones pendientes se mantienen en una cola de a lo sumo
+    C{FORWARD_QUEUE_SIZE} porciones, y al llenarse la cola se espera a que
+    el siguiente servidor las reciba. Si el siguiente servidor falla, se
+    cancela la transferencia en ese servidor y el resto de las porciones
+    se descartan. El proxy del siguiente servidor debe tener un tiempo de
+    espera, de C{FORWARD_TIMEOUT} segundos por cada servidor restante de
+    la cadena, para que un servidor que no responde no retenga la cola
+    indefinidamente.
+    """
+
+    def __init__(self, server, upload_id, size=FORWARD_QUEUE_SIZE):
+        """
+        Inicializa una instancia de la clase C{UploadForwarder} e inicia su
+        hilo.
+
+        @type server: C{Pyro.core.DynamicProxy}
+        @param server: Siguiente servidor de la cadena. Su conexión se
+            cierra al terminar la transferencia.
+
+        @type upload_id: C{str}
+        @param upload_id: Identificador de la transferencia en el siguiente
+            servidor, retornado por su método C{open_upload}.
+
+        @type size: C{int}
+        @param size: Cantidad máxima de porciones pendientes.
+        """
+        self._server = server
+        self._upload_id = upload_id
+        self._chunks = Queue.Queue(size)
+        self._failed = False
+        self._aborted = False
+        self._stored = {}
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        """
+        Método ejecutado por el hilo. Envía las porciones hasta recibir la
+        marca de confirmación o de cancelación de la transferencia.
+        """
+        while True:
+            chunk = self._chunks.get()
+            if chunk is _COMMIT:
+                if not self._failed:
+                    try:
+                        self._stored = self._server.commit_upload(self._upload_id)
+                    except Exception:
+                        # Ignoring any exception here. The rest of the chain
+                        # did not acknowledge the file.
+                        pass
+                break
+            elif chunk is _ABORT:
+                if not self._failed:
+                    self._cancel()
+                break
+            elif not self._failed and not self._aborted:
+                try:
+                    self._server.put_chunk(self._upload_id, chunk)
+                except Exception:
+                    # Ignoring any exception here. The rest of the chain does
+                    # not receive the file. If the call timed out its answer
+                    # may still arrive, so the connection is dropped first.
+                    self._server._release()
+                    self._cancel()
+        self._server._release()
+
+    def _cancel(self):
+        """
+        Cancela la transferencia en el siguiente servidor.
+        """
+        self._failed = True
+        try:
+            self._server.abort_upload(self._upload_id)
+        except Exception:
+            # Ignoring any exception here.
+            pass
+
+    def send(self, chunk):
+        """
+        Pone una porción en la cola para reenviarla. Espera mientras la cola
+        esté llena, a lo sumo hasta que el siguiente servidor reciba una
+        porción o venza el tiempo de espera de su proxy. Si el siguiente
+        servidor falló o se canceló la transferencia, la porción se
+        descarta.
+
+        @type chunk: C{str}
+        @param chunk: Porción del contenido del archivo.
+        """
+        if not self._failed and not self._aborted:
+            self._chunks.put(chunk)
+
+    def commit(self):
+        """
+        Espera a que se reenvíen las porciones pendientes y termina la
+        transferencia en el siguiente servidor, que a su vez espera por el
+        resto de la cadena.
+
+        @rtype: C{dict}
+        @return: Diccionario retornado por el método C{commit_upload} del
+            siguiente servidor, vacío si la transferencia falló.
+        """
+        self._chunks.put(_COMMIT)
+        self._thread.join()
+        return self._stored
+
+    def abort(self):
+        """
+        Descarta las porciones pendientes y cancela la transferencia en el
+        siguiente servidor sin esperar a que termine. No espera por el
+        siguiente servidor aunque la cola esté llena.
+        """
+        self._aborted = True
+        # The pending chunks are dropped to make room for the marker.
+        while True:
+            try:
+                self._chunks.get_nowait()
+            except Queue.Empty:
+                try:
+                    self._chunks.put_nowait(_ABORT)
+                    break
+                except Queue.Full:
+                    pass
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+Sincronización del acceso a los archivos de un servidor TagFS.
+"""
+
+import threading
+
+
+# Number of locks shared by all the files of a server.
+STRIPE_COUNT = 64
+
+
+class LockStripes(object):
+    """
+    Conjunto fijo de C{threading.RLock} compartidos por todos los archivos
+    de un servidor. El lock de un archivo se elige a partir de su hash, por
+    lo que las operaciones sobre archivos distintos pueden ejecutarse a la
+    vez (excepto si sus hashes corresponden al mismo lock) y las operaciones
+    sobre un mismo archivo se ejecutan una a continuación de la otra.
+    """
+
+    def __init__(self, count=STRIPE_COUNT):
+        """
+        Inicializa una instancia de la clase C{LockStripes}.
+
+        @type count: C{int}
+        @param count: Cantidad de locks.
+        """
+        self._locks = [threading.RLock() for _ in xrange(count)]
+
+    def _stripes(self, keys):
+        """
+        Retorna los locks asociados a varios hashes, sin repeticiones y
+        siempre en el mismo orden para evitar interbloqueos.
+        """
+        stripes = sorted(set(hash(key) % len(self._locks) for key in keys))
+        return [self._locks[stripe] for stripe in stripes]
+
+    def acquire(self, key):
+        """
+        Adquiere el lock asociado a un hash.
+
+        @type key: C{str}
+        @param key: Hash del archivo.
+        """
+        self.acquire_many([key])
+
+    def release(self, key):
+        """
+        Libera el lock asociado a un hash.
+
+        @type key: C{str}
+        @param key: Hash del archivo.
+        """
+        self.release_many([key])
+
+    def acquire_many(self, keys):
+        """
+        Adquiere los locks asociados a varios hashes.
+
+        @type keys: C{list}
+        @param keys: Lista con los hashes de los archivos.
+        """
+        for lock in self._stripes(keys):
+            lock.acquire()
+
+    def release_many(self, keys):
+        """
+        Libera los locks asociados a varios hashes.
+
+        @type keys: C{list}
+        @param keys: Lista con los hashes de los archivos.
+        """
+        for lock in reversed(self._stripes(keys)):
+            lock.release()
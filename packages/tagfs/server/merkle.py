@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+"""
+Árbol de Merkle sobre las acciones realizadas en los archivos de un
+servidor TagFS, utilizado para detectar qué archivos hay que comparar
+durante la sincronización de los servidores.
+"""
+
+import hashlib
+import threading
+
+
+# Hexadecimal digits of the file hashes.
+HEX_DIGITS = '0123456789abcdef'
+
+# Length of the prefix of the file hashes that identifies a leaf of the tree.
+LEAF_PREFIX_LENGTH = 2
+
+
+class MerkleTree(object):
+    """
+    Árbol de Merkle de la última acción realizada sobre cada archivo. Los
+    archivos se agrupan en hojas según los primeros C{LEAF_PREFIX_LENGTH}
+    dígitos de su hash y cada nodo interno corresponde a un prefijo más
+    corto, hasta la raíz (el prefijo vacío).
+
+    El resumen de una hoja es el XOR de los resúmenes de la tupla (hash,
+    acción, tiempo) de sus archivos, por lo que se actualiza en tiempo
+    constante al cambiar un archivo. El resumen de un nodo interno es el
+    MD5 de los resúmenes de sus hijos y se calcula al consultarlo.
+
+    El árbol también mantiene los archivos cuya última acción fue una
+    eliminación.
+    """
+
+    def __init__(self):
+        """
+        Inicializa una instancia de la clase C{MerkleTree} sin archivos.
+        """
+        self._entries = {}
+        self._leaves = {}
+        self._buckets = {}
+        self._tombstones = {}
+        self._mutex = threading.Lock()
+
+    def update(self, file_hash, action, time):
+        """
+        Registra la última acción realizada sobre un archivo.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo.
+
+        @type action: C{str}
+        @param action: Acción realizada, C{'add'} o C{'delete'}.
+
+        @type time: C{float}
+        @param time: Identificador de tiempo de la acción.
+        """
+        checksum = hashlib.md5('{0} {1} {2!r}'.format(file_hash, action, float(time)))
+        entry = long(checksum.hexdigest(), 16)
+        prefix = file_hash[:LEAF_PREFIX_LENGTH]
+        with self._mutex:
+            old_entry = self._entries.get(file_hash, 0L)
+            self._entries[file_hash] = entry
+            self._leaves[prefix] = self._leaves.get(prefix, 0L) ^ old_entry ^ entry
+            self._buckets.setdefault(prefix, set()).add(file_hash)
+            if action == 'delete':
+                self._tombstones[file_hash] = float(time)
+            else:
+                self._tombstones.pop(file_hash, None)
+
+    def discard(self, file_hash):
+        """
+        Elimina un archivo del árbol.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo.
+        """
+        prefix = file_hash[:LEAF_PREFIX_LENGTH]
+        with self._mutex:
+            if file_hash in self._entries:
+                self._leaves[prefix] ^= self._entries.pop(file_hash)
+                self._buckets[prefix].discard(file_hash)
+                self._tombstones.pop(file_hash, None)
+
+    def is_live(self, file_hash):
+        """
+        Determina si la última acción realizada sobre un archivo fue añadirlo.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo.
+
+        @rtype: C{bool}
+        @return: C{True} si el archivo está en el árbol y no fue eliminado,
+            C{False} en caso contrario.
+        """
+        with self._mutex:
+            return file_hash in self._entries and file_hash not in self._tombstones
+
+    def digests(self, prefixes):
+        """
+        Retorna los resúmenes de varios nodos del árbol.
+
+        @type prefixes: C{list}
+        @param prefixes: Lista con los prefijos de los nodos, de a lo sumo
+            C{LEAF_PREFIX_LENGTH} dígitos hexadecimales.
+
+        @rtype: C{dict}
+        @return: Diccionario con el resumen hexadecimal de cada nodo,
+            indexado por su prefijo.
+        """
+        with self._mutex:
+            return dict((prefix, self._digest(prefix)) for prefix in prefixes)
+
+    def _digest(self, prefix):
+        """
+        Calcula el resumen de un nodo. Se tiene que llamar con el mutex
+        adquirido.
+        """
+        if len(prefix) == LEAF_PREFIX_LENGTH:
+            return '{0:032x}'.format(self._leaves.get(prefix, 0L))
+        checksum = hashlib.md5()
+        for digit in HEX_DIGITS:
+            checksum.update(self._digest(prefix + digit))
+        return checksum.hexdigest()
+
+    def hashes(self, prefixes):
+        """
+        Retorna los archivos de varias hojas del árbol.
+
+        @type prefixes: C{set}
+        @param prefixes: Conjunto con los prefijos de las hojas.
+
+        @rtype: C{list}
+        @return: Lista con los identificadores de los archivos.
+        """
+        with self._mutex:
+            return [file_hash for prefix in prefixes
+                    for file_hash in self._buckets.get(prefix, ())]
+
+    def tombstones(self):
+        """
+        Retorna los archivos cuya última acción fue una eliminación.
+
+        @rtype: C{dict}
+        @return: Diccionario con el identificador de tiempo de la
+            eliminación de cada archivo, indexado por el hash del archivo.
+        """
+        with self._mutex:
+            return dict(self._tombstones)
+
+
+def prefixes():
+    """
+    Retorna los prefijos de todos los nodos del árbol, comenzando por la
+    raíz y terminando por las hojas.
+
+    @rtype: C{list}
+    @return: Lista con los prefijos.
+    """
+    nodes = ['']
+    level = ['']
+    for _ in xrange(LEAF_PREFIX_LENGTH):
+        level = [child for prefix in level for child in children(prefix)]
+        nodes.extend(level)
+    return nodes
+
+
+def children(prefix):
+    """
+    Retorna los prefijos de los hijos de un nodo del árbol.
+
+    @type prefix: C{str}
+    @param prefix: Prefijo del nodo.
+
+    @rtype: C{list}
+    @return: Lista con los prefijos de los hijos.
+    """
+    return [prefix + digit for digit in HEX_DIGITS]
@@ -5,11 +5,13 @@ Implementación del servidor TagFS compartido en la red.
 """
 
 import os
+import copy
 import time
-import hashlib
+import uuid
+import random
+import shutil
 import threading
 
-import sync
 import magic
 import whoosh.index
 import whoosh.fields
@@ -18,8 +20,37 @@ import whoosh.qparser
 import Pyro.core
 import Zeroconf
 
-from tagfs.common import ZEROCONF_SERVICE_TYPE
+from tagfs.common import ZEROCONF_SERVICE_TYPE, TRANSFER_CHUNK_SIZE, get_file_hash
+from tagfs.common.workers import WorkerPool
+from tagfs.common.bloom import CountingBloomFilter
 from tagfs.common.timeprovider import LocalTimeProvider, NTPTimeProvider
+from tagfs.server.blobstore import BlobStore
+from tagfs.server.committer import IndexCommitter
+from tagfs.server.searchers import SearcherPool
+from tagfs.server.locks import LockStripes
+from tagfs.server import merkle
+from tagfs.server.changelog import ChangeLog
+from tagfs.server.datachannel import DataChannel, download
+from tagfs.server.forwarder import UploadForwarder, FORWARD_TIMEOUT
+
+
+# Maximum number of changes returned by a call to the method changes.
+MAX_PULLED_CHANGES = 1000
+
+# Number of threads used to contact the other servers and to transfer
+# files during the synchronization.
+SYNC_WORKERS = 8
+
+# Seconds between two searches of under-replicated files, when no server
+# becomes unavailable in the meantime.
+REPAIR_INTERVAL = 600
+
+# Seconds between the copies made to repair under-replicated files.
+REPAIR_DELAY = 1
+
+# Seconds to wait for the answers of the other servers when searching the
+# under-replicated files and their capacity.
+REPAIR_TIMEOUT = 30
 
 
 class RemoteTagFSServer(object):
@@ -59,13 +90,19 @@ class RemoteTagFSServer(object):
             os.mkdir(self._data_dir)
         self._pyro_uri = pyro_uri
         self._init_index()
+        self._init_merkle()
         self._init_files()
+        self._init_data_channel()
         self._init_status(capacity)
+        self._init_committer()
+        self._init_repair()
         self._init_autodiscovery()
-        self._mrsw_lock = sync.mrsw()
+        self._file_locks = LockStripes()
         # Keep this last! This requires the index, locks, etc.
         self._sync_thread = threading.Thread(target=self._sync_servers)
         self._sync_thread.start()
+        self._repair_thread = threading.Thread(target=self._repair_files)
+        self._repair_thread.start()
         # TODO Change to use an NTP or local.
         if ntp_server:
             self._time_provider = NTPTimeProvider(ntp_server)
@@ -89,10 +126,13 @@ class RemoteTagFSServer(object):
             group=whoosh.fields.STORED(),
             perms=whoosh.fields.STORED(),
             size=whoosh.fields.STORED(),
-            path=whoosh.fields.STORED(),
+            blob=whoosh.fields.ID(stored=True),
             type=whoosh.fields.STORED(),
             time=whoosh.fields.STORED(),
             action=whoosh.fields.STORED(),
+            fragment=whoosh.fields.STORED(),
+            replicas=whoosh.fields.STORED(),
+            renamed=whoosh.fields.STORED(),
         )
         index_dir = os.path.join(self._data_dir, 'index')
         if not os.path.isdir(index_dir):
@@ -100,28 +140,142 @@ class RemoteTagFSServer(object):
             self._index = whoosh.index.create_in(index_dir, self._index_schema)
         else:
             self._index = whoosh.index.open_dir(index_dir)
+            for name, field in self._index_schema.fields():
+                if name not in self._index.schema:
+                    # Stored fields added after the index was created.
+                    self._index.schema.add(name, field)
+        self._searchers = SearcherPool(self._index)
         
+    def _init_merkle(self):
+        """
+        Inicializa el árbol de Merkle con la última acción realizada sobre
+        cada archivo del índice y el filtro de Bloom de los archivos que no
+        fueron eliminados. El árbol se actualiza cada vez que se aplican
+        modificaciones al índice. Los archivos se añaden al filtro al
+        registrar la modificación que los añade, porque los clientes los
+        pueden buscar antes de que se aplique al índice, y se eliminan del
+        filtro cuando se aplica su eliminación.
+        """
+        self._merkle = merkle.MerkleTree()
+        self._hash_filter = CountingBloomFilter()
+        # Number of submitted operations adding each file that have not
+        # been applied to the index yet.
+        self._filter_pending = {}
+        self._filter_mutex = threading.Lock()
+        with self._searchers.searcher() as searcher:
+            for doc in searcher.reader().all_stored_fields():
+                file_hash = doc['hash'].encode(self._encoding)
+                self._merkle.update(file_hash, doc['action'], float(doc['time']))
+                if doc['action'] != 'delete':
+                    self._hash_filter.add(file_hash)
+        self._changes = ChangeLog()
+
     def _init_files(self):
         """
-        Inicializa el directorio que contiene los archivos almacenados 
-        en este servidor de TagFS. time.mktime(time.gmtime())Los archivos no se almacenarán directamente
-        en la raíz de este directorio sino en un serie de directorios anidados
-        para evitar que este directorio tenga muchas entradas y se haga
-        muy lento el acceso a un archivo.
+        Inicializa el almacén que contiene el contenido de los archivos
+        almacenados en este servidor de TagFS. El contenido de los archivos
+        se identifica por su hash, por lo que archivos con el mismo contenido
+        (por ejemplo, el mismo archivo con distintos tags) comparten el mismo
+        fichero en el almacén.
+
+        Los archivos de un directorio de datos creado por una versión
+        anterior del servidor, que almacenaba cada archivo en la ruta
+        indicada por el campo C{path} de su documento, se añaden al almacén
+        la primera vez que se abre el directorio.
+        """
+        blobs_dir = os.path.join(self._data_dir, 'files')
+        legacy_dir = os.path.join(self._data_dir, 'files.legacy')
+        legacy_docs = self._legacy_documents()
+        if legacy_docs and os.path.isdir(blobs_dir) and not os.path.isdir(legacy_dir):
+            # The files are moved out of the blob store directory before
+            # it is opened, so they are not counted as used space.
+            os.rename(blobs_dir, legacy_dir)
+        self._blobs = BlobStore(blobs_dir,
+                                os.path.join(self._data_dir, 'uploads'),
+                                os.path.join(self._data_dir, 'usage.json'))
+        if legacy_docs:
+            self._import_legacy_files(legacy_docs, legacy_dir)
+        if os.path.isdir(legacy_dir):
+            shutil.rmtree(legacy_dir)
+        self._uploads = {}
+        self._uploads_mutex = threading.Lock()
+
+    def _legacy_documents(self):
+        """
+        Obtiene los documentos del índice que referencian el contenido de
+        su archivo por su ruta en lugar de por su hash en el almacén.
+
+        @rtype: C{list}
+        @return: Lista con los campos almacenados de los documentos.
+        """
+        with self._searchers.searcher() as searcher:
+            return [doc for doc in searcher.reader().all_stored_fields()
+                    if 'path' in doc and 'blob' not in doc]
+
+    def _import_legacy_files(self, docs, legacy_dir):
         """
-        self._files_dir = os.path.join(self._data_dir, 'files')
-        if not os.path.isdir(self._files_dir):
-            os.mkdir(self._files_dir)
+        Añade al almacén de contenidos los archivos almacenados por una
+        versión anterior del servidor y reemplaza en sus documentos la ruta
+        del archivo por el hash de su contenido. Si el servidor termina
+        antes de aplicar la modificación al índice, la importación se repite
+        al abrir nuevamente el directorio de datos.
+
+        @type docs: C{list}
+        @param docs: Lista con los campos almacenados de los documentos
+            retornados por el método C{_legacy_documents}.
+
+        @type legacy_dir: C{str}
+        @param legacy_dir: Ruta absoluta al directorio con los archivos.
+        """
+        pinned = []
+        writer = self._index.writer()
+        try:
+            for doc in docs:
+                fields = dict((str(name), value) for name, value in doc.iteritems()
+                              if name != 'path')
+                fields['blob'] = u''
+                if doc['action'] != 'delete':
+                    blob_writer = self._blobs.writer()
+                    try:
+                        with open(os.path.join(legacy_dir, doc['path']), 'rb') as file:
+                            chunk = file.read(TRANSFER_CHUNK_SIZE)
+                            while chunk:
+                                blob_writer.write(chunk)
+                                chunk = file.read(TRANSFER_CHUNK_SIZE)
+                    except IOError:
+                        # The content of the file was lost, reading the
+                        # file fails as if it was removed from the store.
+                        blob_writer.discard()
+                    else:
+                        self._blobs.add(blob_writer, doc['type'])
+                        fields['blob'] = blob_writer.digest().decode(self._encoding)
+                        pinned.append(blob_writer.digest())
+                writer.delete_by_term('hash', doc['hash'])
+                writer.add_document(**fields)
+        except Exception:
+            writer.cancel()
+            raise
+        writer.commit()
+        for blob in pinned:
+            self._blobs.unpin(blob)
+        self._searchers.clean()
             
+    def _init_data_channel(self):
+        """
+        Inicializa el canal de datos utilizado para transferir el contenido
+        de los archivos sin utilizar Pyro.
+        """
+        self._data_channel = DataChannel(self._address)
+
     def _init_status(self, capacity):
         """
-        Inicializa el diccionario de estado de este servidor de TagFS. Este 
-        diccionario es el que se les envía a los clientes como respuesta
-        del método C{status()}.
+        Inicializa la información de estado de este servidor de TagFS que
+        se les envía a los clientes como respuesta del método C{status()}.
         
-        Actualmente este diccionario contiene información acerca de la 
-        capacidad de almacenamiento de este servidor TagFS y la cantidad
-        de espacio libre.
+        Actualmente esta información es la capacidad de almacenamiento de
+        este servidor TagFS. La cantidad de espacio libre se calcula a
+        partir del registro de bytes utilizados del almacén de contenidos,
+        por lo que no es necesario recorrer el directorio de datos.
         
         @type capacity: C{int}
         @param capacity: Capacidad de almacenamiento en bytes de este servidor.
@@ -129,22 +283,165 @@ class RemoteTagFSServer(object):
             archivos almacenados en este servidor no sobrepasará esta
             capacidad.        
         """
-        self._status = {}
-        self._status['capacity'] = long(capacity)
-        # Calculate the space used in the data directory.
-        data_dir_size = 0L
-        get_file_size_root = lambda root, file: os.path.getsize(os.path.join(root, file))
-        for root, _, files in os.walk(self._data_dir):
-            get_file_size = lambda file: get_file_size_root(root, file)
-            data_dir_size += sum(map(get_file_size, files))
-        self._status['empty_space'] = capacity - data_dir_size
+        self._capacity = long(capacity)
         
+    def _init_committer(self):
+        """
+        Inicializa el hilo que aplica en lotes las modificaciones al índice.
+        Las modificaciones se registran en un fichero del directorio de datos
+        antes de confirmarse a los clientes, por lo que no se pierden si el
+        servidor termina antes de aplicarlas al índice.
+        """
+        self._committer = IndexCommitter(self._index,
+                                         os.path.join(self._data_dir, 'index.log'),
+                                         self._index_committed,
+                                         self._index_discarded)
+
+    def _index_committed(self, ops):
+        """
+        Método ejecutado después de aplicar al índice un lote de
+        modificaciones. Registra las acciones realizadas en el registro de
+        modificaciones, elimina del almacén los contenidos de los archivos
+        reemplazados o eliminados que ningún otro archivo comparte y los
+        ficheros de las generaciones anteriores del índice.
+
+        @type ops: C{list}
+        @param ops: Lista de las modificaciones aplicadas.
+        """
+        for op in ops:
+            file_hash = op['hash'].encode(self._encoding)
+            was_live = self._merkle.is_live(file_hash)
+            if op['fields'] is None:
+                self._merkle.discard(file_hash)
+            else:
+                action, time = op['fields']['action'], float(op['fields']['time'])
+                self._merkle.update(file_hash, action, time)
+                self._changes.append(file_hash, action, time)
+            is_live = self._merkle.is_live(file_hash)
+            with self._filter_mutex:
+                count = int(is_live) - int(was_live)
+                if self._adds_file(op) and self._filter_pending.get(file_hash):
+                    # The file was added to the filter when the operation
+                    # was submitted.
+                    self._unpend_filter(file_hash)
+                    count -= 1
+                if count > 0:
+                    self._hash_filter.add(file_hash)
+                elif count < 0:
+                    self._hash_filter.remove(file_hash)
+        for op in ops:
+            if op['pin']:
+                self._blobs.unpin(op['pin'])
+        for op in ops:
+            if op['release']:
+                self._release_blob(op['release'])
+        self._searchers.clean()
+
+    def _index_discarded(self, ops):
+        """
+        Método ejecutado cuando se descartan modificaciones que no se
+        pudieron aplicar al índice. Los contenidos que protegían se eliminan
+        del almacén si ningún archivo los referencia.
+
+        @type ops: C{list}
+        @param ops: Lista de las modificaciones descartadas.
+        """
+        self._unfilter_pending(ops)
+        for op in ops:
+            if op['pin']:
+                self._blobs.unpin(op['pin'])
+                self._release_blob(op['pin'])
+
+    def _submit(self, ops):
+        """
+        Registra modificaciones del índice con C{self._committer}. Los
+        archivos que se añaden se incluyen en el filtro de Bloom antes de
+        registrarlas, ya que se pueden obtener en cuanto se registran.
+
+        @type ops: C{list}
+        @param ops: Lista de las modificaciones.
+        """
+        with self._filter_mutex:
+            for op in ops:
+                if self._adds_file(op):
+                    file_hash = op['hash'].encode(self._encoding)
+                    self._filter_pending[file_hash] = self._filter_pending.get(file_hash, 0) + 1
+                    self._hash_filter.add(file_hash)
+        try:
+            self._committer.submit(ops)
+        except Exception:
+            self._unfilter_pending(ops)
+            raise
+
+    def _unfilter_pending(self, ops):
+        """
+        Elimina del filtro de Bloom los archivos añadidos por modificaciones
+        registradas con el método C{_submit} que no se van a aplicar.
+
+        @type ops: C{list}
+        @param ops: Lista de las modificaciones.
+        """
+        with self._filter_mutex:
+            for op in ops:
+                file_hash = op['hash'].encode(self._encoding)
+                if self._adds_file(op) and self._filter_pending.get(file_hash):
+                    self._unpend_filter(file_hash)
+                    self._hash_filter.remove(file_hash)
+
+    def _unpend_filter(self, file_hash):
+        """
+        Descuenta una modificación pendiente que añade un archivo. Se tiene
+        que llamar con C{self._filter_mutex} adquirido.
+        """
+        count = self._filter_pending[file_hash]
+        if count > 1:
+            self._filter_pending[file_hash] = count - 1
+        else:
+            del self._filter_pending[file_hash]
+
+    def _adds_file(self, op):
+        """
+        Determina si una modificación del índice añade un archivo.
+        """
+        return op['fields'] is not None and op['fields']['action'] != 'delete'
+
+    def _document(self, file_hash, searcher=None):
+        """
+        Obtiene los campos almacenados del documento del índice asociado a
+        un hash, teniendo en cuenta las modificaciones que todavía no se han
+        aplicado al índice.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo.
+
+        @type searcher: C{whoosh.searching.Searcher}
+        @param searcher: Instancia utilizada para buscar en el índice. Si no
+            se especifica se obtiene una instancia de C{self._searchers}.
+
+        @rtype: C{dict}
+        @return: Campos almacenados del documento o C{None} si no existe
+            un documento asociado al hash dado.
+        """
+        file_hash = file_hash.decode(self._encoding)
+        is_pending, fields = self._committer.pending(file_hash)
+        if is_pending:
+            return fields
+        if searcher is None:
+            with self._searchers.searcher() as searcher:
+                return searcher.document(hash=file_hash)
+        return searcher.document(hash=file_hash)
+
     def _init_autodiscovery(self):
         """
         Inicializa el descubrimiento automático de los servidores.
         """
         self._servers = {}
         self._servers_mutex = threading.Lock()                
+        # Merkle tree digests of each server after the last synchronization.
+        self._sync_state = {}
+        # Epoch and sequence number of the last change pulled from each server.
+        self._feed_state = {}
+        self._sync_pool = WorkerPool(SYNC_WORKERS)
         self.addService = self._server_added
         self.removeService = self._server_removed
         self._zeroconf = Zeroconf.Zeroconf(self._address)
@@ -171,6 +468,9 @@ class RemoteTagFSServer(object):
             with self._servers_mutex:
                 pyro_proxy = Pyro.core.getProxyForURI(pyro_uri)            
                 self._servers[pyro_uri] = pyro_proxy
+            if self._under_replicated:
+                # The new server may store the missing replicas.
+                self._request_repair()
         
     def _server_removed(self, zeroconf, service_type, service_name):
         """
@@ -192,47 +492,624 @@ class RemoteTagFSServer(object):
         if pyro_uri != self._pyro_uri:
             with self._servers_mutex:
                 del self._servers[pyro_uri]
+                self._sync_state.pop(pyro_uri, None)
+                self._feed_state.pop(pyro_uri, None)
+            # The replicas stored in the server are no longer available.
+            self._request_repair()
+
+    def _file_hash(self, file_info):
+        """
+        Calcula el hash que identifica a un archivo en el sistema de
+        ficheros distribuido a partir de sus etiquetas y su nombre.
+
+        @type file_info: C{dict}
+        @param file_info: Diccionario con los metadatos del archivo.
+
+        @rtype: C{str}
+        @return: Hash del archivo.
+        """
+        return get_file_hash(file_info['tags'], file_info['name'], self._encoding)
             
     def _sync_servers(self):
         """
         Método que garantiza la sincronización de los servidores.
+
+        Cada medio segundo se obtienen de los demás servidores las modificaciones
+        realizadas desde la última consulta y periódicamente se realiza una
+        sincronización completa, que recupera las modificaciones que ya no
+        están disponibles en el registro del otro servidor.
         """
         sync_sleep = 30 # seconds
+        pull_sleep = 0.5 # seconds
         self._sync_cond = threading.Condition()
         self._sync_continue = True
+        next_sync = 0
         while self._sync_continue:
-            with self._servers_mutex:
-                self._mrsw_lock.write_in()
-                try:
-                    searcher = self._index.searcher()
-                    reader = self._index.reader()
-                    for hash in reader.lexicon('hash'):
-                        action = self.action(hash, True)
-                        best_server = None
-                        best_action = None
-                        for server in self._servers.itervalues():
-                            server_action = server.action(hash)
-                            if (server_action and 
-                                server_action[1] > action[1]):
-                                best_action = server_action
-                                best_server = server
-                        if best_action:
-                            if best_action[0] == 'delete':
-                                self.remove(hash, True)
-                            else:
-                                self._update_file(hash, best_server, True)                                                    
-                finally:
-                    self._mrsw_lock.write_out()
+            # Pulling first records the last change of the new servers.
+            if not self._pull_changes() or time.time() >= next_sync:
+                self._synchronize()
+                next_sync = time.time() + sync_sleep
             self._sync_cond.acquire()
-            self._sync_cond.wait(sync_sleep)
+            self._sync_cond.wait(pull_sleep)
             self._sync_cond.release()
+
+    def _pull_changes(self):
+        """
+        Aplica las modificaciones realizadas en los demás servidores
+        conocidos desde la última vez que se consultaron. Los servidores se
+        consultan en paralelo sin bloquear la lista de servidores.
+
+        @rtype: C{bool}
+        @return: C{True} si se obtuvieron todas las modificaciones, C{False}
+            si algún servidor ya no conserva en su registro modificaciones
+            que no se han obtenido y hay que realizar una sincronización
+            completa.
+        """
+        with self._servers_mutex:
+            servers = self._servers.items()
+        tasks = [self._sync_pool.submit(self._pull_server_changes, pyro_uri, server)
+                 for pyro_uri, server in servers]
+        complete = True
+        for task in tasks:
+            try:
+                complete = task.result() and complete
+            except Exception:
+                # Ignoring any exception here. The changes will be
+                # pulled again in the next iteration.
+                pass
+        return complete
+
+    def _pull_server_changes(self, pyro_uri, server):
+        """
+        Aplica las modificaciones realizadas en otro servidor desde la
+        última vez que se consultó. Sólo se consideran los archivos de los
+        que este servidor tiene información.
+
+        @type pyro_uri: C{str}
+        @param pyro_uri: URI de PyRO del otro servidor.
+
+        @type server: C{Pyro.core.DynamicProxy}
+        @param server: Servidor del que se obtienen las modificaciones.
+
+        @rtype: C{bool}
+        @return: C{False} si hay que realizar una sincronización completa
+            con el otro servidor, C{True} en caso contrario.
+        """
+        epoch, seq = self._feed_state.get(pyro_uri, (None, 0))
+        while True:
+            server_epoch, last_seq, changes = server.changes(epoch, seq)
+            if changes is None:
+                # The changes after seq are no longer available or the
+                # other server was restarted.
+                self._feed_state[pyro_uri] = (server_epoch, last_seq)
+                return False
+            if not changes:
+                return True
+            # Only the last change of each file is applied.
+            actions = {}
+            for _, file_hash, action, time in changes:
+                actions[file_hash] = (action, time)
+            local_actions = self.action_many(actions.keys())
+            for file_hash, action in actions.iteritems():
+                local_action = local_actions.get(file_hash)
+                if local_action is not None and action[1] > local_action[1]:
+                    self._apply_action(file_hash, action, server)
+            seq = changes[-1][0]
+            self._feed_state[pyro_uri] = (epoch, seq)
+            if len(changes) < MAX_PULLED_CHANGES:
+                return True
+
+    def changes(self, epoch, seq):
+        """
+        Obtiene las modificaciones realizadas en este servidor después de
+        una dada. Lo utilizan los demás servidores para replicar los cambios
+        sin realizar una sincronización completa.
+
+        @type epoch: C{str}
+        @param epoch: Época del registro de modificaciones en la que se
+            obtuvo el número de secuencia, C{None} si no se conoce.
+
+        @type seq: C{long}
+        @param seq: Número de secuencia de la última modificación conocida.
+
+        @rtype: C{tuple}
+        @return: Tupla con la época del registro, el número de secuencia de
+            la última modificación y una lista de a lo sumo
+            C{MAX_PULLED_CHANGES} tuplas C{(seq, hash, action, time)} con
+            las modificaciones posteriores. La lista es C{None} si la época
+            no coincide o las modificaciones ya no están en el registro.
+        """
+        last_seq = self._changes.last_seq()
+        if epoch == self._changes.epoch:
+            changes = self._changes.since(seq, MAX_PULLED_CHANGES)
+        else:
+            changes = None
+        return (self._changes.epoch, last_seq, changes)
             
-    def _update_file(self, file_hash, server, safe=False):
+    def _synchronize(self):
+        """
+        Sincroniza los archivos de este servidor con los de los demás
+        servidores conocidos.
+
+        Los servidores comparan sus árboles de Merkle y sólo se consultan
+        las acciones de los archivos de las hojas que difieren. Además, una
+        hoja que ya se comparó en la sincronización anterior no se vuelve a
+        comparar mientras no cambie en ninguno de los dos servidores, por lo
+        que si no hay cambios la sincronización con cada servidor requiere
+        una única llamada remota.
+
+        Las llamadas remotas a los servidores y la transferencia de los
+        archivos se realizan en paralelo y sin bloquear la lista de
+        servidores. Cada archivo sólo se bloquea mientras se aplica la
+        acción elegida.
+        """
+        with self._servers_mutex:
+            servers = self._servers.items()
+        local_digests = self._merkle.digests(merkle.prefixes())
+        # Tombstones that every known server has acknowledged, i.e.
+        # servers that also removed the file or do not have it.
+        tombstones = self._merkle.tombstones()
+        tasks = [(pyro_uri, server,
+                  self._sync_pool.submit(self._server_actions, server, local_digests,
+                                         self._sync_state.get(pyro_uri), tombstones.keys()))
+                 for pyro_uri, server in servers]
+        server_states = {}
+        all_server_actions = []
+        for pyro_uri, server, task in tasks:
+            try:
+                server_digests, server_actions = task.result()
+            except Exception:
+                # Ignoring any exception here. The server will be
+                # synchronized again in the next iteration.
+                tombstones = {}
+                continue
+            for hash, server_action in server_actions.iteritems():
+                if server_action[0] != 'delete':
+                    tombstones.pop(hash, None)
+            server_states[pyro_uri] = (server_digests, local_digests)
+            all_server_actions.append((server, server_actions))
+        best_actions = self.action_many(set(hash for _, server_actions in all_server_actions
+                                            for hash in server_actions))
+        best_servers = {}
+        for server, server_actions in all_server_actions:
+            for hash, server_action in server_actions.iteritems():
+                best_action = best_actions.get(hash)
+                if (best_action is not None and
+                    server_action[1] > best_action[1]):
+                    best_actions[hash] = server_action
+                    best_servers[hash] = server
+        tasks = [self._sync_pool.submit(self._apply_action, hash, best_actions[hash], best_server)
+                 for hash, best_server in best_servers.iteritems()]
+        synchronized = True
+        for task in tasks:
+            try:
+                task.result()
+            except Exception:
+                # Ignoring any exception here. The file will be
+                # synchronized again in the next iteration.
+                synchronized = False
+        with self._servers_mutex:
+            if synchronized:
+                self._sync_state.update((pyro_uri, state)
+                                        for pyro_uri, state in server_states.iteritems()
+                                        if pyro_uri in self._servers)
+            else:
+                # Compare every diverged leaf in the next iteration.
+                self._sync_state = {}
+        if self._expire_tombstones(tombstones) > 0:
+            # Physically remove the expired tombstones from the index.
+            self._committer.optimize()
+
+    def _server_actions(self, server, local_digests, state, tombstone_hashes):
+        """
+        Obtiene de otro servidor las acciones realizadas sobre los archivos
+        que hay que comparar durante la sincronización.
+
+        @type server: C{Pyro.core.DynamicProxy}
+        @param server: Servidor con el que se sincroniza.
+
+        @type local_digests: C{dict}
+        @param local_digests: Resúmenes de todos los nodos del árbol de
+            Merkle de este servidor, indexados por su prefijo.
+
+        @type state: C{tuple}
+        @param state: Estado de la sincronización anterior con el otro
+            servidor, como se describe en el método C{_diverged_leaves}.
+
+        @type tombstone_hashes: C{list}
+        @param tombstone_hashes: Lista con los identificadores de los
+            archivos eliminados en este servidor.
+
+        @rtype: C{tuple}
+        @return: Tupla con los resúmenes de los nodos del otro servidor y el
+            diccionario retornado por su método C{action_many}.
+        """
+        server_digests, leaves = self._diverged_leaves(server, local_digests, state)
+        hashes = self._merkle.hashes(leaves) + tombstone_hashes
+        if hashes:
+            server_actions = server.action_many(hashes)
+        else:
+            server_actions = {}
+        return server_digests, server_actions
+
+    def _diverged_leaves(self, server, local_digests, state):
+        """
+        Determina las hojas del árbol de Merkle cuyos archivos hay que
+        comparar con otro servidor. Se desciende por el árbol del otro
+        servidor sólo en los nodos que difieren de los de este servidor y
+        que cambiaron desde la sincronización anterior.
+
+        @type server: C{Pyro.core.DynamicProxy}
+        @param server: Servidor con el que se sincroniza.
+
+        @type local_digests: C{dict}
+        @param local_digests: Resúmenes de todos los nodos del árbol de este
+            servidor, indexados por su prefijo.
+
+        @type state: C{tuple}
+        @param state: Tupla con los resúmenes de los nodos del otro servidor
+            y de este servidor en la sincronización anterior, C{None} si
+            no se han sincronizado.
+
+        @rtype: C{tuple}
+        @return: Tupla con los resúmenes de los nodos del otro servidor y el
+            conjunto de los prefijos de las hojas que hay que comparar.
+        """
+        last_server_digests, last_local_digests = state or ({}, {})
+        server_digests = {}
+        leaves = set()
+        nodes = ['']
+        while nodes:
+            fetched = server.merkle_digests(nodes)
+            server_digests.update(fetched)
+            nodes = []
+            for prefix, digest in fetched.iteritems():
+                if digest == local_digests[prefix]:
+                    # This subtree is equal in both servers.
+                    for node, node_digest in local_digests.iteritems():
+                        if node.startswith(prefix):
+                            server_digests[node] = node_digest
+                elif len(prefix) == merkle.LEAF_PREFIX_LENGTH:
+                    leaves.add(prefix)
+                elif digest != last_server_digests.get(prefix):
+                    nodes.extend(merkle.children(prefix))
+                else:
+                    # The other server did not change this subtree since
+                    # the last synchronization, only the leaves that
+                    # changed in this server have to be compared.
+                    for node, node_digest in last_server_digests.iteritems():
+                        if node.startswith(prefix):
+                            server_digests[node] = node_digest
+                            if (len(node) == merkle.LEAF_PREFIX_LENGTH and
+                                node_digest != local_digests[node] and
+                                local_digests[node] != last_local_digests.get(node)):
+                                leaves.add(node)
+        return server_digests, leaves
+
+    def merkle_digests(self, prefixes):
+        """
+        Obtiene los resúmenes de varios nodos del árbol de Merkle de la
+        última acción realizada sobre cada archivo de este servidor. Lo
+        utilizan los demás servidores durante la sincronización.
+
+        @type prefixes: C{list}
+        @param prefixes: Lista con los prefijos de los hashes de los
+            archivos que corresponden a cada nodo. El prefijo vacío
+            corresponde a la raíz.
+
+        @rtype: C{dict}
+        @return: Diccionario con el resumen de cada nodo, indexado por su
+            prefijo.
+        """
+        return self._merkle.digests(prefixes)
+
+    def _expire_tombstones(self, tombstones):
+        """
+        Elimina del índice los documentos que indican que un archivo fue
+        eliminado, una vez que todos los servidores conocidos eliminaron el
+        archivo. Un documento no se elimina si mientras tanto se realizó
+        otra acción sobre el archivo.
+
+        @type tombstones: C{dict}
+        @param tombstones: Diccionario con el identificador de tiempo de la
+            eliminación de cada archivo, indexado por el hash del archivo.
+
+        @rtype: C{int}
+        @return: Cantidad de documentos eliminados del índice.
+        """
+        file_hashes = tombstones.keys()
+        self._file_locks.acquire_many(file_hashes)
+        try:
+            ops = []
+            for file_hash in file_hashes:
+                if self.action(file_hash) == ('delete', tombstones[file_hash]):
+                    ops.append({'hash': file_hash.decode(self._encoding),
+                                'fields': None, 'pin': None, 'release': None})
+            if ops:
+                self._submit(ops)
+            return len(ops)
+        finally:
+            self._file_locks.release_many(file_hashes)
+
+    def _init_repair(self):
+        """
+        Inicializa el estado de la reparación de los archivos que tienen
+        menos réplicas que las indicadas al añadirlos.
+        """
+        # Hashes of the files found under-replicated in the last search.
+        self._under_replicated = set()
+        self._repair_cond = threading.Condition()
+        self._repair_requested = False
+        self._repair_continue = True
+
+    def _request_repair(self):
+        """
+        Solicita que se busquen y reparen los archivos con menos réplicas
+        que las indicadas sin esperar a la próxima búsqueda periódica.
+        """
+        with self._repair_cond:
+            self._repair_requested = True
+            self._repair_cond.notify()
+
+    def _repair_files(self):
+        """
+        Método ejecutado por el hilo que busca periódicamente los archivos
+        de este servidor que tienen menos réplicas que las indicadas al
+        añadirlos y los copia a otros servidores con capacidad disponible.
+        Las copias se realizan una a una, esperando C{REPAIR_DELAY}
+        segundos entre ellas para no afectar el servicio a los clientes.
+        """
+        while self._repair_continue:
+            with self._repair_cond:
+                if not self._repair_requested:
+                    self._repair_cond.wait(REPAIR_INTERVAL)
+                self._repair_requested = False
+            if not self._repair_continue:
+                break
+            with self._servers_mutex:
+                servers = self._servers.items()
+            holders, capacities = self._replica_holders(servers)
+            self._under_replicated = set(holders)
+            for file_hash, (replicas, file_holders) in sorted(holders.iteritems()):
+                if not self._repair_continue:
+                    break
+                # Only one of the servers storing the file repairs it.
+                if min(file_holders) != self._pyro_uri:
+                    continue
+                try:
+                    if self._repair_file(file_hash, replicas, file_holders,
+                                         servers, capacities):
+                        self._under_replicated.discard(file_hash)
+                except Exception:
+                    # Ignoring any exception here. The file will be
+                    # repaired again in the next search.
+                    pass
+                with self._repair_cond:
+                    self._repair_cond.wait(REPAIR_DELAY)
+
+    def _replica_holders(self, servers):
+        """
+        Busca los archivos de este servidor que tienen menos réplicas que
+        las indicadas al añadirlos y obtiene el espacio disponible en los
+        demás servidores. Los archivos almacenados con un código de borrado
+        no se consideran. Se espera a lo sumo C{REPAIR_TIMEOUT} segundos
+        por la respuesta de cada servidor; los servidores que no responden
+        no se cuentan entre los que almacenan los archivos ni entre los que
+        pueden recibir copias.
+
+        @type servers: C{list}
+        @param servers: Lista de tuplas con la URI de PyRO y el servidor de
+            cada uno de los demás servidores conocidos.
+
+        @rtype: C{tuple}
+        @return: Tupla con un diccionario indexado por el hash de cada
+            archivo con menos réplicas que las indicadas con una tupla que
+            contiene la cantidad de réplicas indicada y la lista de las URI
+            de los servidores que almacenan el archivo, y un diccionario con
+            el espacio disponible en bytes en cada servidor que respondió,
+            indexado por su URI.
+        """
+        replicas = {}
+        with self._searchers.searcher() as searcher:
+            for doc in searcher.reader().all_stored_fields():
+                if (doc['action'] == 'add' and doc.get('replicas') and
+                    not doc.get('fragment') and int(doc['replicas']) > 1):
+                    replicas[doc['hash'].encode(self._encoding)] = int(doc['replicas'])
+        if not replicas:
+            return ({}, {})
+        holders = dict((file_hash, [self._pyro_uri]) for file_hash in replicas)
+        capacities = {}
+        tasks = [(pyro_uri, self._sync_pool.submit(self._query_replicas, server, replicas.keys()))
+                 for pyro_uri, server in servers]
+        for pyro_uri, task in tasks:
+            try:
+                server_actions, capacity = task.result()
+            except Exception:
+                # Ignoring any exception here. The server may store some of
+                # the files, which then get an extra replica.
+                continue
+            for file_hash, server_action in server_actions.iteritems():
+                if server_action[0] == 'add':
+                    holders[file_hash].append(pyro_uri)
+            capacities[pyro_uri] = capacity['empty_space']
+        holders = dict((file_hash, (replicas[file_hash], holders[file_hash]))
+                       for file_hash in replicas
+                       if len(holders[file_hash]) < replicas[file_hash])
+        return (holders, capacities)
+
+    def _query_replicas(self, server, file_hashes):
+        """
+        Obtiene de otro servidor la última acción realizada sobre varios
+        archivos y su espacio disponible, mediante una conexión propia que
+        espera a lo sumo C{REPAIR_TIMEOUT} segundos por cada respuesta.
+
+        @type server: C{Pyro.core.DynamicProxy}
+        @param server: Servidor.
+
+        @type file_hashes: C{list}
+        @param file_hashes: Lista con los identificadores de los archivos.
+
+        @rtype: C{tuple}
+        @return: Tupla con el diccionario retornado por el método
+            C{action_many} del servidor y el retornado por su método
+            C{capacity}.
+        """
+        proxy = copy.copy(server)
+        proxy._setTimeout(REPAIR_TIMEOUT)
+        try:
+            return (proxy.action_many(file_hashes), proxy.capacity())
+        finally:
+            proxy._release()
+
+    def _repair_file(self, file_hash, replicas, holders, servers, capacities):
+        """
+        Copia un archivo de este servidor a otros servidores con capacidad
+        disponible hasta completar la cantidad de réplicas indicada. Sólo
+        se consideran los servidores que respondieron al buscar los archivos
+        con menos réplicas.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo.
+
+        @type replicas: C{int}
+        @param replicas: Cantidad de réplicas indicada al añadir el archivo.
+
+        @type holders: C{list}
+        @param holders: Lista de las URI de PyRO de los servidores que
+            almacenan el archivo.
+
+        @type servers: C{list}
+        @param servers: Lista de tuplas con la URI de PyRO y el servidor de
+            cada uno de los demás servidores conocidos.
+
+        @type capacities: C{dict}
+        @param capacities: Diccionario con el espacio disponible en bytes en
+            cada servidor, indexado por su URI, como lo retorna el método
+            C{_replica_holders}. Se descuenta el tamaño de cada copia.
+
+        @rtype: C{bool}
+        @return: C{True} si el archivo tiene la cantidad de réplicas
+            indicada, C{False} en caso contrario.
+        """
+        doc = self._document(file_hash)
+        if doc is None or doc['action'] == 'delete':
+            return True
+        missing = replicas - len(holders)
+        size = long(doc['size'])
+        candidates = [(pyro_uri, server) for pyro_uri, server in servers
+                      if pyro_uri not in holders and capacities.get(pyro_uri, 0) >= size]
+        random.shuffle(candidates)
+        for pyro_uri, server in candidates:
+            if missing == 0:
+                break
+            try:
+                if server.replicate(file_hash, self._pyro_uri):
+                    capacities[pyro_uri] -= size
+                    missing -= 1
+            except Exception:
+                # Ignoring any exception here.
+                pass
+        return missing == 0
+
+    def replicate(self, file_hash, pyro_uri):
+        """
+        Copia a este servidor un archivo almacenado en otro servidor. Lo
+        utilizan los demás servidores para reparar los archivos que tienen
+        menos réplicas que las indicadas.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo.
+
+        @type pyro_uri: C{str}
+        @param pyro_uri: URI de PyRO del servidor que almacena el archivo.
+
+        @rtype: C{bool}
+        @return: C{True} si este servidor almacena el archivo, C{False} en
+            caso contrario.
+        """
+        with self._servers_mutex:
+            server = self._servers.get(pyro_uri)
+        if server is None:
+            return False
+        self._update_file(file_hash, server)
+        action = self.action(file_hash)
+        return action is not None and action[0] == 'add'
+
+    def _apply_action(self, file_hash, action, server):
+        """
+        Aplica en este servidor la última acción realizada sobre un archivo
+        en otro servidor.
+
+        Si el archivo se eliminó al cambiar su nombre o sus etiquetas con el
+        método C{update_metadata}, antes de eliminarlo se obtiene el archivo
+        con el nuevo hash, reutilizando el contenido almacenado en este
+        servidor. Si no se puede obtener, la eliminación no se aplica y se
+        vuelve a intentar en la próxima sincronización.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo.
+
+        @type action: C{tuple}
+        @param action: Tupla con la acción y su identificador de tiempo,
+            como la retornada por el método C{action}.
+
+        @type server: C{Pyro.core.DynamicProxy}
+        @param server: Servidor donde se realizó la acción.
+        """
+        if action[0] == 'delete':
+            renamed = None
+            local_action = self.action(file_hash)
+            if local_action is not None and local_action[0] != 'delete':
+                renamed = server.renamed(file_hash)
+                if renamed is not None:
+                    self._update_file(renamed, server)
+            self._file_locks.acquire(file_hash)
+            try:
+                if self._is_newer(file_hash, action[1]):
+                    op = self._remove_file_op(file_hash, time=action[1], renamed=renamed)
+                    if op is not None:
+                        self._submit([op])
+            finally:
+                self._file_locks.release(file_hash)
+        else:
+            self._update_file(file_hash, server)
+
+    def renamed(self, file_hash):
+        """
+        Obtiene el hash actual de un archivo eliminado en este servidor al
+        cambiar su nombre o sus etiquetas. Lo utilizan los demás servidores
+        para no perder su réplica del archivo al aplicar la eliminación.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo eliminado.
+
+        @rtype: C{str}
+        @return: Hash del archivo después de los cambios de nombre o de
+            etiquetas realizados sobre él, C{None} si el archivo no se
+            eliminó al cambiar su nombre o sus etiquetas o si ya no está
+            almacenado en este servidor.
+        """
+        visited = set()
+        doc = self._document(file_hash)
+        while doc is not None and doc['action'] == 'delete' and doc.get('renamed'):
+            file_hash = doc['renamed'].encode(self._encoding)
+            if file_hash in visited:
+                return None
+            visited.add(file_hash)
+            doc = self._document(file_hash)
+        if visited and doc is not None and doc['action'] != 'delete':
+            return file_hash
+        return None
+
+    def _update_file(self, file_hash, server):
         """
         Actualiza un fichero existente en este servidor.
         
         Actualiza un fichero almacenado en este servidor por el fichero 
-        identificado por el mismo hash en el servidor dado.
+        identificado por el mismo hash en el servidor dado. El contenido
+        del archivo se transfiere sin bloquear el acceso a los archivos de
+        este servidor y el archivo sólo se actualiza si mientras tanto no
+        se almacenó en este servidor una versión más reciente.
         
         @type file_hash: C{str}
         @param file_hash: Identificador del archivo cuyos datos se quiere 
@@ -240,20 +1117,71 @@ class RemoteTagFSServer(object):
             sistema de ficheros distribuidos, a partir de sus etiquetas y 
             su nombre.
             
-        @type server: TODO
-        @param server: Servidor que contiene el fichero del que se va a 
-        actualizar el local.
-        
-        @type safe: C{bool}
-        @param safe: Expresa si la ejecución es "thread safe" o si el 
-            método se tiene que encargar de la sincronización. Es falso por
-            defecto
+        @type server: C{Pyro.core.DynamicProxy}
+        @param server: Proxy de PyRO del servidor que contiene el fichero
+            del que se va a actualizar el local.
         """
-        data = server.get(file_hash)
         info = server.info(file_hash)
-        self.put(data, info, safe)
+        if info is None:
+            return
+        if info.get('fragment') is not None:
+            # Each server stores a different fragment of a file stored with
+            # an erasure code. A fragment of the same version is kept, it
+            # must not be replaced by the fragment of another server.
+            fragment = self._fragment(self._document(file_hash) or {})
+            if (fragment is not None and
+                fragment['version'] == info['fragment']['version']):
+                return
+        if info.get('blob') and self._blobs.pin(info['blob']):
+            # The content of the file is already stored in this server,
+            # only the metadata has to be updated.
+            blob, file_type = info['blob'], info['type']
+        else:
+            transfer = server.open_download(file_hash)
+            if transfer is None:
+                return
+            blob_writer = self._blobs.writer()
+            try:
+                for chunk in download(*transfer[:5]):
+                    blob_writer.write(chunk)
+            except Exception:
+                blob_writer.discard()
+                raise
+            blob, file_type = blob_writer.digest(), magic.whatis(blob_writer.header)
+            self._blobs.add(blob_writer, file_type)
+        self._file_locks.acquire(file_hash)
+        try:
+            if self._is_newer(file_hash, float(info['time'])):
+                self._submit([self._add_file_op(info, blob, file_type)])
+                return
+        finally:
+            self._file_locks.release(file_hash)
+        # A newer version of the file was stored while the content was
+        # transferred, the content may be no longer referenced.
+        self._blobs.unpin(blob)
+        self._release_blob(blob)
+
+    def _is_newer(self, file_hash, time):
+        """
+        Determina si la última acción realizada en otro servidor sobre un
+        archivo es posterior a la última acción realizada en este servidor.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo.
+
+        @type time: C{float}
+        @param time: Identificador de tiempo de la acción realizada en el
+            otro servidor.
+
+        @rtype: C{bool}
+        @return: C{True} si la acción del otro servidor es posterior o este
+            servidor no tiene información sobre el archivo, C{False} en caso
+            contrario.
+        """
+        action = self.action(file_hash)
+        return action is None or time > action[1]
             
-    def action(self, file_hash, safe=False):
+    def action(self, file_hash):
         """
         Obtiene la última acción que se realizó sobre ese equipo.
         
@@ -266,42 +1194,77 @@ class RemoteTagFSServer(object):
         @rtype: C{tuple}
         @return: Tupla que contiene como primer valor la acción que se realizó 
             sobre este y el identificador de tiempo en el que se realizó.
-            
-        @type safe: C{bool}
-        @param safe: Expresa si la ejecución es "thread safe" o si el 
-            método se tiene que encargar de la sincronización. Es falso por
-            defecto
         """
-        if not safe:
-            self._mrsw_lock.read_in()
-        try:
-            searcher = self._index.searcher()
-            doc = searcher.document(hash=file_hash.decode(self._encoding))
-            if doc is not None:
-                return (doc['action'], doc['time'])
-            else:
-                return None
-        finally:
-            if not safe:
-                self._mrsw_lock.read_out()
+        doc = self._document(file_hash)
+        if doc is not None:
+            return (doc['action'], float(doc['time']))
+        else:
+            return None
+
+    def action_many(self, file_hashes):
+        """
+        Obtiene la última acción que se realizó sobre varios archivos con
+        una única llamada. Permite a los servidores comparar su estado sin
+        realizar una llamada remota por cada archivo.
+
+        @type file_hashes: C{list}
+        @param file_hashes: Lista con los identificadores de los archivos.
+
+        @rtype: C{dict}
+        @return: Diccionario indexado por el hash de cada archivo con la
+            tupla que retornaría el método C{action}. Los archivos sobre
+            los que este servidor no tiene información no se incluyen.
+        """
+        actions = {}
+        with self._searchers.searcher() as searcher:
+            for file_hash in file_hashes:
+                doc = self._document(file_hash, searcher)
+                if doc is not None:
+                    actions[file_hash] = (doc['action'], float(doc['time']))
+        return actions
         
-    def status(self):
+    def status(self, filter_state=None):
         """
         Brinda información a los clientes TagFS acerca del estado de este
         servidor. Por ejemplo: cantidad de espacio disponible para almacenar
         nuevos archivos.
+
+        @type filter_state: C{tuple}
+        @param filter_state: Tupla con la época y el número de secuencia de
+            la copia del filtro de Bloom de los archivos de este servidor
+            que tiene el cliente, C{(None, 0)} si no tiene una copia. Si se
+            especifica, la llave C{filter} contiene la tupla retornada por
+            el método C{changes} de la clase C{CountingBloomFilter} para
+            actualizar la copia.
         
         @rtype: C{dict}
         @return: Diccionario que contiene información acerca del estado 
             del servidor.
         """
-        self._mrsw_lock.read_in()
-        try:
-            return self._status
-        finally:
-            self._mrsw_lock.read_out()
+        status = self.capacity()
+        status['cache_hits'] = self._blobs.cache.hits
+        status['cache_misses'] = self._blobs.cache.misses
+        status['under_replicated'] = len(self._under_replicated)
+        if filter_state is not None:
+            status['filter'] = self._hash_filter.changes(*filter_state)
+        return status
         
-    def get(self, file_hash, safe=False):
+    def capacity(self):
+        """
+        Obtiene la capacidad de almacenamiento de este servidor. Los métodos
+        que almacenan archivos también la retornan, para que los clientes
+        no tengan que consultarla antes de cada archivo.
+
+        @rtype: C{dict}
+        @return: Diccionario con la capacidad C{capacity} y el espacio
+            disponible C{empty_space} en bytes.
+        """
+        capacity = {}
+        capacity['capacity'] = self._capacity
+        capacity['empty_space'] = self._capacity - self._blobs.used()
+        return capacity
+
+    def get(self, file_hash):
         """
         Obtiene el contenido del archivo identificado por C{file_hash}
         
@@ -314,90 +1277,502 @@ class RemoteTagFSServer(object):
         @rtype: C{str}
         @return: Contenido del archivo identificado por C{file_hash} si
             este archivo existe, C{None} si no hay almacenado en este
-            servidor un archivo identificado por el hash dado.
-            
-        @type safe: C{bool}
-        @param safe: Expresa si la ejecución es "thread safe" o si el 
-            método se tiene que encargar de la sincronización. Es falso por
-            defecto
+            servidor un archivo identificado por el hash dado. Se lanza
+            C{IOError} si este servidor sólo almacena un fragmento del
+            archivo; el contenido de estos archivos se obtiene con el método
+            C{open_download}.
         """
-        if not safe:
-            self._mrsw_lock.read_in()
-        try:
-            searcher = self._index.searcher()
-            doc = searcher.document(hash=file_hash.decode(self._encoding))
-            if doc is not None and doc['action'] != 'delete':
-                file_path = os.path.join(self._files_dir, doc['path'])
-                with open(file_path, 'rb') as file:
-                    return file.read()
-            else:
-                return None
-        finally:
-            if not safe:
-                self._mrsw_lock.read_out()
-        
+        found = self._read_blob(file_hash, self._blobs.read)
+        if found is not None:
+            self._check_complete(file_hash, found[0])
+            return found[1]
+        else:
+            return None
+
+    def get_range(self, file_hash, offset, length):
+        """
+        Obtiene una porción del contenido del archivo identificado por
+        C{file_hash}. Este método permite transferir archivos grandes en
+        partes de tamaño acotado.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo cuyos datos se quiere
+            obtener. Este hash identifica al archivo únicamente dentro del
+            sistema de ficheros distribuidos, a partir de sus etiquetas y
+            su nombre.
+
+        @type offset: C{int}
+        @param offset: Posición del primer byte que se quiere obtener.
+
+        @type length: C{int}
+        @param length: Cantidad máxima de bytes que se quiere obtener. Nunca
+            se retornarán más de C{TRANSFER_CHUNK_SIZE} bytes.
+
+        @rtype: C{str}
+        @return: Porción del contenido del archivo identificado por
+            C{file_hash} (una cadena vacía si C{offset} es mayor o igual
+            que el tamaño del archivo), C{None} si no hay almacenado en este
+            servidor un archivo identificado por el hash dado. Se lanza
+            C{IOError} si este servidor sólo almacena un fragmento del
+            archivo, como en el método C{get}.
+        """
+        found = self._read_blob(file_hash, self._blobs.open)
+        if found is not None:
+            with found[1] as file:
+                self._check_complete(file_hash, found[0])
+                file.seek(offset)
+                return file.read(min(length, TRANSFER_CHUNK_SIZE))
+        else:
+            return None
+
+    def _check_complete(self, file_hash, doc):
+        """
+        Lanza C{IOError} si un documento del índice corresponde a un
+        fragmento de un archivo almacenado con un código de borrado, cuyo
+        contenido no se puede retornar como el del archivo.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo.
+
+        @type doc: C{dict}
+        @param doc: Campos almacenados del documento.
+        """
+        if doc.get('fragment'):
+            raise IOError('File {0} is stored as erasure-coded fragments'.format(file_hash))
+
+    def open_download(self, file_hash):
+        """
+        Prepara la transferencia del contenido del archivo identificado por
+        C{file_hash} por el canal de datos de este servidor. Los contenidos
+        pequeños se envían desde la caché en memoria del almacén y los
+        demás directamente desde el fichero a la conexión, sin copiarlos a
+        la memoria del proceso. El contenido nunca se serializa con Pyro y
+        se recibe con la función C{tagfs.server.datachannel.download}.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo cuyos datos se quiere
+            obtener. Este hash identifica al archivo únicamente dentro del
+            sistema de ficheros distribuidos, a partir de sus etiquetas y
+            su nombre.
+
+        @rtype: C{tuple}
+        @return: Tupla con la dirección IP y el puerto del canal de datos,
+            el identificador de la transferencia, el tamaño en bytes del
+            contenido transferido, el algoritmo con el que está comprimido
+            (C{None} si no está comprimido) y el diccionario que describe el
+            fragmento si el archivo se almacenó con un código de borrado
+            (C{None} si este servidor almacena el archivo completo). El
+            diccionario del fragmento incluye además el tamaño C{size} del
+            archivo y el identificador de tiempo C{time} de su versión.
+            Retorna C{None} si no hay almacenado en este servidor un archivo
+            identificado por el hash dado.
+        """
+        found = self._read_blob(file_hash, self._blobs.open_cached)
+        if found is not None:
+            doc, (file, codec, size) = found
+            fragment = self._fragment(doc)
+            if fragment is not None:
+                fragment['size'] = long(doc['size'])
+                fragment['time'] = float(doc['time'])
+            token = self._data_channel.register(file)
+            return (self._data_channel.address, self._data_channel.port,
+                    token, size, codec, fragment)
+        else:
+            return None
+
+    def cancel_download(self, token):
+        """
+        Cancela una transferencia preparada con el método C{open_download}
+        que el cliente no va a utilizar, por ejemplo porque otro servidor
+        respondió antes.
+
+        @type token: C{str}
+        @param token: Identificador de la transferencia.
+        """
+        self._data_channel.cancel(token)
+
+    def _read_blob(self, file_hash, read):
+        """
+        Accede al contenido del archivo identificado por C{file_hash}. Las
+        lecturas no adquieren ningún lock, por lo que el contenido se puede
+        eliminar del almacén si el archivo se reemplaza entre la consulta
+        del índice y el acceso al contenido; en este caso se vuelve a
+        consultar el índice.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo.
+
+        @type read: C{function}
+        @param read: Método de C{BlobStore} que recibe el hash del contenido
+            y lanza C{IOError} si no está almacenado, por ejemplo C{open} o
+            C{read}.
+
+        @rtype: C{tuple}
+        @return: Tupla con los campos almacenados del documento del archivo
+            y el resultado del método C{read}, C{None} si no hay almacenado
+            en este servidor un archivo identificado por el hash dado.
+        """
+        blob = None
+        doc = self._document(file_hash)
+        while doc is not None and doc['action'] != 'delete':
+            if doc['blob'] == blob:
+                raise IOError('Content of file {0} is missing'.format(file_hash))
+            blob = doc['blob']
+            try:
+                return (doc, read(blob))
+            except IOError:
+                doc = self._document(file_hash)
+        return None
+
     def put(self, file_data, file_info, safe=False):
         """
-        Almacena un nuevo archivo en este servidor del sistema de 
+        Almacena un nuevo archivo en este servidor del sistema de
         archivos distribuidos.
-        
+
         @type file_data: C{str}
         @param file_data: Contenido del archivo que se quiere almacenar.
-        
+
         @type file_info: C{dict}
         @param file_info: Diccionario con los metadatos del archivo.
-        
+
         @type safe: C{bool}
-        @param safe: Expresa si la ejecución es "thread safe" o si el 
+        @param safe: Expresa si la ejecución es "thread safe" o si el
             método se tiene que encargar de la sincronización. Es falso por
-            defecto         
+            defecto
+
+        @rtype: C{dict}
+        @return: Diccionario retornado por el método C{commit_upload}.
+        """
+        upload_id = self.open_upload(file_info)
+        self.put_chunk(upload_id, file_data)
+        return self.commit_upload(upload_id, safe)
+
+    def open_upload(self, file_info, chain=()):
+        """
+        Inicia la transferencia por partes de un nuevo archivo hacia este
+        servidor. El contenido del archivo se envía utilizando el método
+        C{put_chunk} y el archivo se almacena al llamar al método
+        C{commit_upload}.
+
+        Si se especifica una cadena de servidores, este servidor reenvía la
+        transferencia al primero de ellos que la acepte, indicándole el resto
+        de la cadena, de modo que el cliente sólo envía el contenido del
+        archivo una vez. Las porciones se reenvían mediante una instancia de
+        C{UploadForwarder}, sin esperar a que el siguiente servidor las
+        reciba. Si un servidor de la cadena falla durante la transferencia,
+        los servidores que le siguen no reciben el archivo.
+
+        @type file_info: C{dict}
+        @param file_info: Diccionario con los metadatos del archivo.
+
+        @type chain: C{list}
+        @param chain: Lista con las URI de PyRO de los servidores a los que
+            se debe reenviar el archivo, en orden.
+
+        @rtype: C{str}
+        @return: Identificador de la transferencia.
+        """
+        forward = None
+        for index, pyro_uri in enumerate(chain):
+            server = Pyro.core.getProxyForURI(pyro_uri)
+            # The next server also waits for the rest of the chain.
+            server._setTimeout(FORWARD_TIMEOUT * (len(chain) - index))
+            try:
+                forward = UploadForwarder(server, server.open_upload(file_info, chain[index + 1:]))
+            except Exception:
+                # Ignoring any exception here. The next server of the chain
+                # receives the file instead.
+                server._release()
+            else:
+                break
+        upload_id = uuid.uuid4().hex
+        with self._uploads_mutex:
+            self._uploads[upload_id] = (self._blobs.writer(), file_info, forward)
+        return upload_id
+
+    def put_chunk(self, upload_id, chunk):
+        """
+        Añade una porción del contenido de un archivo a una transferencia
+        iniciada con el método C{open_upload}. Las porciones se deben enviar
+        en el orden en que aparecen en el archivo.
+
+        @type upload_id: C{str}
+        @param upload_id: Identificador de la transferencia.
+
+        @type chunk: C{str}
+        @param chunk: Porción del contenido del archivo.
         """
+        with self._uploads_mutex:
+            blob_writer, _, forward = self._uploads[upload_id]
+        if forward is not None:
+            forward.send(chunk)
+        blob_writer.write(chunk)
+
+    def abort_upload(self, upload_id):
+        """
+        Cancela una transferencia iniciada con el método C{open_upload} y
+        descarta el contenido recibido hasta el momento.
+
+        @type upload_id: C{str}
+        @param upload_id: Identificador de la transferencia.
+        """
+        with self._uploads_mutex:
+            blob_writer, _, forward = self._uploads.pop(upload_id, (None, None, None))
+        if blob_writer is not None:
+            blob_writer.discard()
+        if forward is not None:
+            forward.abort()
+
+    def commit_upload(self, upload_id, safe=False):
+        """
+        Termina una transferencia iniciada con el método C{open_upload} y
+        almacena el archivo recibido en este servidor.
+
+        @type upload_id: C{str}
+        @param upload_id: Identificador de la transferencia.
+
+        @type safe: C{bool}
+        @param safe: Expresa si la ejecución es "thread safe" o si el
+            método se tiene que encargar de la sincronización. Es falso por
+            defecto
+
+        @rtype: C{dict}
+        @return: Diccionario indexado por la URI de PyRO de cada servidor
+            de la cadena de la transferencia que almacenó el archivo, este
+            incluido, con el diccionario retornado por su método
+            C{capacity} después de almacenar el archivo.
+        """
+        with self._uploads_mutex:
+            blob_writer, file_info, forward = self._uploads.pop(upload_id)
+        try:
+            # Save the content of the file in the blob store. The content is
+            # written only once even if it is shared by several files.
+            file_type = magic.whatis(blob_writer.header)
+            self._blobs.add(blob_writer, file_type)
+            file_hash = self._file_hash(file_info)
+            if not safe:
+                self._file_locks.acquire(file_hash)
+            try:
+                op = self._add_file_op(file_info, blob_writer.digest(), file_type)
+                self._submit([op])
+            finally:
+                if not safe:
+                    self._file_locks.release(file_hash)
+        except Exception:
+            if forward is not None:
+                forward.abort()
+            raise
+        # The file is acknowledged once every server of the chain stored it.
+        stored = {}
+        if forward is not None:
+            stored.update(forward.commit())
+        stored[str(self._pyro_uri)] = self.capacity()
+        return stored
+
+    def put_many(self, files, safe=False):
+        """
+        Almacena varios archivos en este servidor del sistema de archivos
+        distribuidos. Las modificaciones del índice de todos los archivos
+        se registran de una vez. Este método está pensado para archivos
+        pequeños; los archivos grandes se deben transferir por partes
+        utilizando el método C{open_upload}.
+
+        @type files: C{list}
+        @param files: Lista de tuplas de la forma C{(file_data, file_info)}
+            con el contenido y el diccionario con los metadatos de cada
+            archivo.
+
+        @type safe: C{bool}
+        @param safe: Expresa si la ejecución es "thread safe" o si el
+            método se tiene que encargar de la sincronización. Es falso por
+            defecto
+
+        @rtype: C{dict}
+        @return: Diccionario retornado por el método C{capacity}, con la
+            capacidad de este servidor después de almacenar los archivos.
+        """
+        blob_writers = []
+        for file_data, file_info in files:
+            blob_writer = self._blobs.writer()
+            blob_writer.write(file_data)
+            self._blobs.add(blob_writer, magic.whatis(blob_writer.header))
+            blob_writers.append(blob_writer)
+        file_hashes = [self._file_hash(file_info) for _, file_info in files]
         if not safe:
-            self._mrsw_lock.write_in()
+            self._file_locks.acquire_many(file_hashes)
         try:
-            # Save the file in the files directory.
-            file_name = file_info['name']
-            file_hash = hashlib.md5(u' ' .join([tag.decode(self._encoding) 
-                                              for tag in file_info['tags']]) 
-                                    + file_name.decode(self._encoding)).hexdigest()
-            file_path = os.path.join(self._files_dir, os.path.sep.join(file_hash[0:5]), file_name)
-            if not os.path.isdir(os.path.dirname(file_path)):
-                os.makedirs(os.path.dirname(file_path))
-            with open(file_path, 'w') as file:
-                file.write(file_data)
-                
-            mod_time =''
-            if not time in file_info:
-                mod_time = str(self._time_provider.get_time()).decode(self._encoding)
-            else:
-                mod_time = file_info['time'].decode(self._encoding)
-    
-            # Add the metadata of the file to the index.
-            file_path = file_path[len(self._files_dir) + 1:]
-            writer = self._index.writer()
-            writer.delete_by_term('hash', file_hash.decode(self._encoding))
-            writer.add_document(
-                hash=file_hash.decode(self._encoding),
-                tags=u' '.join([tag.decode(self._encoding) for tag in file_info['tags']]),
-                description=file_info['description'].decode(self._encoding),
-                name=file_info['name'].decode(self._encoding),
-                size=file_info['size'].decode(self._encoding),
-                owner=file_info['owner'].decode(self._encoding),
-                group=file_info['group'].decode(self._encoding),
-                perms=file_info['perms'].decode(self._encoding),
-                path=file_path.decode(self._encoding),
-                type=magic.whatis(file_data),
-                time=mod_time,
-                action=u'add'                
-            )               
-            writer.commit()
-    
-            # Update the empty space of this server.
-            self._status['empty_space'] -= long(file_info['size'])
+            ops = []
+            batch = {}
+            for (_, file_info), blob_writer in zip(files, blob_writers):
+                op = self._add_file_op(file_info, blob_writer.digest(),
+                                       magic.whatis(blob_writer.header), batch)
+                batch[op['hash']] = op['fields']
+                ops.append(op)
+            self._submit(ops)
         finally:
             if not safe:
-                self._mrsw_lock.write_out()
-        
+                self._file_locks.release_many(file_hashes)
+        return self.capacity()
+
+    def _add_file_op(self, file_info, blob, file_type, batch=None):
+        """
+        Construye la modificación del índice que añade los metadatos de un
+        archivo cuyo contenido ya está en el almacén de contenidos de este
+        servidor y protegido con el método C{pin} del almacén. Si existía un
+        archivo con el mismo hash, su contenido se elimina del almacén cuando
+        ningún otro archivo lo comparta.
+
+        @type file_info: C{dict}
+        @param file_info: Diccionario con los metadatos del archivo.
+
+        @type blob: C{str}
+        @param blob: Hash del contenido del archivo en el almacén.
+
+        @type file_type: C{str}
+        @param file_type: Tipo del contenido del archivo.
+
+        @type batch: C{dict}
+        @param batch: Diccionario con los documentos de las modificaciones
+            que se construyeron antes que esta y se registrarán junto con
+            ella, indexado por el hash de cada documento.
+
+        @rtype: C{dict}
+        @return: Modificación del índice, según se describe en la clase
+            C{IndexCommitter}.
+        """
+        file_hash = self._file_hash(file_info)
+        if 'time' not in file_info:
+            mod_time = str(self._time_provider.get_time()).decode(self._encoding)
+        else:
+            mod_time = file_info['time'].decode(self._encoding)
+
+        # Add the metadata of the file to the index. The previous content
+        # of the file may be no longer referenced once this is committed.
+        if batch and file_hash in batch:
+            old_doc = batch[file_hash]
+        else:
+            old_doc = self._document(file_hash)
+        fields = dict(
+            hash=file_hash.decode(self._encoding),
+            tags=u' '.join([tag.decode(self._encoding) for tag in file_info['tags']]),
+            description=file_info['description'].decode(self._encoding),
+            name=file_info['name'].decode(self._encoding),
+            size=file_info['size'].decode(self._encoding),
+            owner=file_info['owner'].decode(self._encoding),
+            group=file_info['group'].decode(self._encoding),
+            perms=file_info['perms'].decode(self._encoding),
+            blob=blob.decode(self._encoding),
+            type=file_type,
+            time=mod_time,
+            action=u'add',
+            fragment=self._fragment_field(file_info.get('fragment')),
+            replicas=(file_info.get('replicas') or '').decode(self._encoding),
+        )
+        release = None
+        if old_doc is not None and old_doc['action'] != 'delete':
+            release = old_doc['blob']
+        return {'hash': fields['hash'], 'fields': fields,
+                'pin': fields['blob'], 'release': release}
+
+    def _fragment_field(self, fragment):
+        """
+        Construye el valor del campo C{fragment} del índice a partir del
+        diccionario que describe un fragmento.
+
+        @type fragment: C{dict}
+        @param fragment: Diccionario con el número C{index} del fragmento,
+            las cantidades C{data} y C{parity} de fragmentos de datos y de
+            paridad, y el identificador C{version} de la versión del
+            archivo a la que pertenece el fragmento. Es C{None} si se
+            almacena el archivo completo.
+
+        @rtype: C{unicode}
+        @return: Valor del campo, una cadena vacía si se almacena el archivo
+            completo.
+        """
+        if fragment is None:
+            return u''
+        return u'{0} {1} {2} {3}'.format(fragment['index'], fragment['data'],
+                                         fragment['parity'], fragment['version'])
+
+    def _fragment(self, doc):
+        """
+        Construye el diccionario que describe el fragmento almacenado en un
+        documento del índice.
+
+        @type doc: C{dict}
+        @param doc: Campos almacenados del documento.
+
+        @rtype: C{dict}
+        @return: Diccionario descrito en el método C{_fragment_field}, C{None}
+            si el documento corresponde a un archivo completo.
+        """
+        if not doc.get('fragment'):
+            return None
+        index, data, parity, version = doc['fragment'].split()
+        return {'index': int(index), 'data': int(data),
+                'parity': int(parity), 'version': version.encode(self._encoding)}
+
+    def _remove_file_op(self, file_hash, batch=None, time=None, renamed=None):
+        """
+        Construye la modificación del índice que elimina un archivo. El
+        contenido del archivo se elimina del almacén cuando se aplique la
+        modificación si ningún otro archivo lo comparte.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo que se quiere eliminar.
+
+        @type batch: C{dict}
+        @param batch: Diccionario con los documentos de las modificaciones
+            que se construyeron antes que esta y se registrarán junto con
+            ella, indexado por el hash de cada documento.
+
+        @type time: C{float}
+        @param time: Identificador de tiempo de la eliminación. Si no se
+            especifica se utiliza el tiempo actual.
+
+        @type renamed: C{str}
+        @param renamed: Nuevo hash del archivo si se elimina al cambiar su
+            nombre o sus etiquetas, C{None} en caso contrario.
+
+        @rtype: C{dict}
+        @return: Modificación del índice, según se describe en la clase
+            C{IndexCommitter}, o C{None} si este servidor no tiene almacenado
+            un archivo identificado por el hash dado.
+        """
+        if batch and file_hash in batch:
+            doc = batch[file_hash]
+        else:
+            doc = self._document(file_hash)
+        if doc is not None and doc['action'] != 'delete':
+            if time is None:
+                time = self._time_provider.get_time()
+            fields = dict(
+                hash=file_hash.decode(self._encoding),
+                time=str(time).decode(self._encoding),
+                action=u'delete',
+                renamed=(renamed or '').decode(self._encoding),
+            )
+            return {'hash': fields['hash'], 'fields': fields,
+                    'pin': None, 'release': doc['blob']}
+        else:
+            return None
+
+    def _release_blob(self, blob):
+        """
+        Elimina un contenido del almacén de este servidor si ningún archivo
+        del índice hace referencia a él. Los contenidos referenciados por
+        modificaciones que aún no se han aplicado al índice están protegidos
+        y no se eliminan.
+
+        @type blob: C{unicode}
+        @param blob: Hash del contenido en el almacén.
+        """
+        with self._searchers.searcher() as searcher:
+            referenced = searcher.document_number(blob=blob) is not None
+        if not referenced:
+            self._blobs.remove(blob)
+
     def remove(self, file_hash, safe=False):
         """
         Elimina un archivo almacenado en este servidor. Si este servidor
@@ -415,30 +1790,116 @@ class RemoteTagFSServer(object):
             defecto
         """
         if not safe:
-            self._mrsw_lock.write_in()
+            self._file_locks.acquire(file_hash)
         try:
-            searcher = self._index.searcher()
-            doc = searcher.document(hash=file_hash.decode(self._encoding))
-            if doc is not None and doc['action'] != 'delete':                
-                # Remove the file from the files directory.
-                os.remove(os.path.join(self._files_dir, doc['path']))
-                
-                # Remove the metadata of the file from the index.
-                writer = self._index.writer()
-                writer.delete_by_term('hash', file_hash.decode(self._encoding))
-                writer.add_document(
-                    hash=file_hash.decode(self._encoding),
-                    time=self._time_provider.get_time(),
-                    action=u'delete'                
-                )
-                writer.commit()
-
-                # Update the empty space in this server.
-                self._status['empty_space'] += long(doc['size'])
+            op = self._remove_file_op(file_hash)
+            if op is not None:
+                self._submit([op])
         finally:
             if not safe:
-                self._mrsw_lock.write_out()
-        
+                self._file_locks.release(file_hash)
+
+    def remove_many(self, file_hashes, safe=False):
+        """
+        Elimina varios archivos almacenados en este servidor. Las
+        modificaciones del índice de todos los archivos se registran de una
+        vez. Los hashes de archivos que este servidor no tiene almacenados
+        se ignoran.
+
+        @type file_hashes: C{list}
+        @param file_hashes: Lista con los identificadores de los archivos
+            que se quieren eliminar.
+
+        @type safe: C{bool}
+        @param safe: Expresa si la ejecución es "thread safe" o si el
+            método se tiene que encargar de la sincronización. Es falso por
+            defecto
+        """
+        if not safe:
+            self._file_locks.acquire_many(file_hashes)
+        try:
+            ops = []
+            batch = {}
+            for file_hash in file_hashes:
+                op = self._remove_file_op(file_hash, batch)
+                if op is not None:
+                    batch[file_hash] = op['fields']
+                    ops.append(op)
+            if ops:
+                self._submit(ops)
+        finally:
+            if not safe:
+                self._file_locks.release_many(file_hashes)
+
+    def update_metadata(self, file_hash, name, tags, description, safe=False):
+        """
+        Cambia el nombre, las etiquetas y la descripción de un archivo
+        almacenado en este servidor sin transferir su contenido. Como el
+        hash del archivo depende de su nombre y sus etiquetas, se añade un
+        documento al índice con el nuevo hash que referencia el mismo
+        contenido del almacén y se elimina el documento anterior. Ambas
+        modificaciones del índice se registran de una vez. El documento que
+        indica la eliminación registra el nuevo hash, que los servidores que
+        no recibieron la llamada obtienen con el método C{renamed} durante
+        la sincronización.
+
+        @type file_hash: C{str}
+        @param file_hash: Identificador del archivo que se quiere modificar.
+
+        @type name: C{str}
+        @param name: Nuevo nombre del archivo.
+
+        @type tags: C{set}
+        @param tags: Nuevo conjunto de etiquetas del archivo.
+
+        @type description: C{str}
+        @param description: Nueva descripción del archivo.
+
+        @type safe: C{bool}
+        @param safe: Expresa si la ejecución es "thread safe" o si el
+            método se tiene que encargar de la sincronización. Es falso por
+            defecto
+
+        @rtype: C{str}
+        @return: Nuevo hash del archivo, C{None} si este servidor no tiene
+            almacenado un archivo identificado por el hash dado.
+        """
+        new_hash = self._file_hash({'tags': tags, 'name': name})
+        file_hashes = [file_hash, new_hash]
+        if not safe:
+            self._file_locks.acquire_many(file_hashes)
+        try:
+            doc = self._document(file_hash)
+            if (doc is None or doc['action'] == 'delete' or
+                not self._blobs.pin(doc['blob'])):
+                return None
+            file_info = dict(
+                tags=tags,
+                name=name,
+                description=description,
+                size=doc['size'].encode(self._encoding),
+                owner=doc['owner'].encode(self._encoding),
+                group=doc['group'].encode(self._encoding),
+                perms=doc['perms'].encode(self._encoding),
+                fragment=self._fragment(doc),
+                replicas=(doc.get('replicas') or u'').encode(self._encoding),
+            )
+            ops = []
+            batch = {}
+            if new_hash != file_hash:
+                # The new hash is recorded, so the servers that apply the
+                # removal during the synchronization keep the file.
+                op = self._remove_file_op(file_hash, renamed=new_hash)
+                batch[file_hash] = op['fields']
+                ops.append(op)
+            ops.append(self._add_file_op(file_info, doc['blob'].encode(self._encoding),
+                                         doc['type'], batch))
+            self._submit(ops)
+            return new_hash
+        finally:
+            if not safe:
+                self._file_locks.release_many(file_hashes)
+
     def list(self, tags):
         """
         Lista los archivos almacenados en este servidor que tienen todos
@@ -451,14 +1912,11 @@ class RemoteTagFSServer(object):
         @return: Conjunto con los hash de los archivos que tienen los tags 
             especificados mediante el conjunto C{tags}.
         """
-        self._mrsw_lock.read_in()
-        try:
-            searcher = self._index.searcher()
-            tags_terms = [tag.decode(self._encoding).lower() for tag in tags]
-            query = whoosh.query.And([whoosh.query.Term('tags', term) for term in tags_terms])
+        self._committer.flush()
+        tags_terms = [tag.decode(self._encoding).lower() for tag in tags]
+        query = whoosh.query.And([whoosh.query.Term('tags', term) for term in tags_terms])
+        with self._searchers.searcher() as searcher:
             return set([result['hash'] for result in searcher.search(query)])
-        finally:
-            self._mrsw_lock.read_out()
 
     def search(self, text):
         """
@@ -472,17 +1930,14 @@ class RemoteTagFSServer(object):
         @return: Conjunto con los hash de los archivos que son relevantes 
             para la búsqueda de texto libre C{text}.
         """
-        self._mrsw_lock.read_in()
-        try:
-            searcher = self._index.searcher()
-            default_fields = ['tags', 'description', 'name']
-            parser = whoosh.qparser.MultifieldParser(default_fields, schema=self._index_schema)
-            query = parser.parse(text.decode(self._encoding))
+        self._committer.flush()
+        default_fields = ['tags', 'description', 'name']
+        parser = whoosh.qparser.MultifieldParser(default_fields, schema=self._index_schema)
+        query = parser.parse(text.decode(self._encoding))
+        with self._searchers.searcher() as searcher:
             return set([result['hash'] for result in searcher.search(query)])
-        finally:
-            self._mrsw_lock.read_out()
                                    
-    def info(self, file_hash, safe=False):
+    def info(self, file_hash):
         """
         Obtiene información a partir del hash de un archivo.
         
@@ -496,35 +1951,60 @@ class RemoteTagFSServer(object):
         @return: Diccionario con los metadatos del archivo si este servidor
             tiene almacenado un archivo identificado por el hash dado,
             C{None} en caso contrario.
-        
-        @type safe: C{bool}
-        @param safe: Expresa si la ejecución es "thread safe" o si el 
-            método se tiene que encargar de la sincronización. Es falso por
-            defecto
         """
-        if not safe:
-            self._mrsw_lock.read_in()
-        try:
-            searcher = self._index.searcher()
-            doc = searcher.document(hash=file_hash.decode(self._encoding))
-            if doc is not None and doc['action'] != 'delete':
-                info = {}
-                info['hash'] = doc['hash']
-                info['tags'] = set(doc['tags'].split())
-                info['description'] = doc['description']
-                info['name'] = doc['name']
-                info['size'] = doc['size']
-                info['type'] = doc['type']
-                info['owner'] = doc['owner']
-                info['group'] = doc['group']
-                info['perms'] = doc['perms']
-                info['time']=doc['time']
-                return info
-            else:
-                return None
-        finally:
-            if not safe:
-                self._mrsw_lock.read_out()        
+        return self._info(self._document(file_hash))
+
+    def info_many(self, file_hashes):
+        """
+        Obtiene información de varios archivos con una única llamada.
+
+        @type file_hashes: C{list}
+        @param file_hashes: Lista con los identificadores de los archivos
+            cuya información se quiere obtener.
+
+        @rtype: C{dict}
+        @return: Diccionario indexado por el hash de cada archivo con el
+            diccionario que retornaría el método C{info}. Los archivos que
+            este servidor no tiene almacenados no se incluyen.
+        """
+        infos = {}
+        with self._searchers.searcher() as searcher:
+            for file_hash in file_hashes:
+                info = self._info(self._document(file_hash, searcher))
+                if info is not None:
+                    infos[file_hash] = info
+        return infos
+
+    def _info(self, doc):
+        """
+        Construye el diccionario con los metadatos de un archivo a partir
+        de los campos almacenados de su documento del índice.
+
+        @type doc: C{dict}
+        @param doc: Campos almacenados del documento o C{None}.
+
+        @rtype: C{dict}
+        @return: Diccionario con los metadatos del archivo, C{None} si
+            el documento no existe o corresponde a un archivo eliminado.
+        """
+        if doc is not None and doc['action'] != 'delete':
+            info = {}
+            info['hash'] = doc['hash']
+            info['tags'] = set(doc['tags'].split())
+            info['description'] = doc['description']
+            info['name'] = doc['name']
+            info['size'] = doc['size']
+            info['type'] = doc['type']
+            info['blob'] = doc['blob']
+            info['owner'] = doc['owner']
+            info['group'] = doc['group']
+            info['perms'] = doc['perms']
+            info['time']=doc['time']
+            info['fragment'] = self._fragment(doc)
+            info['replicas'] = doc.get('replicas') or u''
+            return info
+        else:
+            return None
             
     def get_all_tags(self):
         """
@@ -534,15 +2014,15 @@ class RemoteTagFSServer(object):
         @rtype: C{set}
         @return: Conjunto con las etiquetas en este servidor.
         """
-        reader = self._index.reader()
-        searcher = self._index.searcher()
+        self._committer.flush()
         tags = set()
-        for tag in reader.lexicon('tags'):
-            # Ugly hack! Returns tags that were removed from the index?!
-            query = whoosh.query.Term('tags', tag)
-            results = searcher.search(query, limit=1)
-            if len(results) > 0:
-                tags.add(tag)
+        with self._searchers.searcher() as searcher:
+            for tag in list(searcher.reader().lexicon('tags')):
+                # Ugly hack! Returns tags that were removed from the index?!
+                query = whoosh.query.Term('tags', tag)
+                results = searcher.search(query, limit=1)
+                if len(results) > 0:
+                    tags.add(tag)
         return tags
     
     def get_popular_tags(self, number):
@@ -556,8 +2036,9 @@ class RemoteTagFSServer(object):
         @rtype: C{set}
         @return: Conjunto de tuplas de la forma (frecuencia, tag) 
         """        
-        reader = self._index.reader()
-        return set(reader.most_distinctive_terms('tags', number, u''))
+        self._committer.flush()
+        with self._searchers.searcher() as searcher:
+            return set(searcher.reader().most_distinctive_terms('tags', number, u''))
         
     def terminate(self):
         """
@@ -570,4 +2051,13 @@ class RemoteTagFSServer(object):
         self._sync_cond.notify()
         self._sync_cond.release()
         self._sync_thread.join()
+        self._repair_continue = False
+        self._request_repair()
+        self._repair_thread.join()
+        self._sync_pool.close()
+        for upload_id in self._uploads.keys():
+            self.abort_upload(upload_id)
+        self._data_channel.close()
+        self._committer.close()
+        self._searchers.close()
         self._index.close()
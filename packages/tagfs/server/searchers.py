@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""
+Reutilización de las instancias utilizadas para buscar en el índice de un
+servidor TagFS.
+"""
+
+import threading
+import contextlib
+
+
+# Maximum number of idle searchers kept for the current generation.
+MAX_IDLE_SEARCHERS = 8
+
+
+class SearcherPool(object):
+    """
+    Mantiene abiertas las instancias de C{whoosh.searching.Searcher} del
+    índice de un servidor para reutilizarlas entre las distintas llamadas,
+    evitando abrir los segmentos del índice en cada llamada.
+
+    Una instancia de C{Searcher} no se puede utilizar desde varios hilos a la
+    vez, por lo que cada hilo obtiene una instancia para su uso exclusivo y
+    la devuelve al terminar. Las instancias se asocian a la generación del
+    índice en que se crearon: cuando se aplica un nuevo C{commit} al índice
+    las instancias de generaciones anteriores se cierran en cuanto dejan de
+    utilizarse.
+
+    Whoosh elimina los ficheros de las generaciones anteriores del índice
+    en cada C{commit}, aunque una instancia de C{Searcher} los esté
+    utilizando. Al crear una instancia de esta clase se desactiva esta
+    eliminación y los ficheros se eliminan al llamar al método C{clean}
+    cuando ninguna instancia de una generación anterior está en uso.
+    """
+
+    def __init__(self, index):
+        """
+        Inicializa una instancia de la clase C{SearcherPool}.
+
+        @type index: C{whoosh.index.Index}
+        @param index: Índice en el que se busca. Todas las modificaciones
+            del índice se tienen que aplicar a esta instancia para que se
+            detecten los cambios de generación.
+        """
+        self._index = index
+        self._mutex = threading.Lock()
+        self._generation = index.generation
+        self._idle = []
+        self._generations = {}
+        # This relies on the internals of the Whoosh version bundled in
+        # contrib (0.3.18): FileIndex.commit calls the private method
+        # _clean_files to remove the files of the previous generations.
+        # Check it again when Whoosh is upgraded.
+        self._clean_files = index._clean_files
+        index._clean_files = lambda: None
+
+    def acquire(self):
+        """
+        Obtiene una instancia para buscar en la última generación del
+        índice. La instancia se tiene que devolver con el método C{release}.
+
+        @rtype: C{whoosh.searching.Searcher}
+        @return: Instancia para buscar en el índice.
+        """
+        with self._mutex:
+            self._refresh()
+            if self._idle:
+                return self._idle.pop()
+            # The generation is read before opening the searcher, so a
+            # searcher is never associated to a generation newer than its
+            # segments. The searcher is opened holding the mutex so the
+            # files it opens are not removed by the method clean.
+            generation = self._generation
+            searcher = self._index.searcher()
+            self._generations[searcher] = generation
+            return searcher
+
+    def release(self, searcher):
+        """
+        Devuelve una instancia obtenida con el método C{acquire}. La
+        instancia se cierra si corresponde a una generación anterior del
+        índice.
+
+        @type searcher: C{whoosh.searching.Searcher}
+        @param searcher: Instancia que se devuelve.
+        """
+        with self._mutex:
+            self._refresh()
+            if (self._generations[searcher] == self._generation and
+                len(self._idle) < MAX_IDLE_SEARCHERS):
+                self._idle.append(searcher)
+                return
+            del self._generations[searcher]
+        searcher.close()
+
+    @contextlib.contextmanager
+    def searcher(self):
+        """
+        Obtiene una instancia para buscar en la última generación del índice
+        durante la ejecución de un bloque C{with}.
+        """
+        searcher = self.acquire()
+        try:
+            yield searcher
+        finally:
+            self.release(searcher)
+
+    def _refresh(self):
+        """
+        Cierra las instancias sin utilizar si cambió la generación del
+        índice. Se tiene que llamar con el mutex adquirido.
+        """
+        if self._index.generation != self._generation:
+            self._generation = self._index.generation
+            for searcher in self._idle:
+                del self._generations[searcher]
+                searcher.close()
+            self._idle = []
+
+    def clean(self):
+        """
+        Elimina los ficheros de las generaciones anteriores del índice si
+        ninguna instancia de estas generaciones está en uso. No se debe
+        llamar a este método mientras se aplica un C{commit} al índice.
+        """
+        with self._mutex:
+            self._refresh()
+            for generation in self._generations.itervalues():
+                if generation != self._generation:
+                    return
+            self._clean_files()
+
+    def close(self):
+        """
+        Cierra las instancias sin utilizar y elimina los ficheros de las
+        generaciones anteriores del índice. No se debe llamar a ningún otro
+        método después de este.
+        """
+        with self._mutex:
+            for searcher in self._idle:
+                del self._generations[searcher]
+                searcher.close()
+            self._idle = []
+        self.clean()
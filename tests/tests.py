@@ -12,6 +12,8 @@ import hashlib
 import unittest
 import threading
 import shutil
+import json
+import itertools
 
 # Add to the Python path the directory containing the packages in the source distribution. 
 SRC_DIR = os.path.join(os.path.dirname(__file__), os.pardir)
@@ -22,7 +24,18 @@ sys.path.insert(0, PACKAGES_DIR)
 CONTRIB_DIR = os.path.abspath(os.path.join(PACKAGES_DIR, 'tagfs', 'contrib'))
 sys.path.insert(0, CONTRIB_DIR)
 
+import whoosh.index
+import whoosh.fields
+
+from tagfs.common import get_file_hash
+from tagfs.common.erasure import ReedSolomon
+from tagfs.common.bloom import BloomFilter, CountingBloomFilter
+from tagfs.common.ring import HashRing
 from tagfs.client import TagFSClient
+from tagfs.client.asynchronous import AsyncTagFSClient
+from tagfs.server.committer import IndexCommitter
+from tagfs.server import merkle
+from tagfs.server.forwarder import UploadForwarder
 
 
 TESTS_DIR = os.path.abspath(os.path.join(SRC_DIR, 'tests'))
@@ -106,6 +119,75 @@ class TagFS(unittest.TestCase):
         self.assertEqual(hashlib.md5(original_data).digest(), 
                          hashlib.md5(tagfs_data).digest())
         
+    def testGetAfterPut(self):
+        original_data = open(os.path.join(FILES_DIR, 'UbuntuLogo.png')).read()
+        client = random.choice(self._clients)
+        tags = set(['ubuntu', 'logo'])
+        self.assertTrue(client.put('UbuntuLogo.png', 'The Ubuntu logo.', tags,
+                                   'tagfs', 'tagfs', 644, original_data, 100))
+        tagfs_data = client.get(get_file_hash(tags, 'UbuntuLogo.png'))
+        self.assertEqual(hashlib.md5(original_data).digest(),
+                         hashlib.md5(tagfs_data).digest())
+
+    def testPutChained(self):
+        original_data = open(os.path.join(FILES_DIR, 'UbuntuIsHumanity.ogv')).read()
+        client = random.choice(self._clients)
+        self.assertTrue(client.put('UbuntuIsHumanity.ogv',  'Ubuntu is Humanity video.',
+                                   set(['ubuntu', 'video']), 'tagfs', 'tagfs', 644,
+                                   original_data, 100, chained=True))
+        hash = client.list(set(['video'])).pop()
+        self.assertEqual(hashlib.md5(original_data).digest(),
+                         hashlib.md5(client.get(hash)).digest())
+
+    def testGetChunks(self):
+        original_data = open(os.path.join(FILES_DIR, 'UbuntuIsHumanity.ogv')).read()
+        client = random.choice(self._clients)
+        client.put('UbuntuIsHumanity.ogv',  'Ubuntu is Humanity video.',
+                   set(['ubuntu', 'gnu', 'linux', 'humanity', 'video']), 'tagfs', 'tagfs',
+                   644, open(os.path.join(FILES_DIR, 'UbuntuIsHumanity.ogv')), 100)
+        hash = client.list(set(['video'])).pop()
+        chunks = list(client.get_chunks(hash))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(hashlib.md5(original_data).digest(),
+                         hashlib.md5(''.join(chunks)).digest())
+
+    def testGetCompressed(self):
+        original_data = 'The Ubuntu logo.\n' * 200000
+        client = random.choice(self._clients)
+        client.put('UbuntuLogo.txt',  'The Ubuntu logo.',
+                   set(['ubuntu', 'text']), 'tagfs', 'tagfs', 644, original_data, 100)
+        hash = client.list(set(['text'])).pop()
+        self.assertEqual(hashlib.md5(original_data).digest(),
+                         hashlib.md5(client.get(hash)).digest())
+        self.assertEqual(hashlib.md5(original_data).digest(),
+                         hashlib.md5(''.join(client.get_chunks(hash))).digest())
+
+    def testGetHedged(self):
+        original_data = open(os.path.join(FILES_DIR, 'UbuntuIsHumanity.ogv')).read()
+        client = random.choice(self._clients)
+        client.put('UbuntuIsHumanity.ogv',  'Ubuntu is Humanity video.',
+                   set(['ubuntu', 'video']), 'tagfs', 'tagfs', 644, original_data, 100)
+        hash = client.list(set(['video'])).pop()
+        for _ in xrange(3):
+            self.assertEqual(hashlib.md5(original_data).digest(),
+                             hashlib.md5(client.get(hash, hedged=True)).digest())
+        self.assertEqual(client.get('0' * 32, hedged=True), None)
+
+    def testAsync(self):
+        client = AsyncTagFSClient(random.choice(self._clients))
+        logo_data = open(os.path.join(FILES_DIR, 'UbuntuLogo.png')).read()
+        puts = [client.put('UbuntuLogo{0}.png'.format(index), 'The Ubuntu logo.',
+                           set(['ubuntu', 'logo']), 'tagfs', 'tagfs', 644, logo_data, 100)
+                for index in xrange(10)]
+        self.assertEquals([put.result() for put in puts], [True] * len(puts))
+        results = client.list(set(['logo'])).result()
+        self.assertEquals(len(results), len(puts))
+        gets = [client.get(hash) for hash in results]
+        for get in gets:
+            self.assertEqual(hashlib.md5(logo_data).digest(),
+                             hashlib.md5(get.result()).digest())
+        client.close()
+
     def testRemove(self):
         client = random.choice(self._clients)
         client.put('UbuntuLogo.png',  'The Ubuntu logo.', 
@@ -116,6 +198,20 @@ class TagFS(unittest.TestCase):
         client.remove(results.pop())
         self.assertEquals(len(results), 0)
         
+    def testUpdateMetadata(self):
+        original_data = open(os.path.join(FILES_DIR, 'UbuntuLogo.png')).read()
+        client = random.choice(self._clients)
+        client.put('UbuntuLogo.png',  'The Ubuntu logo.',
+                   set(['ubuntu', 'logo']), 'tagfs', 'tagfs', 644, original_data, 100)
+        hash = client.list(set(['logo'])).pop()
+        new_hash = client.update_metadata(hash, 'Logo.png', set(['ubuntu', 'image']),
+                                          'The logo.')
+        self.assertEquals(len(client.list(set(['logo']))), 0)
+        self.assertEquals(client.list(set(['image'])), set([new_hash]))
+        self.assertEquals(client.info(new_hash)['name'], 'Logo.png')
+        self.assertEqual(hashlib.md5(original_data).digest(),
+                         hashlib.md5(client.get(new_hash)).digest())
+
     def testList(self):
         client = random.choice(self._clients)
         client.put('UbuntuLogo.png',  'The Ubuntu logo.', 
@@ -161,7 +257,42 @@ class TagFS(unittest.TestCase):
         self.assertEquals(info['owner'], owner)
         self.assertEquals(info['group'], group)
         self.assertEquals(int(info['perms']), perms)
-    
+
+    def testInfoCached(self):
+        client = random.choice(self._clients)
+        tags = set(['ubuntu', 'gnu', 'linux', 'logo'])
+        client.put('UbuntuLogo.png', 'The Ubuntu logo.', tags, 'tagfs', 'tagfs', 644,
+                   open(os.path.join(FILES_DIR, 'UbuntuLogo.png')).read(), 20)
+        hash = client.list(set(['ubuntu'])).pop()
+        info = client.info(hash)
+        info['tags'].add('changed')
+        self.assertEquals(client.info(hash)['tags'], tags)
+        self.assertEquals(client.info_many([hash])[hash]['tags'], tags)
+
+    def testPutMany(self):
+        client = random.choice(self._clients)
+        logo_data = open(os.path.join(FILES_DIR, 'UbuntuLogo.png')).read()
+        files = [('UbuntuLogo{0}.png'.format(index), 'The Ubuntu logo.',
+                  set(['ubuntu', 'logo']), 'tagfs', 'tagfs', 644, logo_data)
+                 for index in xrange(10)]
+        self.assertEquals(client.put_many(files, 100), [True] * len(files))
+        results = client.list(set(['logo']))
+        infos = client.info_many(results)
+        self.assertEquals(set([info['name'] for info in infos.values()]),
+                          set([name for name, _, _, _, _, _, _ in files]))
+        client.remove_many(results)
+        self.assertEquals(len(client.list(set(['logo']))), 0)
+
+    def testPutCoded(self):
+        original_data = open(os.path.join(FILES_DIR, 'UbuntuIsHumanity.ogv')).read()
+        client = random.choice(self._clients)
+        self.assertTrue(client.put_coded('UbuntuIsHumanity.ogv', 'Ubuntu is Humanity video.',
+                                         set(['ubuntu', 'video']), 'tagfs', 'tagfs', 644,
+                                         original_data, 3, 2))
+        hash = client.list(set(['video'])).pop()
+        self.assertEqual(hashlib.md5(original_data).digest(),
+                         hashlib.md5(client.get(hash)).digest())
+
     def testGetAllTags(self):
         client = random.choice(self._clients)
         logo_tags = set(['ubuntu', 'gnu', 'linux', 'logo'])
@@ -187,6 +318,347 @@ class TagFS(unittest.TestCase):
         self.assertEquals(popular_tags, set(['ubuntu', 'logo', 'linux']))
 
 
+class ReedSolomonTest(unittest.TestCase):
+    """
+    Pruebas por unidades del código de borrado Reed-Solomon.
+    """
+
+    def setUp(self):
+        self._code = ReedSolomon(4, 2)
+        self._stripe = ''.join(chr((index * 7 + 3) % 256) for index in xrange(1000))
+
+    def testEncode(self):
+        pieces = self._code.encode(self._stripe)
+        self.assertEquals(len(pieces), 6)
+        self.assertEquals(set(len(piece) for piece in pieces), set([250]))
+        self.assertEquals(''.join(pieces[:4]), self._stripe)
+
+    def testDecodeErasures(self):
+        pieces = self._code.encode(self._stripe)
+        for indexes in itertools.combinations(xrange(6), 4):
+            available = dict((index, pieces[index]) for index in indexes)
+            self.assertEquals(self._code.decode(available, len(self._stripe)), self._stripe)
+
+    def testDecodePadded(self):
+        stripe = self._stripe[:998]
+        pieces = self._code.encode(stripe)
+        self.assertEquals(self._code.piece_size(len(stripe)), 250)
+        available = {1: pieces[1], 3: pieces[3], 4: pieces[4], 5: pieces[5]}
+        self.assertEquals(self._code.decode(available, len(stripe)), stripe)
+
+    def testNotEnoughFragments(self):
+        pieces = self._code.encode(self._stripe)
+        available = {0: pieces[0], 2: pieces[2], 5: pieces[5]}
+        self.assertRaises(ValueError, self._code.decode, available, len(self._stripe))
+
+    def testInvalidFragments(self):
+        self.assertRaises(ValueError, ReedSolomon, 0, 2)
+        self.assertRaises(ValueError, ReedSolomon, 200, 100)
+
+
+class MerkleTreeTest(unittest.TestCase):
+    """
+    Pruebas por unidades del árbol de Merkle de los servidores.
+    """
+
+    def _root(self, tree):
+        return tree.digests(['']).values()[0]
+
+    def testEmpty(self):
+        tree = merkle.MerkleTree()
+        self.assertEquals(tree.digests(['ab']), {'ab': '0' * 32})
+        self.assertEquals(tree.digests(['a'])['a'],
+                          hashlib.md5(''.join('0' * 32 for _ in xrange(16))).hexdigest())
+
+    def testOrderIndependent(self):
+        first, second = merkle.MerkleTree(), merkle.MerkleTree()
+        actions = [('ab01', 'add', 1.0), ('ab02', 'add', 2.0), ('cd03', 'delete', 3.0)]
+        for action in actions:
+            first.update(*action)
+        for action in reversed(actions):
+            second.update(*action)
+        self.assertEquals(first.digests(merkle.prefixes()), second.digests(merkle.prefixes()))
+
+    def testUpdate(self):
+        tree = merkle.MerkleTree()
+        tree.update('ab01', 'add', 1.0)
+        tree.update('cd02', 'add', 2.0)
+        before = tree.digests(merkle.prefixes())
+        tree.update('ab01', 'delete', 3.0)
+        after = tree.digests(merkle.prefixes())
+        changed = set(prefix for prefix in before if before[prefix] != after[prefix])
+        self.assertEquals(changed, set(['', 'a', 'ab']))
+        self.assertFalse(tree.is_live('ab01'))
+        self.assertTrue(tree.is_live('cd02'))
+        self.assertEquals(tree.tombstones(), {'ab01': 3.0})
+        self.assertEquals(tree.hashes(set(['ab'])), ['ab01'])
+
+    def testDiscard(self):
+        tree = merkle.MerkleTree()
+        empty = self._root(tree)
+        tree.update('ab01', 'delete', 1.0)
+        self.assertNotEquals(self._root(tree), empty)
+        tree.discard('ab01')
+        self.assertEquals(self._root(tree), empty)
+        self.assertEquals(tree.tombstones(), {})
+        self.assertFalse(tree.is_live('ab01'))
+
+
+class HashRingTest(unittest.TestCase):
+    """
+    Pruebas por unidades del anillo de hash consistente.
+    """
+
+    def setUp(self):
+        self._keys = [hashlib.md5(str(index)).hexdigest() for index in xrange(1000)]
+
+    def _ring(self, nodes):
+        ring = HashRing()
+        for node in nodes:
+            ring.add(node)
+        return ring
+
+    def testNodes(self):
+        ring = self._ring(['a', 'b', 'c'])
+        for key in self._keys[:100]:
+            self.assertEquals(sorted(ring.nodes(key)), ['a', 'b', 'c'])
+            self.assertEquals(ring.nodes(key, 2), ring.nodes(key)[:2])
+        self.assertEquals(HashRing().nodes('key'), [])
+
+    def testDeterministic(self):
+        first = self._ring(['a', 'b', 'c'])
+        second = self._ring(['c', 'a', 'b'])
+        for key in self._keys:
+            self.assertEquals(first.nodes(key), second.nodes(key))
+
+    def testAddRemove(self):
+        ring = self._ring(['a', 'b', 'c'])
+        before = dict((key, ring.nodes(key, 1)[0]) for key in self._keys)
+        ring.add('d')
+        after = dict((key, ring.nodes(key, 1)[0]) for key in self._keys)
+        moved = [key for key in self._keys if before[key] != after[key]]
+        self.assertTrue(moved)
+        self.assertEquals(set(after[key] for key in moved), set(['d']))
+        ring.remove('d')
+        self.assertEquals(dict((key, ring.nodes(key, 1)[0]) for key in self._keys), before)
+
+    def testWeight(self):
+        ring = HashRing()
+        ring.add('a', 4.0)
+        ring.add('b')
+        primaries = [ring.nodes(key, 1)[0] for key in self._keys]
+        self.assertTrue(primaries.count('a') > 2 * primaries.count('b'))
+        self.assertEquals(len(ring), 2)
+
+
+class CountingBloomFilterTest(unittest.TestCase):
+    """
+    Pruebas por unidades de los filtros de Bloom de los archivos.
+    """
+
+    def _copy(self, counting):
+        epoch, seq, flips, data = counting.changes(None, 0)
+        return BloomFilter(data)
+
+    def testAddRemove(self):
+        counting = CountingBloomFilter()
+        keys = [hashlib.md5(str(index)).hexdigest() for index in xrange(100)]
+        for key in keys:
+            counting.add(key)
+        bloom = self._copy(counting)
+        self.assertTrue(all(key in bloom for key in keys))
+        self.assertFalse(hashlib.md5('other').hexdigest() in bloom)
+        for key in keys[50:]:
+            counting.remove(key)
+        bloom = self._copy(counting)
+        self.assertTrue(all(key in bloom for key in keys[:50]))
+        self.assertFalse(any(key in bloom for key in keys[50:]))
+
+    def testDuplicates(self):
+        counting = CountingBloomFilter()
+        counting.add('a')
+        counting.add('a')
+        counting.remove('a')
+        self.assertTrue('a' in self._copy(counting))
+        counting.remove('a')
+        self.assertFalse('a' in self._copy(counting))
+
+    def testChanges(self):
+        counting = CountingBloomFilter()
+        counting.add('a')
+        epoch, seq, flips, data = counting.changes(None, 0)
+        self.assertEquals(flips, None)
+        bloom = BloomFilter(data)
+        counting.add('b')
+        counting.remove('a')
+        epoch, seq, flips, data = counting.changes(epoch, seq)
+        self.assertEquals(data, None)
+        bloom.flip(flips)
+        self.assertEquals(str(bloom._bits), str(self._copy(counting)._bits))
+        self.assertTrue('b' in bloom)
+        self.assertFalse('a' in bloom)
+        # A sequence number of another epoch returns the whole filter.
+        self.assertEquals(CountingBloomFilter().changes(epoch, seq)[2], None)
+
+
+class IndexCommitterTest(unittest.TestCase):
+    """
+    Pruebas por unidades de la escritura en lotes del índice.
+    """
+
+    def setUp(self):
+        self._dir = os.path.join(TESTS_DIR, 'committer')
+        if os.path.isdir(self._dir):
+            shutil.rmtree(self._dir)
+        os.mkdir(self._dir)
+        schema = whoosh.fields.Schema(hash=whoosh.fields.ID(stored=True, unique=True),
+                                      name=whoosh.fields.STORED())
+        self._index = whoosh.index.create_in(self._dir, schema)
+        self._log_path = os.path.join(self._dir, 'index.log')
+        self._committed = []
+        self._discarded = []
+
+    def tearDown(self):
+        self._index.close()
+        shutil.rmtree(self._dir)
+
+    def _committer(self):
+        return IndexCommitter(self._index, self._log_path,
+                              self._committed.extend, self._discarded.extend)
+
+    def _op(self, file_hash, **fields):
+        fields['hash'] = file_hash
+        return {'hash': file_hash, 'fields': fields, 'pin': None, 'release': None}
+
+    def _names(self):
+        searcher = self._index.searcher()
+        try:
+            return dict((doc['hash'], doc['name'])
+                        for doc in searcher.reader().all_stored_fields())
+        finally:
+            searcher.close()
+
+    def testReplay(self):
+        with open(self._log_path, 'wb') as log:
+            log.write(json.dumps(self._op(u'a', name=u'first')) + '\n')
+            log.write(json.dumps(self._op(u'a', name=u'second')) + '\n')
+            log.write(json.dumps(self._op(u'b', name=u'other')) + '\n')
+            log.write('{"hash": "c", "fie')
+        committer = self._committer()
+        committer.close()
+        self.assertEquals(self._names(), {u'a': u'second', u'b': u'other'})
+        self.assertEquals(len(self._committed), 3)
+        self.assertEquals(os.path.getsize(self._log_path), 0)
+
+    def testPending(self):
+        committer = self._committer()
+        committer.submit([self._op(u'a', name=u'first')])
+        self.assertEquals(committer.pending(u'a'), (True, {'hash': u'a', 'name': u'first'}))
+        committer.flush()
+        self.assertEquals(committer.pending(u'a'), (False, None))
+        self.assertEquals(self._names(), {u'a': u'first'})
+        committer.close()
+
+    def testDiscardFailed(self):
+        committer = self._committer()
+        bad = self._op(u'b', name=u'bad', unknown=u'field')
+        committer.submit([self._op(u'a', name=u'good'), bad])
+        self.assertRaises(KeyError, committer.flush)
+        self.assertEquals(self._names(), {u'a': u'good'})
+        self.assertEquals(self._discarded, [bad])
+        committer.submit([self._op(u'c', name=u'later')])
+        committer.flush()
+        self.assertEquals(self._names(), {u'a': u'good', u'c': u'later'})
+        committer.close()
+        # The discarded operation is not applied again.
+        committer = self._committer()
+        committer.close()
+        self.assertEquals(self._discarded, [bad])
+
+
+class _ChainServer(object):
+    """
+    Servidor de prueba que registra las llamadas de un C{UploadForwarder}.
+    """
+
+    def __init__(self, fail_after=None, hang=None):
+        self.calls = []
+        self._fail_after = fail_after
+        self._hang = hang
+        self.sending = threading.Event()
+
+    def put_chunk(self, upload_id, chunk):
+        if self._fail_after is not None and len(self.calls) >= self._fail_after:
+            raise IOError('Server failed')
+        self.sending.set()
+        if self._hang is not None:
+            self._hang.wait()
+        time.sleep(0.01)
+        self.calls.append(('put_chunk', upload_id, chunk))
+
+    def commit_upload(self, upload_id):
+        self.calls.append(('commit_upload', upload_id))
+        return {'next': {'empty_space': 0}}
+
+    def abort_upload(self, upload_id):
+        self.calls.append(('abort_upload', upload_id))
+
+    def _release(self):
+        self.calls.append(('_release',))
+
+
+class UploadForwarderTest(unittest.TestCase):
+    """
+    Pruebas por unidades del reenvío de las transferencias en una cadena.
+    """
+
+    def testCommit(self):
+        server = _ChainServer()
+        forwarder = UploadForwarder(server, 'up', 2)
+        for index in xrange(4):
+            forwarder.send(str(index))
+        self.assertEquals(forwarder.commit(), {'next': {'empty_space': 0}})
+        self.assertEquals(server.calls,
+                          [('put_chunk', 'up', str(index)) for index in xrange(4)] +
+                          [('commit_upload', 'up'), ('_release',)])
+
+    def testFailure(self):
+        server = _ChainServer(fail_after=1)
+        forwarder = UploadForwarder(server, 'up')
+        for index in xrange(4):
+            forwarder.send(str(index))
+        self.assertEquals(forwarder.commit(), {})
+        self.assertEquals(server.calls, [('put_chunk', 'up', '0'), ('_release',),
+                                         ('abort_upload', 'up'), ('_release',)])
+
+    def _wait_calls(self, server, count):
+        deadline = time.time() + 5
+        while len(server.calls) < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def testAbort(self):
+        server = _ChainServer()
+        forwarder = UploadForwarder(server, 'up')
+        forwarder.abort()
+        self._wait_calls(server, 2)
+        self.assertEquals(server.calls, [('abort_upload', 'up'), ('_release',)])
+
+    def testAbortFullQueue(self):
+        hang = threading.Event()
+        server = _ChainServer(hang=hang)
+        forwarder = UploadForwarder(server, 'up', 1)
+        forwarder.send('0')
+        forwarder.send('1')
+        server.sending.wait(5)
+        start = time.time()
+        forwarder.abort()
+        self.assertTrue(time.time() - start < 1)
+        hang.set()
+        self._wait_calls(server, 3)
+        self.assertEquals(server.calls, [('put_chunk', 'up', '0'), ('abort_upload', 'up'),
+                                         ('_release',)])
+
+
 if __name__ == "__main__":
     module = os.path.basename(__file__)[:-3]
     suite = unittest.TestLoader().loadTestsFromName(module)